@@ -7,6 +7,71 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     MEDIA_DIR: str = "media"
+    MEDIA_STORAGE: str = "local"
+    # Cache-Control de media que não é content-addressed
+    MEDIA_MAX_AGE_SECONDS: int = 3600
+
+    # Fila de impressão de etiquetas (PDF + lp)
+    PRINT_COMMAND: str = "lp"
+    PRINT_SPOOL_DIR: str = "./app/tmp"
+    PRINT_WORKERS: int = 2
+    PRINT_MAX_ATTEMPTS: int = 5
+    PRINT_POLL_SECONDS: int = 5
+
+    # Idempotency-Key (POST /orders/, POST /payments/confirm)
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    IDEMPOTENCY_WAIT_SECONDS: int = 30
+
+    # Reserva de stock de pedidos pendentes
+    ORDER_RESERVATION_MINUTES: int = 30
+    RESERVATION_RELEASE_BATCH: int = 500
+
+    # Cache do catálogo (GET /products/)
+    CATALOG_CACHE_TTL_SECONDS: int = 30
+
+    # POST /orders/bulk
+    BULK_ORDERS_MAX: int = 20000
+
+    # POST /admin/products/import
+    PRODUCT_IMPORT_BATCH: int = 1000
+    PRODUCT_IMPORT_MAX_BYTES: int = 50 * 1024 * 1024
+
+    # POST /admin/commissions/recompute
+    COMMISSION_RECOMPUTE_CHUNK: int = 2000
+
+    # GET /commissions/export (linhas por fetch e por bloco de CSV)
+    COMMISSION_EXPORT_BATCH: int = 2000
+
+    # Regras de comissão (commission_rules): revalidar a versão compilada
+    COMMISSION_RULES_REFRESH_SECONDS: int = 30
+
+    # Job pending -> eligible das comissões
+    COMMISSION_PROMOTION_MINUTES: int = 5
+    COMMISSION_PROMOTION_CHUNK: int = 1000
+    COMMISSION_PROMOTION_LOOKBACK_HOURS: int = 24
+
+    # Motor de payouts (beneficiários por bloco/commit)
+    PAYOUT_CHUNK: int = 1000
+    # Jobs de geração: "running" sem heartbeat há mais que isto = worker morreu
+    PAYOUT_JOB_STALE_MINUTES: int = 10
+    # Geração incremental (job_payouts): recua o watermark anterior estas
+    # horas (+ ELIGIBILITY_DAYS) para apanhar commits tardios e comissões
+    # que só ficaram eligible depois da última execução
+    PAYOUT_WATERMARK_LOOKBACK_HOURS: int = 24
+    # POST /admin/payouts/export (linhas por fetch, por UPDATE e por bloco)
+    PAYOUT_EXPORT_BATCH: int = 1000
+    # POST /admin/payouts/reconcile
+    PAYOUT_RECONCILE_MAX_BYTES: int = 20 * 1024 * 1024
+
+    # GET /products/stream (SSE)
+    PRODUCT_EVENTS_BUFFER: int = 100
+    PRODUCT_EVENTS_HISTORY: int = 1000
+    PRODUCT_EVENTS_HEARTBEAT_SECONDS: int = 15
+
+    # Upload de imagens (POST /uploads/image)
+    UPLOAD_MAX_BYTES: int = 10 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    IMAGE_WORKERS: int = 2
 
     class Config:
         env_file = ".env"
@@ -51,4 +51,17 @@ def get_current_admin(user: User = Depends(get_current_user)) -> User:
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Acesso restrito",
-    )
\ No newline at end of file
+    )
+
+
+def get_current_seller(user: User = Depends(get_current_user)) -> User:
+    """
+    Admin, staff ou consultor (ex.: lançamento de vendas em lote).
+    """
+    if _role_to_value(getattr(user, "role", None)) in ("admin", "staff", "consultant"):
+        return user
+
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Acesso restrito",
+    )
@@ -1,9 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
@@ -17,11 +16,28 @@ from .routers import (
     orders_routes,
     payouts_routes,
     uploads_routes,
+    media_routes,
     commissions_routes,
     payments_routes,
     admin,
 )
-from .services.payouts_service import gerar_payouts_periodo
+from .services.payout_jobs_service import (
+    criar_job_incremental,
+    encerrar_jobs_payouts,
+    executar_job_payouts,
+    job_activo,
+    retomar_jobs_payouts,
+)
+from .services.print_queue_service import processar_fila_impressao, encerrar_workers
+from .services.idempotency_service import purgar_chaves_expiradas
+from .services.reservations_service import liberar_reservas_expiradas
+from .services.search_service import garantir_indice_busca
+from .services.products_service import recalcular_facetas
+from .services.referrals_service import reconstruir_rede
+from .services.commission_balances_service import reconstruir_saldos
+from .services.commission_promotion_service import promover_comissoes_elegiveis
+from .services.commission_rules_service import recarregar_regras, semear_regras_padrao
+from .services.media_service import encerrar_pool_imagens
 
 
 # =========================================================
@@ -33,14 +49,46 @@ scheduler = BackgroundScheduler()
 def job_payouts():
     db = SessionLocal()
     try:
-        period_end = datetime.utcnow()
-        period_start = period_end - timedelta(days=30)
-        gerar_payouts_periodo(db, period_start, period_end)
-        db.commit()
+        if job_activo(db) is not None:
+            return  # a geração em curso é retomada por job_resume_payout_jobs
+        # só comissões novas desde o watermark do último incremental
+        job = criar_job_incremental(db)
+        if job is None:
+            return
+        job_id = job.id
+    finally:
+        db.close()
+    executar_job_payouts(job_id)
+
+
+def job_resume_payout_jobs():
+    retomar_jobs_payouts()
+
+
+def job_release_reservations():
+    db = SessionLocal()
+    try:
+        liberar_reservas_expiradas(db)
     finally:
         db.close()
 
 
+def job_promote_commissions():
+    db = SessionLocal()
+    try:
+        promover_comissoes_elegiveis(db)
+    finally:
+        db.close()
+
+
+def job_print_queue():
+    processar_fila_impressao()
+
+
+def job_purge_idempotency_keys():
+    purgar_chaves_expiradas()
+
+
 # =========================================================
 # Lifespan (Startup / Shutdown)
 # =========================================================
@@ -51,6 +99,12 @@ async def lifespan(app: FastAPI):
     try:
         ensure_admin_exists(db)
         db.commit()
+        garantir_indice_busca(db)
+        recalcular_facetas(db)
+        reconstruir_rede(db)
+        reconstruir_saldos(db)
+        semear_regras_padrao(db)
+        recarregar_regras(db)
     finally:
         db.close()
 
@@ -62,6 +116,42 @@ async def lifespan(app: FastAPI):
         id="job_payouts",
         replace_existing=True,
     )
+    scheduler.add_job(
+        job_resume_payout_jobs,
+        "interval",
+        minutes=1,
+        next_run_time=datetime.now(),  # retoma já jobs interrompidos
+        id="job_resume_payout_jobs",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        job_release_reservations,
+        "interval",
+        minutes=1,
+        id="job_release_reservations",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        job_promote_commissions,
+        "interval",
+        minutes=settings.COMMISSION_PROMOTION_MINUTES,
+        id="job_promote_commissions",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        job_print_queue,
+        "interval",
+        seconds=settings.PRINT_POLL_SECONDS,
+        id="job_print_queue",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        job_purge_idempotency_keys,
+        "interval",
+        hours=1,
+        id="job_purge_idempotency_keys",
+        replace_existing=True,
+    )
     scheduler.start()
 
     yield  # ⬅️ importante
@@ -69,6 +159,9 @@ async def lifespan(app: FastAPI):
     # --- shutdown ---
     if scheduler.running:
         scheduler.shutdown(wait=False)
+    encerrar_workers()
+    encerrar_jobs_payouts()
+    encerrar_pool_imagens()
 
 
 # =========================================================
@@ -92,6 +185,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
@@ -117,8 +211,4 @@ app.include_router(admin.router)
 # =========================================================
 # Media
 # =========================================================
-app.mount(
-    "/media",
-    StaticFiles(directory=settings.MEDIA_DIR),
-    name="media",
-)
\ No newline at end of file
+app.include_router(media_routes.router, prefix="/media", tags=["Media"])
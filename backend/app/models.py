@@ -13,6 +13,10 @@ from sqlalchemy import (
     Boolean,
     Enum,
     Text,
+    JSON,
+    Index,
+    UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -157,17 +161,35 @@ class Product(Base, SerializerMixin):
     __tablename__ = "products"
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    sku = Column(String, nullable=True, unique=True, index=True)  # código do fornecedor / id externo
     name = Column(String, nullable=False)
     description = Column(Text)
     price = Column(Numeric(10, 2), nullable=False)
     cost = Column(Numeric(10, 2), nullable=False)
-    stock = Column(Integer, default=0)
+    stock = Column(Integer, default=0)  # disponível para venda
+    reserved = Column(Integer, nullable=False, default=0, server_default="0")  # preso em pedidos pendentes
     category = Column(String)
     image_url = Column(String, nullable=True)
     video_url = Column(String, nullable=True)
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_products_active_category_price", "active", "category", "price"),
+        Index("ix_products_active_created_at", "active", "created_at"),
+    )
+
+
+class CategoryFacet(Base, SerializerMixin):
+    """
+    Nº de produtos activos por categoria, mantido em cada escrita de produto
+    (ver services/products_service.py). Categoria vazia = "".
+    """
+    __tablename__ = "category_facets"
+
+    category = Column(String, primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+
 
 class Order(Base, SerializerMixin):
     __tablename__ = "orders"
@@ -211,6 +233,11 @@ class Order(Base, SerializerMixin):
         back_populates="order",
     )
 
+    __table_args__ = (
+        Index("ix_orders_user_created_at", "user_id", "created_at"),
+        Index("ix_orders_paid_at", "paid_at"),
+    )
+
 
 class OrderItem(Base, SerializerMixin):
     __tablename__ = "order_items"
@@ -260,6 +287,8 @@ class CommissionRecord(Base, SerializerMixin):
     status = Column(String, nullable=False, default="pending")
     rate = Column(Numeric(6, 4), nullable=True)
     eligible_at = Column(DateTime, nullable=True)
+    # versão da tabela de regras (commission_rules.version) que calculou rate
+    rule_version = Column(Integer, nullable=True)
 
     payout_id = Column(String, ForeignKey("payouts.id"), nullable=True)
 
@@ -273,6 +302,98 @@ class CommissionRecord(Base, SerializerMixin):
         back_populates="commissions",
     )
 
+    __table_args__ = (
+        UniqueConstraint("beneficiary_id", "order_id", "type", name="uq_commission_beneficiary_order_type"),
+        Index("ix_commission_order_id", "order_id"),
+        Index("ix_commission_status_eligible_at", "status", "eligible_at"),
+        # listagem/export admin: keyset (created_at, id) por filtro
+        Index("ix_commission_created_at_id", "created_at", "id"),
+        Index("ix_commission_beneficiary_created_at", "beneficiary_id", "created_at", "id"),
+        Index("ix_commission_status_created_at", "status", "created_at", "id"),
+        Index("ix_commission_type_created_at", "type", "created_at", "id"),
+        Index("ix_commission_payout_id", "payout_id"),
+        # candidatas a payout (índice parcial): motor de payouts por beneficiário
+        Index(
+            "ix_commission_payout_candidates",
+            "beneficiary_id",
+            "created_at",
+            postgresql_where=text("status = 'eligible' AND payout_id IS NULL AND paid IS NOT true"),
+            sqlite_where=text("status = 'eligible' AND payout_id IS NULL AND paid IS NOT 1"),
+        ),
+    )
+
+
+class CommissionRule(Base, SerializerMixin):
+    """
+    Regra de comissão versionada. Linhas imutáveis: mudar uma taxa = nova
+    linha com version maior (ver services/commission_rules_service.py).
+    Chave: commission_type (nível na rede) + user_level do beneficiário +
+    categoria do produto (None = qualquer); vale a partir de effective_from.
+    rate None = a partir daí a chave deixa de ter taxa própria.
+    """
+    __tablename__ = "commission_rules"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    version = Column(Integer, nullable=False, unique=True)
+
+    commission_type = Column(Enum(CommissionType), nullable=False)
+    user_level = Column(Enum(UserLevel), nullable=True)
+    category = Column(String, nullable=True)
+
+    rate = Column(Numeric(6, 4), nullable=True)
+    effective_from = Column(DateTime, nullable=False)
+
+    note = Column(String, nullable=True)
+    created_by_id = Column(String, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CommissionBalance(Base, SerializerMixin):
+    """
+    Totais de comissões por beneficiário, mantidos na mesma transacção de
+    cada escrita em commission_records (ver services/commission_balances_service.py).
+    total_<status> = soma por status; paid_total = soma com o bool paid.
+    """
+    __tablename__ = "commission_balances"
+
+    beneficiary_id = Column(String, ForeignKey("users.id"), primary_key=True)
+
+    total_pending = Column(Numeric(14, 2), nullable=False, default=0)
+    total_eligible = Column(Numeric(14, 2), nullable=False, default=0)
+    total_locked = Column(Numeric(14, 2), nullable=False, default=0)
+    total_paid = Column(Numeric(14, 2), nullable=False, default=0)
+    total_void = Column(Numeric(14, 2), nullable=False, default=0)
+    paid_total = Column(Numeric(14, 2), nullable=False, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CommissionPromotionRun(Base, SerializerMixin):
+    """
+    Execução do job pending -> eligible (ver services/commission_promotion_service.py).
+    watermark_to = eligible_at máximo coberto; a execução seguinte começa aí.
+    status: running | done | failed
+    """
+    __tablename__ = "commission_promotion_runs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = Column(String, nullable=False, default="running")
+
+    watermark_from = Column(DateTime, nullable=True)
+    watermark_to = Column(DateTime, nullable=False)
+
+    promoted = Column(Integer, nullable=False, default=0)
+    chunks = Column(Integer, nullable=False, default=0)
+    duration_ms = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_commission_promotion_runs_started_at", "started_at"),
+    )
+
 
 class Payout(Base, SerializerMixin):
     __tablename__ = "payouts"
@@ -291,8 +412,165 @@ class Payout(Base, SerializerMixin):
     method = Column(String, nullable=True)
     reference = Column(String, nullable=True)
     state = Column(String, nullable=False, default="generated")
+    # execução do motor de payouts que o criou (services/payouts_service.py)
+    batch_id = Column(String, nullable=True)
+    # ficheiro de desembolso em que saiu (services/payout_export_service.py)
+    export_id = Column(String, nullable=True)
+    exported_at = Column(DateTime, nullable=True)
 
     user = relationship(
         "User",
         back_populates="payouts",
-    )
\ No newline at end of file
+    )
+
+    __table_args__ = (
+        # um payout por beneficiário e período (motor: ON CONFLICT DO NOTHING)
+        UniqueConstraint("user_id", "period_start", "period_end", name="uq_payout_user_period"),
+        Index("ix_payout_batch_user", "batch_id", "user_id"),
+        Index("ix_payout_state_created_at", "state", "created_at", "id"),
+        Index("ix_payout_export_id", "export_id"),
+    )
+
+class PayoutJob(Base, SerializerMixin):
+    """
+    Geração de payouts em background (ver services/payout_jobs_service.py).
+    checkpoint = último users.id cujo bloco ficou gravado; gravado na mesma
+    transacção do bloco, por isso um job interrompido retoma a partir dele.
+    O id do job é o batch_id dos payouts que cria.
+    mode: window (janela de created_at) | incremental (desde o watermark
+    do último incremental done até watermark_at/watermark_id)
+    status: pending | running | done | failed
+    """
+    __tablename__ = "payout_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = Column(String, nullable=False, default="pending")
+    mode = Column(String, nullable=False, default="window")
+
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+
+    # incremental: comissões com created_at > watermark_from e
+    # (created_at, id) <= (watermark_at, watermark_id)
+    watermark_from = Column(DateTime, nullable=True)
+    watermark_at = Column(DateTime, nullable=True)
+    watermark_id = Column(String, nullable=True)
+
+    # progresso em utilizadores (window) ou beneficiários com comissões novas (incremental)
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    checkpoint = Column(String, nullable=True)
+    chunks = Column(Integer, nullable=False, default=0)
+
+    payouts_created = Column(Integer, nullable=False, default=0)
+    commissions_linked = Column(Integer, nullable=False, default=0)
+    # candidatas que ficaram sem payout (o do período já foi exportado/pago)
+    commissions_unlinked = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Numeric(14, 2), nullable=False, default=0)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_at = Column(DateTime, nullable=True)  # heartbeat: actualizado a cada bloco
+    last_error = Column(Text, nullable=True)
+
+    created_by_id = Column(String, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_payout_jobs_status_locked_at", "status", "locked_at"),
+        Index("ix_payout_jobs_created_at", "created_at"),
+        Index("ix_payout_jobs_mode_status_watermark", "mode", "status", "watermark_at"),
+    )
+
+
+class PrintJob(Base, SerializerMixin):
+    """
+    Job de impressão da etiqueta do pedido (PDF + lp).
+    Criado na mesma transacção do pedido e processado fora do request.
+    status: pending | processing | done | failed
+    """
+    __tablename__ = "print_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    order_id = Column(String, ForeignKey("orders.id"), nullable=False, index=True)
+
+    status = Column(String, nullable=False, default="pending")
+    payload = Column(JSON, nullable=True)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    pdf_path = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    printed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_print_jobs_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class IdempotencyKey(Base, SerializerMixin):
+    """
+    Resposta guardada de um POST com header `Idempotency-Key`.
+    id = sha256(scope | user_id | key)
+    status: in_progress | completed
+    """
+    __tablename__ = "idempotency_keys"
+
+    id = Column(String, primary_key=True)
+    scope = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)
+
+    status = Column(String, nullable=False, default="in_progress")
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(JSON, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class StockReservation(Base, SerializerMixin):
+    """
+    Stock preso por um pedido PENDING até `expires_at`.
+    status: active | consumed (pago) | released (expirou/cancelado)
+    """
+    __tablename__ = "stock_reservations"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    order_id = Column(String, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(String, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+    status = Column(String, nullable=False, default="active")
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_stock_reservations_status_expires", "status", "expires_at"),
+    )
+
+
+class ReferralAncestry(Base):
+    """
+    Closure table da rede de indicações (users.referred_by_id): uma linha
+    por par (ancestral, descendente) com a distância entre eles.
+    depth 1 = quem indicou directamente. Sem linhas de depth 0.
+    Mantida em services/referrals_service.py.
+    """
+    __tablename__ = "referral_ancestry"
+
+    ancestor_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    descendant_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_referral_ancestry_descendant_depth", "descendant_id", "depth"),
+        Index("ix_referral_ancestry_ancestor_depth", "ancestor_id", "depth"),
+    )
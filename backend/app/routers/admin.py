@@ -1,12 +1,40 @@
+import tempfile
+import uuid
 from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from .. import schemas
+from ..config import settings
 from ..database import get_db
 from ..deps import get_current_admin
-from ..models import User, UserRole, Product
+from ..models import User, UserRole, Product, PrintJob
+from ..services.catalog_cache_service import invalidar_catalogo
+from ..services.products_service import faceta_de, sincronizar_produtos
+from ..services.product_events_service import publicar_produtos
+from ..services.commission_recompute_service import recalcular_comissoes
+from ..services.commission_balances_service import reconstruir_saldos, verificar_saldos
+from ..services.commission_promotion_service import listar_execucoes, promover_comissoes_elegiveis
+from ..services.commission_rules_service import criar_regra, listar_regras, obter_tabela
+from ..services.payout_export_service import LAYOUTS, gerar_arquivo_desembolso, reservar_para_exportacao
+from ..services.payout_reconciliation_service import ler_extracto, reconciliar_pagamentos
+from ..services.payout_jobs_service import (
+    criar_job_incremental,
+    criar_job_payouts,
+    iniciar_job,
+    job_para_dict,
+    listar_jobs,
+    obter_job,
+    retomar_job,
+)
+from ..services.print_queue_service import repetir_job
+from ..services.referrals_service import reparentar
+from ..services.product_import_service import importar_produtos, ler_csv, ler_ndjson
 
 # ✅ Imports "safe" para não quebrar caso ainda não existam
 try:
@@ -19,12 +47,6 @@ try:
 except Exception:
     Payout = None  # type: ignore
 
-# ✅ Service "safe"
-try:
-    from ..services.payouts_service import gerar_payouts_periodo
-except Exception:
-    gerar_payouts_periodo = None  # type: ignore
-
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
@@ -110,6 +132,30 @@ def admin_set_user_role(
     return {"id": str(user.id), "role": _enum_to_value(user.role)}
 
 
+@router.patch("/users/{user_id}/referrer")
+def admin_set_user_referrer(
+    user_id: str,
+    payload: Dict[str, Any],
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Muda quem indicou o utilizador (move toda a sub-árvore da rede).
+    Body: {"referred_by_id": "<user_id>" | null}
+    """
+    if "referred_by_id" not in payload:
+        raise HTTPException(status_code=400, detail="referred_by_id is required")
+
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    reparentar(db, user, payload.get("referred_by_id") or None)
+    db.commit()
+    db.refresh(user)
+    return {"id": str(user.id), "referred_by_id": user.referred_by_id}
+
+
 # -------------------------
 # PRODUCTS (ADMIN)
 # -------------------------
@@ -153,11 +199,54 @@ def admin_create_product(
     )
 
     db.add(product)
+    db.flush()
+    sincronizar_produtos(db, [product])
     db.commit()
     db.refresh(product)
+    invalidar_catalogo()
+    publicar_produtos(db, [product.id])
     return _model_to_dict(product)
 
 
+@router.post("/products/import", response_model=schemas.ProductImportOut)
+async def admin_import_products(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Upsert em massa por SKU a partir de CSV (cabeçalho com sku|external_id,
+    name, price, cost, stock, category, ...) ou NDJSON (um objecto por linha).
+    Formato pelo `?format=` ou pelo Content-Type. Linhas com erro são
+    reportadas e não impedem as restantes.
+    """
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "ndjson" in content_type or "jsonlines" in content_type else "csv")
+
+    # corpo para disco (em memória até 1 MB), lido depois linha a linha
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.PRODUCT_IMPORT_MAX_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Arquivo maior que {settings.PRODUCT_IMPORT_MAX_BYTES // (1024 * 1024)} MB",
+                )
+            await run_in_threadpool(spool.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Arquivo vazio")
+        spool.seek(0)
+
+        linhas = ler_ndjson(spool) if fmt == "ndjson" else ler_csv(spool)
+        try:
+            return await run_in_threadpool(importar_produtos, db, linhas)
+        finally:
+            # lotes já gravados ficam visíveis mesmo se um lote posterior falhar
+            invalidar_catalogo()
+
+
 @router.patch("/products/{product_id}")
 def admin_update_product(
     product_id: str,
@@ -169,6 +258,7 @@ def admin_update_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
+    antes = {product.id: faceta_de(product)}
     for field in ["name", "description", "category", "image_url", "video_url", "price", "cost", "active"]:
         if field in payload and payload[field] is not None and hasattr(product, field):
             setattr(product, field, payload[field])
@@ -179,8 +269,11 @@ def admin_update_product(
         except Exception:
             raise HTTPException(status_code=400, detail="stock must be integer")
 
+    sincronizar_produtos(db, [product], antes)
     db.commit()
     db.refresh(product)
+    invalidar_catalogo()
+    publicar_produtos(db, [product.id])
     return _model_to_dict(product)
 
 
@@ -197,9 +290,13 @@ def admin_deactivate_product(
     if not hasattr(product, "active"):
         raise HTTPException(status_code=400, detail="Product has no active field")
 
+    antes = {product.id: faceta_de(product)}
     product.active = False
+    sincronizar_produtos(db, [product], antes)
     db.commit()
     db.refresh(product)
+    invalidar_catalogo()
+    publicar_produtos(db, [product.id])
     return {"id": str(product.id), "active": bool(product.active)}
 
 
@@ -221,16 +318,107 @@ def admin_list_payouts(
     return [_model_to_dict(p) for p in payouts]
 
 
-@router.post("/payouts/generate")
+def _validar_formato(formato: str):
+    if formato not in LAYOUTS:
+        raise HTTPException(status_code=422, detail=f"format inválido ({'|'.join(LAYOUTS)})")
+
+
+def _resposta_desembolso(formato: str, export_id: str) -> StreamingResponse:
+    filename = f"payouts-{formato}-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"
+    return StreamingResponse(
+        gerar_arquivo_desembolso(formato, export_id),
+        media_type="text/csv; charset=utf-8",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Id": export_id,
+        },
+    )
+
+
+@router.post("/payouts/export")
+def admin_export_payouts(
+    format: str = Query("mpesa", description="mpesa|emola|bank"),
+    batch_id: Optional[str] = Query(None, description="só os payouts deste job de geração"),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Ficheiro de desembolso em massa com os payouts pendentes ainda não
+    exportados; passam a state="exported" antes de o ficheiro começar a
+    sair. O id do ficheiro vem em X-Export-Id (download perdido:
+    GET /admin/payouts/exports/{export_id}).
+    """
+    _validar_formato(format)
+    export_id = str(uuid.uuid4())
+    reservados = reservar_para_exportacao(db, export_id, batch_id=batch_id)
+    resposta = _resposta_desembolso(format, export_id)
+    resposta.headers["X-Export-Count"] = str(reservados)
+    return resposta
+
+
+@router.get("/payouts/exports/{export_id}")
+def admin_download_payout_export(
+    export_id: str,
+    format: str = Query("mpesa", description="mpesa|emola|bank"),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Gera de novo um ficheiro já exportado (download interrompido), sem mudar estados.
+    """
+    _validar_formato(format)
+    return _resposta_desembolso(format, export_id)
+
+
+@router.post("/payouts/reconcile")
+async def admin_reconcile_payouts(
+    request: Request,
+    method: str = Query("mpesa", description="mpesa|emola|bank (gravado em payout.method)"),
+    dry_run: bool = Query(False, description="só casa e reporta, sem marcar pagos"),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Extracto de liquidação do provedor (CSV com reference e/ou msisdn,
+    amount; opcionais receipt/transaction_id e status). Os payouts casados
+    e as suas comissões ficam pagos numa transacção; as linhas sem par,
+    com valor diferente ou falhadas vêm em `issues`.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.PAYOUT_RECONCILE_MAX_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Arquivo maior que {settings.PAYOUT_RECONCILE_MAX_BYTES // (1024 * 1024)} MB",
+                )
+            await run_in_threadpool(spool.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Arquivo vazio")
+        spool.seek(0)
+
+        linhas = await run_in_threadpool(ler_extracto, spool)
+    return await run_in_threadpool(reconciliar_pagamentos, db, linhas, method, dry_run)
+
+
+@router.post("/payouts/generate", status_code=status.HTTP_202_ACCEPTED)
 def admin_generate_payouts(
     payload: Dict[str, Any],
     db: Session = Depends(get_db),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
-    if Payout is None:
-        raise HTTPException(status_code=501, detail="Model Payout não existe/import falhou.")
-    if gerar_payouts_periodo is None:
-        raise HTTPException(status_code=501, detail="Serviço gerar_payouts_periodo não disponível.")
+    """
+    Regista a geração de payouts como job em background e devolve-o já.
+    Progresso em GET /admin/payouts/jobs/{id}.
+    {"mode": "incremental"}: como o scheduler, só comissões novas desde o
+    último watermark (204 se não houver comissões novas).
+    """
+    if payload.get("mode") == "incremental":
+        job = criar_job_incremental(db, created_by_id=admin.id)
+        if job is None:
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
+        iniciar_job(job.id)
+        return job_para_dict(job)
 
     days = payload.get("days", 30)
     try:
@@ -244,17 +432,152 @@ def admin_generate_payouts(
     period_end = datetime.utcnow()
     period_start = period_end - timedelta(days=days)
 
-    before = db.query(Payout).count()
+    job = criar_job_payouts(db, period_start, period_end, created_by_id=admin.id)
+    iniciar_job(job.id)
+    return job_para_dict(job)
 
-    gerar_payouts_periodo(db, period_start, period_end)
-    db.commit()
 
-    after = db.query(Payout).count()
+@router.get("/payouts/jobs")
+def admin_list_payout_jobs(
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    return listar_jobs(db, limit=limit)
+
+
+@router.get("/payouts/jobs/{job_id}")
+def admin_get_payout_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    return job_para_dict(obter_job(db, job_id))
+
 
+@router.post("/payouts/jobs/{job_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+def admin_resume_payout_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Retoma um job failed (ou parado) a partir do último checkpoint.
+    """
+    job = retomar_job(db, job_id)
+    iniciar_job(job.id)
+    return job_para_dict(job)
+
+
+# -------------------------
+# COMMISSIONS (ADMIN)
+# -------------------------
+@router.post("/commissions/recompute")
+def admin_recompute_commissions(
+    payload: Dict[str, Any],
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Recalcula as comissões dos pedidos pagos em [start, end) com as taxas
+    e a rede actuais. Por omissão é dry-run (só devolve o diff).
+    Body: {"start": "2025-01-01", "end": "2025-02-01", "dry_run": true}
+    """
+    try:
+        start = datetime.fromisoformat(str(payload.get("start")))
+        end = datetime.fromisoformat(str(payload.get("end")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end devem ser datas ISO (YYYY-MM-DD)")
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start deve ser anterior a end")
+
+    return recalcular_comissoes(db, start, end, dry_run=bool(payload.get("dry_run", True)))
+
+
+@router.get("/commissions/rules")
+def admin_list_commission_rules(
+    limit: int = Query(200, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Todas as versões de regras (mais recentes primeiro) e a versão compilada em uso.
+    """
+    return {
+        "compiled_version": obter_tabela(db).version,
+        "rules": listar_regras(db, limit=limit),
+    }
+
+
+@router.post("/commissions/rules", response_model=schemas.CommissionRuleOut, status_code=status.HTTP_201_CREATED)
+def admin_create_commission_rule(
+    payload: schemas.CommissionRuleCreate,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin),
+):
+    """
+    Nova versão de regra. Comissões já gravadas não mudam; para aplicar a
+    pedidos antigos usar /commissions/recompute.
+    """
+    return criar_regra(
+        db,
+        commission_type=payload.commission_type,
+        rate=payload.rate,
+        effective_from=payload.effective_from,
+        user_level=payload.user_level,
+        category=payload.category,
+        note=payload.note,
+        created_by_id=admin.id,
+    )
+
+
+@router.post("/commissions/promote")
+def admin_promote_commissions(
+    full: bool = Query(False, description="ignora o watermark e varre todas as pending vencidas"),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Corre já o job pending -> eligible (normalmente corre no scheduler).
+    """
+    return promover_comissoes_elegiveis(db, full=full)
+
+
+@router.get("/commissions/promotion-runs")
+def admin_list_promotion_runs(
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    return listar_execucoes(db, limit=limit)
+
+
+@router.get("/commissions/balances/verify")
+def admin_verify_commission_balances(
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Compara commission_balances com a soma das comissões por beneficiário.
+    """
+    return verificar_saldos(db, limit=limit)
+
+
+@router.post("/commissions/balances/rebuild")
+def admin_rebuild_commission_balances(
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Reconstrói commission_balances a partir das comissões e verifica o resultado.
+    """
+    antes = verificar_saldos(db, limit=0)["mismatched"]
+    beneficiaries = reconstruir_saldos(db, apenas_se_vazio=False)
     return {
-        "created": max(0, after - before),
-        "period_start": period_start.isoformat(),
-        "period_end": period_end.isoformat(),
+        "rebuilt": beneficiaries,
+        "mismatched_before": antes,
+        "verify": verificar_saldos(db),
     }
 
 
@@ -273,4 +596,44 @@ def admin_list_orders(
     if hasattr(Order, "created_at"):
         q = q.order_by(Order.created_at.desc())
     orders = q.all()
-    return [_model_to_dict(o) for o in orders]
\ No newline at end of file
+    return [_model_to_dict(o) for o in orders]
+
+# -------------------------
+# PRINT QUEUE (ADMIN)
+# -------------------------
+@router.get("/print-jobs")
+def admin_print_queue(
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    """
+    Profundidade da fila de impressão por status + últimos jobs falhados.
+    """
+    depth = {
+        status_: count
+        for status_, count in db.query(PrintJob.status, func.count(PrintJob.id))
+        .group_by(PrintJob.status)
+        .all()
+    }
+    failed = (
+        db.query(PrintJob)
+        .filter(PrintJob.status == "failed")
+        .order_by(PrintJob.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "depth": depth,
+        "failed": [_model_to_dict(j) for j in failed],
+    }
+
+
+@router.post("/print-jobs/{job_id}/retry")
+def admin_retry_print_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    _: User = Depends(get_current_admin),
+):
+    job = repetir_job(db, job_id)
+    return {"id": job.id, "status": job.status}
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from ..database import get_db
 from .. import models, schemas, auth
 from ..deps import get_current_user
+from ..services.referrals_service import registrar_na_rede
 
 router = APIRouter()
 
@@ -17,6 +18,9 @@ def auth_register_user(
     if existing:
         raise HTTPException(status_code=400, detail="Email já cadastrado")
 
+    if data.referred_by_id and db.get(models.User, data.referred_by_id) is None:
+        raise HTTPException(status_code=400, detail="Indicador não encontrado")
+
     user = models.User(
         name=data.name,
         email=data.email,
@@ -26,6 +30,8 @@ def auth_register_user(
         referred_by_id=data.referred_by_id,
     )
     db.add(user)
+    db.flush()
+    registrar_na_rede(db, user)
     db.commit()
     db.refresh(user)
     return user
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import List, Optional
 from datetime import datetime
 
 from ..database import get_db
 from .. import models, schemas
 from ..deps import get_current_user, get_current_admin
+from ..services.commission_balances_service import saldo_de
+from ..services.commission_export_service import filtrar_comissoes, gerar_csv_comissoes
+from ..utils.pagination import decode_datetime_cursor, encode_cursor, keyset_after
 
 router = APIRouter()
 
@@ -54,10 +57,11 @@ def my_commissions(
 
 
 # -----------------------------
-# ✅ ADMIN: todas comissões (mantido + melhorado)
+# ✅ ADMIN: todas comissões (keyset em (created_at, id))
 # -----------------------------
 @router.get("/", response_model=List[schemas.CommissionRecordOut])
 def all_commissions(
+    response: Response,
     beneficiary_id: Optional[str] = Query(None),
     order_id: Optional[str] = Query(None),
     status: Optional[str] = Query(None),
@@ -65,49 +69,77 @@ def all_commissions(
     date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
     date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
     limit: int = Query(200, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="valor de X-Next-Cursor da página anterior"),
     db: Session = Depends(get_db),
     admin=Depends(get_current_admin),
 ):
-    q = db.query(models.CommissionRecord)
-
-    if beneficiary_id:
-        q = q.filter(models.CommissionRecord.beneficiary_id == beneficiary_id)
+    """
+    Mais recentes primeiro. O cursor da página seguinte vem no header
+    `X-Next-Cursor` (ausente na última página).
+    """
+    q = filtrar_comissoes(
+        db.query(models.CommissionRecord),
+        beneficiary_id=beneficiary_id,
+        order_id=order_id,
+        status=status,
+        type=type,
+        date_from=date_from,
+        date_to=date_to,
+    )
 
-    if order_id:
-        q = q.filter(models.CommissionRecord.order_id == order_id)
+    if cursor:
+        created_at, commission_id = decode_datetime_cursor(cursor)
+        q = q.filter(
+            keyset_after(
+                (models.CommissionRecord.created_at, models.CommissionRecord.id),
+                (created_at, commission_id),
+            )
+        )
 
-    if status:
-        q = q.filter(models.CommissionRecord.status == status)
+    recs = (
+        q.order_by(models.CommissionRecord.created_at.desc(), models.CommissionRecord.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
 
-    if type:
-        # aceita string igual ao Enum (ex.: "consultant")
-        try:
-            q = q.filter(models.CommissionRecord.type == models.CommissionType(type))
-        except Exception:
-            pass
+    if len(recs) > limit:
+        recs = recs[:limit]
+        last = recs[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
 
-    if date_from:
-        try:
-            dt_from = datetime.fromisoformat(date_from)
-            q = q.filter(models.CommissionRecord.created_at >= dt_from)
-        except Exception:
-            pass
+    return recs
 
-    if date_to:
-        try:
-            dt_to = datetime.fromisoformat(date_to)
-            q = q.filter(models.CommissionRecord.created_at <= dt_to)
-        except Exception:
-            pass
 
-    recs = (
-        q.order_by(models.CommissionRecord.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
+# -----------------------------
+# ✅ ADMIN: export CSV (streaming)
+# -----------------------------
+@router.get("/export")
+def export_commissions(
+    beneficiary_id: Optional[str] = Query(None),
+    order_id: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    type: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    admin=Depends(get_current_admin),
+):
+    """
+    Todas as comissões filtradas em CSV, por ordem de (created_at, id),
+    enviadas à medida que são lidas (memória constante).
+    """
+    filename = f"commissions-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"
+    return StreamingResponse(
+        gerar_csv_comissoes(
+            beneficiary_id=beneficiary_id,
+            order_id=order_id,
+            status=status,
+            type=type,
+            date_from=date_from,
+            date_to=date_to,
+        ),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
-    return recs
 
 
 # -----------------------------
@@ -120,30 +152,7 @@ def my_commissions_summary(
 ):
     """
     Retorna totais por status e total geral para mostrar no painel do consultor.
-    Não depende de schema novo (não quebra).
+    Lido de commission_balances (uma linha por beneficiário), não das comissões.
+    paid_total = compatibilidade com o bool antigo "paid".
     """
-    rows = (
-        db.query(models.CommissionRecord.status, func.sum(models.CommissionRecord.amount))
-        .filter(models.CommissionRecord.beneficiary_id == current.id)
-        .group_by(models.CommissionRecord.status)
-        .all()
-    )
-
-    by_status = {status: float(total or 0) for status, total in rows}
-
-    total = float(sum(by_status.values())) if by_status else 0.0
-
-    # compatibilidade com o bool antigo "paid"
-    paid_total = (
-        db.query(func.sum(models.CommissionRecord.amount))
-        .filter(models.CommissionRecord.beneficiary_id == current.id)
-        .filter(models.CommissionRecord.paid == True)
-        .scalar()
-    )
-
-    return {
-        "beneficiary_id": current.id,
-        "total": total,
-        "by_status": by_status,
-        "paid_total": float(paid_total or 0),
-    }
\ No newline at end of file
+    return saldo_de(db, current.id)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from ..config import settings
+from ..services.catalog_cache_service import etag_corresponde
+from ..services.media_storage import MediaObject, MediaStorage, get_media_storage
+
+router = APIRouter()
+
+# =========================================================
+# Servir /media
+#
+# - content-addressed (images/ab/<sha256>...): Cache-Control immutable, 1 ano
+# - restantes: max-age curto + revalidação por ETag / Last-Modified
+# - Range (um intervalo) para seek de vídeo; 206 / 416
+# - negociação: WebP gerado no upload (Accept: image/webp) e
+#   pré-comprimidos .br / .gz (Accept-Encoding) quando existirem
+# - corpo enviado por zero-copy quando o servidor ASGI suporta a extensão
+#   http.response.zerocopysend; senão, leituras por chunks em threadpool
+# =========================================================
+
+CHUNK_SIZE = 256 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_CONTENT_ADDRESSED_RE = re.compile(r"^images/[0-9a-f]{2}/(?P<sha>[0-9a-f]{64})(?P<variant>_[a-z]+)?\.[a-z0-9]+$")
+_WEBP_SOURCE_RE = re.compile(r"^(?P<base>images/[0-9a-f]{2}/[0-9a-f]{64})\.(jpg|png)$")
+
+_COMPRESSIBLE_PREFIXES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _aceita(header: Optional[str], token: str) -> bool:
+    """Token presente num Accept/Accept-Encoding com q > 0."""
+    for part in (header or "").split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        if name.lower() != token:
+            continue
+        for param in params:
+            k, _, v = param.partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    return float(v) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _negociar(
+    storage: MediaStorage, key: str, accept: Optional[str], accept_encoding: Optional[str]
+) -> Tuple[Optional[MediaObject], Optional[str], List[str]]:
+    """
+    Escolhe a representação: (objecto a enviar, content-encoding, vary).
+    """
+    vary: List[str] = []
+
+    webp = _WEBP_SOURCE_RE.match(key)
+    if webp:
+        vary.append("Accept")
+        if _aceita(accept, "image/webp"):
+            obj = storage.stat(f"{webp.group('base')}_webp.webp")
+            if obj is not None:
+                return obj, None, vary
+
+    obj = storage.stat(key)
+    if obj is None:
+        return None, None, vary
+
+    if obj.content_type.startswith(_COMPRESSIBLE_PREFIXES):
+        vary.append("Accept-Encoding")
+        for encoding, suffix in _ENCODINGS:
+            if _aceita(accept_encoding, encoding):
+                compressed = storage.stat(key + suffix)
+                if compressed is not None:
+                    return compressed, encoding, vary
+
+    return obj, None, vary
+
+
+def _etag(obj: MediaObject, encoding: Optional[str]) -> Tuple[str, bool]:
+    """(etag, é content-addressed?)"""
+    m = _CONTENT_ADDRESSED_RE.match(obj.key)
+    if m:
+        tag = m.group("sha") + (m.group("variant") or "")
+    else:
+        tag = f"{int(obj.mtime * 1_000_000):x}-{obj.size:x}"
+    if encoding:
+        tag += f"-{encoding}"
+    return f'"{tag}"', bool(m)
+
+
+def _nao_modificado_desde(header: Optional[str], mtime: float) -> bool:
+    if not header:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _intervalo(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Um único intervalo `bytes=` -> (start, end) inclusivo.
+    None = ignorar (sem Range, sintaxe inválida ou multi-range -> 200 completo).
+    (-1, -1) = insatisfazível (416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, sep, end_s = header[6:].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_s == "":
+            suffix = int(end_s)
+            if suffix <= 0:
+                return (-1, -1)
+            return (max(size - suffix, 0), size - 1)
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return (-1, -1)
+    if end < start:
+        return None
+    return (start, min(end, size - 1))
+
+
+class MediaResponse(Response):
+    """
+    Envia `length` bytes a partir de `offset` de um MediaObject.
+    """
+
+    def __init__(
+        self,
+        storage: MediaStorage,
+        obj: MediaObject,
+        status_code: int,
+        headers: dict,
+        offset: int = 0,
+        length: int = 0,
+    ):
+        self.storage = storage
+        self.obj = obj
+        self.offset = offset
+        self.length = length
+        super().__init__(status_code=status_code, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.obj.path and "http.response.zerocopysend" in extensions:
+            f = await run_in_threadpool(open, self.obj.path, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            finally:
+                await run_in_threadpool(f.close)
+            return
+
+        chunks = self.storage.ler(self.obj, self.offset, self.length, CHUNK_SIZE)
+        async for chunk in iterate_in_threadpool(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_media(key: str, request: Request):
+    if key.endswith(".part"):
+        return Response(status_code=404)  # upload ainda a ser gravado
+
+    storage = get_media_storage()
+    obj, encoding, vary = await run_in_threadpool(
+        _negociar,
+        storage,
+        key,
+        request.headers.get("accept"),
+        request.headers.get("accept-encoding"),
+    )
+    if obj is None:
+        return Response(status_code=404)
+
+    etag, immutable = _etag(obj, encoding)
+    last_modified = formatdate(obj.mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL
+            if immutable
+            else f"public, max-age={settings.MEDIA_MAX_AGE_SECONDS}, must-revalidate"
+        ),
+    }
+    if vary:
+        headers["Vary"] = ", ".join(vary)
+
+    if_none_match = request.headers.get("if-none-match")
+    if etag_corresponde(if_none_match, etag) or (
+        if_none_match is None
+        and _nao_modificado_desde(request.headers.get("if-modified-since"), obj.mtime)
+    ):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Type"] = obj.content_type
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range not in (etag, last_modified):
+        range_header = None  # representação mudou: envia completa
+
+    span = _intervalo(range_header, obj.size)
+    if span == (-1, -1):
+        headers["Content-Range"] = f"bytes */{obj.size}"
+        del headers["Content-Type"]
+        return Response(status_code=416, headers=headers)
+
+    if span is None:
+        headers["Content-Length"] = str(obj.size)
+        return MediaResponse(storage, obj, 200, headers, 0, obj.size)
+
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{obj.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return MediaResponse(storage, obj, 206, headers, start, end - start + 1)
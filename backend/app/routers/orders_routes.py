@@ -1,20 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Any, Dict
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Any, Dict, Optional
 from decimal import Decimal
 
 from ..database import get_db
 from .. import models, schemas
-from ..deps import get_current_user
+from ..config import settings
+from ..deps import get_current_user, get_current_seller
 from ..services.points_service import (
     calcular_max_desconto_pontos,
     calcular_pontos_ganhos,
     adicionar_pontos,
     usar_pontos,
 )
-
-from ..utils.pdf_generator import generate_order_pdf
-from ..utils.printer import print_pdf
+from ..services.stock_service import (
+    agregar_demanda,
+    carregar_produtos,
+    reservar_stock,
+)
+from ..services.reservations_service import criar_reservas
+from ..services.print_queue_service import enfileirar_impressao
+from ..services.idempotency_service import executar_idempotente
+from ..services.bulk_orders_service import importar_orders_em_lote
+from ..services.product_events_service import publicar_produtos
+from ..utils.pagination import encode_cursor, decode_datetime_cursor, keyset_after
 
 router = APIRouter()
 
@@ -34,7 +47,24 @@ def create_order(
     data: schemas.OrderCreate,
     db: Session = Depends(get_db),
     current=Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
+    """
+    Cria pedido. Com header `Idempotency-Key`, retries do mesmo pedido
+    devolvem a resposta original em vez de criar outro pedido.
+    """
+    return executar_idempotente(
+        key=idempotency_key,
+        scope="orders.create",
+        user_id=current.id,
+        payload=data.model_dump(mode="json"),
+        executar=lambda: schemas.OrderOut.model_validate(
+            _criar_order(data, db, current)
+        ).model_dump(mode="json"),
+    )
+
+
+def _criar_order(data: schemas.OrderCreate, db: Session, current) -> models.Order:
     if not data.items:
         raise HTTPException(status_code=400, detail="Carrinho vazio")
 
@@ -44,43 +74,28 @@ def create_order(
     if not consultant_id and getattr(current, "role", None) == models.UserRole.consultant:
         consultant_id = current.id
 
-    total = Decimal("0.00")
-    stock_issues: List[Dict[str, Any]] = []
-
-    products_by_id: Dict[str, models.Product] = {}
-
     for item in data.items:
-        product = db.query(models.Product).filter(
-            models.Product.id == item.product_id,
-            models.Product.active == True
-        ).first()
-
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Produto {item.product_id} não encontrado")
-
-        products_by_id[item.product_id] = product
-
-        requested = int(item.quantity or 0)
-        available = int(product.stock or 0)
-
-        if requested <= 0:
+        if int(item.quantity or 0) <= 0:
             raise HTTPException(status_code=400, detail="Quantidade inválida")
 
-        if available < requested:
-            stock_issues.append({
-                "product_id": product.id,
-                "name": product.name,
-                "available": available,
-                "requested": requested,
-            })
-            continue
+    # ✅ carrega o carrinho inteiro numa única query (com lock de linha)
+    demanda = agregar_demanda(data.items)
+    products_by_id = carregar_produtos(db, demanda.keys())
 
-        line_total = Decimal(product.price) * requested
-        total += line_total
+    for product_id in demanda:
+        if product_id not in products_by_id:
+            raise HTTPException(status_code=404, detail=f"Produto {product_id} não encontrado")
 
+    # ✅ baixa stock num batch de UPDATE condicional (sem lost updates);
+    # fica reservado até o pagamento ou até expirar
+    stock_issues = reservar_stock(db, products_by_id, demanda, reservado=True)
     if stock_issues:
         _stock_conflict(stock_issues)
 
+    total = Decimal("0.00")
+    for item in data.items:
+        total += Decimal(products_by_id[item.product_id].price) * int(item.quantity)
+
     # Cria pedido como PENDING
     order = models.Order(
         user_id=current.id,
@@ -95,20 +110,17 @@ def create_order(
     db.add(order)
     db.flush()  # gera ID
 
-    for item in data.items:
-        product = products_by_id[item.product_id]
-        requested = int(item.quantity)
+    criar_reservas(db, order.id, demanda)
 
-        oi = models.OrderItem(
+    db.add_all([
+        models.OrderItem(
             order_id=order.id,
-            product_id=product.id,
-            quantity=requested,
-            unit_price=product.price,
+            product_id=item.product_id,
+            quantity=int(item.quantity),
+            unit_price=products_by_id[item.product_id].price,
         )
-        db.add(oi)
-
-        # baixa stock agora
-        product.stock = int(product.stock or 0) - requested
+        for item in data.items
+    ])
 
     max_points = calcular_max_desconto_pontos(current, total)
     points_to_use = min(int(max_points), int(data.points_to_use or 0))
@@ -127,34 +139,118 @@ def create_order(
         adicionar_pontos(db, current, int(points_earned), "Pontos por compra", order.id)
         order.points_earned = int(points_earned)
 
+    # ✅ etiqueta (PDF + impressão) vai para a fila: fora do request
+    enfileirar_impressao(db, order, data.delivery_address)
+
     db.commit()
     db.refresh(order)
+    publicar_produtos(db, demanda.keys())
+
+    return order
+
 
-    # ✅ Geração do PDF do endereço e impressão
+def _parse_bulk_order(index: int, raw: Any):
     try:
-        order_dict = {
-            "id": order.id,
-            "delivery_address": data.delivery_address,  # assume que vem no schema OrderCreate
-            "items": [{"name": i.name, "quantity": i.quantity, "price": str(i.unit_price)} for i in order.order_items],
-            "total_amount": str(order.total_amount),
-        }
-        pdf_file = generate_order_pdf(order_dict)
-        print_pdf(pdf_file)
-    except Exception as e:
-        print(f"Erro ao gerar/imprimir PDF: {e}")
+        if isinstance(raw, (bytes, str)):
+            return index, schemas.BulkOrderIn.model_validate_json(raw), None
+        return index, schemas.BulkOrderIn.model_validate(raw), None
+    except ValidationError as e:
+        return index, None, "; ".join(
+            f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+        )
 
-    return order
+
+def _check_bulk_size(n: int):
+    if n > settings.BULK_ORDERS_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo de {settings.BULK_ORDERS_MAX} pedidos por lote",
+        )
+
+
+@router.post("/bulk", response_model=schemas.BulkOrdersOut)
+async def bulk_create_orders(
+    request: Request,
+    db: Session = Depends(get_db),
+    current=Depends(get_current_seller),
+):
+    """
+    Lançamento em lote de vendas offline (admin/staff/consultor).
+
+    Body:
+    - JSON: lista de pedidos ou {"orders": [...]}
+    - NDJSON (Content-Type: application/x-ndjson): um pedido por linha
+
+    Cada pedido: {ref?, user_id?, consultant_id?, ref_source?, items: [...]}.
+    Retorna o resultado por pedido (mesma ordem/índice da entrada).
+    """
+    content_type = request.headers.get("content-type", "")
+    entradas = []
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buf = b""
+        index = 0
+        async for chunk in request.stream():
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    entradas.append(_parse_bulk_order(index, line))
+                    index += 1
+            _check_bulk_size(index)
+        if buf.strip():
+            entradas.append(_parse_bulk_order(index, buf))
+    else:
+        try:
+            body = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="JSON inválido")
+        if isinstance(body, dict):
+            body = body.get("orders")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Esperado lista de pedidos ou {\"orders\": [...]}")
+        _check_bulk_size(len(body))
+        entradas = [_parse_bulk_order(i, raw) for i, raw in enumerate(body)]
+
+    _check_bulk_size(len(entradas))
+    if not entradas:
+        raise HTTPException(status_code=400, detail="Lote vazio")
+
+    return await run_in_threadpool(importar_orders_em_lote, db, current, entradas)
 
 
 @router.get("/me", response_model=List[schemas.OrderOut])
 def my_orders(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="valor de X-Next-Cursor da página anterior"),
     db: Session = Depends(get_db),
     current=Depends(get_current_user),
 ):
-    orders = (
+    """
+    Pedidos do utilizador, mais recentes primeiro, paginados por keyset
+    em (created_at, id). O cursor da página seguinte vem no header
+    `X-Next-Cursor` (ausente na última página).
+    """
+    q = (
         db.query(models.Order)
+        .options(selectinload(models.Order.items))
         .filter(models.Order.user_id == current.id)
-        .order_by(models.Order.created_at.desc())
+    )
+
+    if cursor:
+        created_at, order_id = decode_datetime_cursor(cursor)
+        q = q.filter(keyset_after((models.Order.created_at, models.Order.id), (created_at, order_id)))
+
+    orders = (
+        q.order_by(models.Order.created_at.desc(), models.Order.id.desc())
+        .limit(limit + 1)
         .all()
     )
+
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+
     return orders
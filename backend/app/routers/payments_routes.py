@@ -1,6 +1,8 @@
 from decimal import Decimal
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
@@ -14,6 +16,10 @@ from ..services.payments_service import (
 
 # ✅ comissão perfeita (idempotente)
 from ..services.commissions_service import criar_comissoes_para_order
+from ..services.commission_balances_service import transicionar_comissoes
+from ..services.idempotency_service import executar_idempotente
+from ..services.reservations_service import consumir_reservas, liberar_reservas
+from ..services.product_events_service import publicar_produtos
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
@@ -59,14 +65,36 @@ def confirm_payment(
     data: ConfirmOrderPaymentRequest,
     db: Session = Depends(get_db),
     current=Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     """
     Confirma pagamento de um pedido e:
     - valida amount
     - marca Order como PAID
     - cria comissões (idempotente)
+
+    Com header `Idempotency-Key`, retries devolvem a resposta original.
     """
+    return executar_idempotente(
+        key=idempotency_key,
+        scope="payments.confirm",
+        user_id=current.id,
+        payload=data.model_dump(mode="json"),
+        executar=lambda: _confirmar_pagamento(data, db, current),
+    )
 
+
+def _ja_pago(order: models.Order):
+    return {
+        "ok": True,
+        "status": order.status.value,
+        "order_id": order.id,
+        "paid_at": order.paid_at.isoformat() if order.paid_at else None,
+        "message": "Pedido já estava pago",
+    }
+
+
+def _confirmar_pagamento(data: ConfirmOrderPaymentRequest, db: Session, current):
     order = db.query(models.Order).filter(models.Order.id == data.order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
@@ -80,13 +108,10 @@ def confirm_payment(
 
     # ✅ idempotência: se já pago, retorna ok
     if order.status == models.OrderStatus.paid:
-        return {
-            "ok": True,
-            "status": order.status.value,
-            "order_id": order.id,
-            "paid_at": order.paid_at.isoformat() if order.paid_at else None,
-            "message": "Pedido já estava pago",
-        }
+        return _ja_pago(order)
+
+    if order.status == models.OrderStatus.canceled:
+        raise HTTPException(status_code=409, detail="Pedido cancelado ou reserva expirada")
 
     # ✅ valida amount
     expected = Decimal(order.total_amount or 0) - Decimal(order.discount_amount or 0)
@@ -100,15 +125,33 @@ def confirm_payment(
     intent = criar_payment_intent(data.amount, data.method)
     intent = simular_confirmacao_pagamento(intent)
 
-    # ✅ marca order como pago
-    order.status = models.OrderStatus.paid
-    order.paid_at = datetime.utcnow()
+    # ✅ marca order como pago (UPDATE condicional: só um confirm concorrente ganha)
+    marked = (
+        db.query(models.Order)
+        .filter(models.Order.id == order.id, models.Order.status == models.OrderStatus.pending)
+        .update(
+            {"status": models.OrderStatus.paid, "paid_at": datetime.utcnow()},
+            synchronize_session=False,
+        )
+    )
+    if not marked:
+        db.rollback()
+        db.refresh(order)
+        if order.status == models.OrderStatus.canceled:
+            raise HTTPException(status_code=409, detail="Pedido cancelado ou reserva expirada")
+        return _ja_pago(order)
+    db.refresh(order)
+
+    # ✅ a reserva de stock vira venda
+    consumidos = consumir_reservas(db, order.id)
 
     # ✅ cria comissões (nasce no PAID)
     criar_comissoes_para_order(db, order)
 
     db.commit()
     db.refresh(order)
+    # `reserved` mudou: subscritores de /products/stream
+    publicar_produtos(db, consumidos)
 
     return {
         "ok": True,
@@ -147,6 +190,9 @@ def refund_order(
     if order.status == models.OrderStatus.canceled:
         return {"ok": True, "message": "Pedido já cancelado"}
 
+    # larga reservas activas (o stock é reposto logo abaixo)
+    liberar_reservas(db, order.id, repor_stock=False)
+
     # repõe stock
     items = (
         db.query(models.OrderItem)
@@ -168,11 +214,10 @@ def refund_order(
         .filter(models.CommissionRecord.order_id == order.id)
         .all()
     )
-    for c in comms:
-        c.status = "void"
-        c.paid = False
+    transicionar_comissoes(db, comms, status="void", paid=False)
 
     order.status = models.OrderStatus.canceled
 
     db.commit()
+    publicar_produtos(db, [it.product_id for it in items])
     return {"ok": True, "status": order.status.value, "order_id": order.id}
\ No newline at end of file
@@ -6,6 +6,8 @@ from typing import List, Optional
 from ..database import get_db
 from .. import models, schemas
 from ..deps import get_current_user, get_current_admin
+from ..services.payout_reconciliation_service import marcar_payouts_pagos
+from ..services.payouts_service import gerar_payouts_periodo
 
 
 # -----------------------------
@@ -61,53 +63,7 @@ def admin_generate_payouts(
     period_end = datetime.utcnow()
     period_start = period_end - timedelta(days=days)
 
-    # pega comissões eligible ainda não associadas a payout
-    commissions = (
-        db.query(models.CommissionRecord)
-        .filter(models.CommissionRecord.status == "eligible")
-        .filter(models.CommissionRecord.payout_id.is_(None))
-        .filter(models.CommissionRecord.created_at >= period_start)
-        .filter(models.CommissionRecord.created_at <= period_end)
-        .all()
-    )
-
-    if not commissions:
-        return {"created": 0, "period_start": period_start.isoformat(), "period_end": period_end.isoformat()}
-
-    # soma por beneficiário
-    totals = {}
-    for c in commissions:
-        totals.setdefault(c.beneficiary_id, 0.0)
-        totals[c.beneficiary_id] += float(c.amount or 0)
-
-    created = 0
-
-    # cria payout por beneficiário e "locka" comissões
-    for beneficiary_id, total in totals.items():
-        if total <= 0:
-            continue
-
-        payout = models.Payout(
-            user_id=beneficiary_id,
-            amount=total,
-            status="pending",
-            period_start=period_start,
-            period_end=period_end,
-        )
-        db.add(payout)
-        db.flush()  # para obter payout.id
-
-        # associa commissions ao payout
-        for c in commissions:
-            if c.beneficiary_id == beneficiary_id:
-                c.payout_id = payout.id
-                c.status = "locked"  # ou mantém eligible se preferires
-
-        created += 1
-
-    db.commit()
-
-    return {"created": created, "period_start": period_start.isoformat(), "period_end": period_end.isoformat()}
+    return gerar_payouts_periodo(db, period_start, period_end)
 
 
 class MarkPaidPayload(schemas.BaseModel):  # se não tiver, usa Pydantic BaseModel
@@ -125,18 +81,12 @@ def admin_mark_payout_paid(
     payout = db.query(models.Payout).filter(models.Payout.id == payout_id).first()
     if not payout:
         raise HTTPException(status_code=404, detail="Payout não encontrado")
+    if payout.status != models.PayoutStatus.pending:
+        raise HTTPException(status_code=409, detail="Payout já pago")
 
-    payout.status = "processed"
-    payout.paid_method = payload.method
-    payout.paid_reference = payload.reference
-    payout.paid_at = datetime.utcnow()
-
-    # marca comissões associadas como paid (se existir esse campo/estado)
-    qs = db.query(models.CommissionRecord).filter(models.CommissionRecord.payout_id == payout_id)
-    for c in qs.all():
-        c.status = "paid"
-
+    # payout + comissões ligadas (paid=True) e saldos, em conjunto
+    marcar_payouts_pagos(db, [(payout_id, payload.reference)], payload.method)
     db.commit()
     db.refresh(payout)
 
-    return {"ok": True, "payout_id": payout_id, "status": payout.status}
\ No newline at end of file
+    return {"ok": True, "payout_id": payout_id, "status": payout.status}
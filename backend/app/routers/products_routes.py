@@ -1,17 +1,94 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from decimal import Decimal
+from typing import List, Literal, Optional
 
 from ..database import get_db
 from .. import models, schemas
 from ..deps import get_current_admin
+from ..services.catalog_cache_service import obter_catalogo, etag_corresponde, invalidar_catalogo
+from ..services.search_service import buscar_produtos
+from ..services.product_events_service import publicar_produtos, stream_eventos
+from ..services.products_service import (
+    faceta_de,
+    listar_facetas,
+    paginar_catalogo,
+    sincronizar_produtos,
+)
 
 router = APIRouter()
 
 @router.get("/", response_model=List[schemas.ProductOut])
-def list_products(db: Session = Depends(get_db)):
-    products = db.query(models.Product).filter(models.Product.active == True).all()
-    return products
+def list_products(
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    Catálogo servido de cache em memória (JSON pré-serializado) com ETag.
+    Com `If-None-Match` igual ao ETag actual responde 304 sem corpo.
+    """
+    snap = obter_catalogo(db)
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if etag_corresponde(if_none_match, snap.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snap.body, media_type="application/json", headers=headers)
+
+@router.get("/catalog", response_model=schemas.CatalogPage)
+def catalog_page(
+    category: Optional[str] = Query(None),
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    in_stock: bool = Query(False),
+    sort: Literal["newest", "price_asc", "price_desc"] = Query("newest"),
+    limit: int = Query(24, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+    db: Session = Depends(get_db),
+):
+    """
+    Catálogo paginado (keyset) com filtros, ordenação e contagem por
+    categoria (facetas pré-calculadas, sem GROUP BY por pedido).
+    `GET /products/` continua a devolver a lista completa (cache + ETag).
+    """
+    items, next_cursor = paginar_catalogo(
+        db,
+        category=category,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+        sort=sort,
+        limit=limit,
+        cursor=cursor,
+    )
+    return {"items": items, "next_cursor": next_cursor, "facets": listar_facetas(db)}
+
+@router.get("/search", response_model=List[schemas.ProductOut])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Busca por nome/descrição/categoria, sem acentos, por prefixo (typeahead),
+    ordenada por relevância.
+    """
+    return buscar_produtos(db, q, limit)
+
+@router.get("/stream")
+async def stream_products(last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """
+    Server-Sent Events com as alterações de preço/stock dos produtos:
+    `event: products` com [{id, price, stock, reserved, active}, ...].
+    `event: resync` = o cliente perdeu eventos e deve reler o catálogo.
+    Reconexões com `Last-Event-ID` recebem os eventos em falta (se ainda
+    estiverem no histórico).
+    """
+    return StreamingResponse(
+        stream_eventos(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @router.get("/{product_id}", response_model=schemas.ProductOut)
 def get_product(product_id: str, db: Session = Depends(get_db)):
@@ -24,8 +101,12 @@ def get_product(product_id: str, db: Session = Depends(get_db)):
 def create_product(data: schemas.ProductCreate, db: Session = Depends(get_db), admin = Depends(get_current_admin)):
     product = models.Product(**data.dict())
     db.add(product)
+    db.flush()
+    sincronizar_produtos(db, [product])
     db.commit()
     db.refresh(product)
+    invalidar_catalogo()
+    publicar_produtos(db, [product.id])
     return product
 
 @router.put("/{product_id}", response_model=schemas.ProductOut)
@@ -33,8 +114,12 @@ def update_product(product_id: str, data: schemas.ProductUpdate, db: Session = D
     product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
+    antes = {product.id: faceta_de(product)}
     for field, value in data.dict(exclude_unset=True).items():
         setattr(product, field, value)
+    sincronizar_produtos(db, [product], antes)
     db.commit()
     db.refresh(product)
+    invalidar_catalogo()
+    publicar_produtos(db, [product.id])
     return product
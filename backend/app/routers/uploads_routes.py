@@ -1,20 +1,63 @@
 import os
-import uuid
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, Request
 from fastapi import HTTPException
-from ..config import settings
+from starlette.concurrency import run_in_threadpool
+from ..services.media_service import (
+    gravar_upload_stream,
+    gerar_variantes,
+    ler_arquivo_multipart,
+    url_media,
+    remover_arquivo,
+)
 
 router = APIRouter()
 
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
 @router.post("/image")
-async def upload_image(file: UploadFile = File(...)):
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in [".jpg", ".jpeg", ".png", ".webp"]:
+async def upload_image(request: Request):
+    """
+    Upload em streaming (multipart, campo "file"): o corpo é lido do socket
+    e gravado por chunks com limite de tamanho, sem spool prévio; guarda
+    pelo SHA-256 do conteúdo (o mesmo arquivo só é guardado uma vez) e gera
+    thumbnails/WebP num process pool.
+    """
+    partes = ler_arquivo_multipart(request, "file")
+    primeiro = await anext(partes, None)
+    if primeiro is None:
+        raise HTTPException(status_code=400, detail="Arquivo vazio ou campo 'file' ausente")
+    filename, chunk = primeiro
+
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".jpeg":
+        ext = ".jpg"
+    if ext not in ALLOWED_EXTENSIONS:
+        await partes.aclose()
         raise HTTPException(status_code=400, detail="Formato de imagem inválido")
-    os.makedirs(settings.MEDIA_DIR, exist_ok=True)
-    filename = f"{uuid.uuid4()}{ext}"
-    path = os.path.join(settings.MEDIA_DIR, filename)
-    with open(path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    return {"url": f"/media/{filename}"}
+
+    async def _conteudo():
+        yield chunk
+        async for _, resto in partes:
+            yield resto
+
+    stored = await gravar_upload_stream(_conteudo(), ext)
+
+    try:
+        variants = await gerar_variantes(stored["path"], stored["sha256"])
+    except ValueError:
+        if not stored["deduplicated"]:
+            await run_in_threadpool(remover_arquivo, stored["path"])
+        raise HTTPException(status_code=400, detail="Arquivo não é uma imagem válida")
+
+    original = url_media(stored["path"])
+    return {
+        "url": original,
+        "sha256": stored["sha256"],
+        "size": stored["size"],
+        "deduplicated": stored["deduplicated"],
+        "variants": {
+            "original": original,
+            **{name: url_media(path) for name, path in variants.items()},
+        },
+    }
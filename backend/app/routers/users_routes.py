@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from ..database import get_db
 from .. import models, schemas
 from ..deps import get_current_admin, get_current_user
+from ..services.referrals_service import downline
 
 router = APIRouter()
 
@@ -14,6 +15,29 @@ def get_current_user_profile(
 ):
     return current
 
+@router.get("/me/downline", response_model=List[schemas.DownlineMemberOut])
+def my_downline(
+    max_depth: Optional[int] = Query(None, ge=1, le=64),
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current=Depends(get_current_user),
+):
+    """
+    Rede abaixo do utilizador (indicados directos e indirectos), por nível.
+    """
+    return [
+        schemas.DownlineMemberOut(
+            id=u.id,
+            name=u.name,
+            role=u.role,
+            level=u.level,
+            referred_by_id=u.referred_by_id,
+            depth=depth,
+        )
+        for u, depth in downline(db, current.id, max_depth, limit, offset)
+    ]
+
 @router.get("/", response_model=List[schemas.UserOut])
 def list_users(
     db: Session = Depends(get_db),
@@ -1,7 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import List, Optional
-from pydantic import BaseModel, EmailStr
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, EmailStr, Field, computed_field
 from .models import UserRole, UserLevel, OrderStatus, CommissionType, PayoutStatus
 
 
@@ -29,6 +29,15 @@ class UserOut(UserBase):
         from_attributes = True
 
 
+class DownlineMemberOut(BaseModel):
+    id: str
+    name: str
+    role: UserRole
+    level: UserLevel
+    referred_by_id: Optional[str] = None
+    depth: int  # 1 = indicado directo
+
+
 # Auth
 class Token(BaseModel):
     access_token: str
@@ -42,6 +51,7 @@ class LoginData(BaseModel):
 
 # Products
 class ProductBase(BaseModel):
+    sku: Optional[str] = None
     name: str
     description: Optional[str] = None
     price: Decimal
@@ -58,6 +68,7 @@ class ProductCreate(ProductBase):
 
 
 class ProductUpdate(BaseModel):
+    sku: Optional[str] = None
     name: Optional[str] = None
     description: Optional[str] = None
     price: Optional[Decimal] = None
@@ -72,11 +83,60 @@ class ProductUpdate(BaseModel):
 class ProductOut(ProductBase):
     id: str
     created_at: datetime
+    reserved: int = 0  # preso em pedidos pendentes (ainda não pagos)
+
+    @computed_field
+    @property
+    def available(self) -> int:
+        # `stock` já desconta o reservado
+        return self.stock
 
     class Config:
         from_attributes = True
 
 
+class ProductImportRow(BaseModel):
+    """
+    Linha de POST /admin/products/import. Só os campos presentes na linha
+    são alterados num produto existente; name, price, cost e category são
+    obrigatórios para criar.
+    """
+    sku: str = Field(min_length=1)
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[Decimal] = Field(None, ge=0)
+    cost: Optional[Decimal] = Field(None, ge=0)
+    stock: Optional[int] = Field(None, ge=0)
+    category: Optional[str] = None
+    image_url: Optional[str] = None
+    video_url: Optional[str] = None
+    active: Optional[bool] = None
+
+    class Config:
+        extra = "ignore"
+        str_strip_whitespace = True
+        coerce_numbers_to_str = True  # SKU numérico no NDJSON ({"sku": 12345})
+
+
+class ProductImportError(BaseModel):
+    line: int
+    sku: Optional[str] = None
+    error: str
+
+
+class ProductImportOut(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    errors: List[ProductImportError]
+
+
+class CatalogPage(BaseModel):
+    items: List[ProductOut]
+    next_cursor: Optional[str] = None
+    facets: Dict[str, int]  # categoria -> nº de produtos activos
+
+
 # Orders
 class OrderItemCreate(BaseModel):
     product_id: str
@@ -86,6 +146,31 @@ class OrderItemCreate(BaseModel):
 class OrderCreate(BaseModel):
     items: List[OrderItemCreate]
     points_to_use: int = 0
+    delivery_address: Optional[Dict[str, Any]] = None
+
+
+class BulkOrderIn(BaseModel):
+    ref: Optional[str] = None  # referência do cliente, devolvida no resultado
+    user_id: Optional[str] = None  # comprador (omisso = quem lança)
+    consultant_id: Optional[str] = None  # só admin/staff podem indicar
+    ref_source: Optional[str] = None
+    items: List[OrderItemCreate]
+
+
+class BulkOrderResult(BaseModel):
+    index: int
+    ref: Optional[str] = None
+    ok: bool
+    order_id: Optional[str] = None
+    total_amount: Optional[Decimal] = None
+    error: Optional[str] = None
+    items: Optional[List[Dict[str, Any]]] = None
+
+
+class BulkOrdersOut(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkOrderResult]
 
 
 class OrderItemOut(BaseModel):
@@ -125,6 +210,31 @@ class CommissionRecordOut(BaseModel):
         from_attributes = True
 
 
+class CommissionRuleCreate(BaseModel):
+    commission_type: CommissionType
+    user_level: Optional[UserLevel] = None  # None = qualquer nível
+    category: Optional[str] = None  # None = qualquer categoria
+    rate: Optional[Decimal] = Field(None, ge=0, le=1, decimal_places=4)  # None = remove a regra
+    effective_from: Optional[datetime] = None  # None = agora
+    note: Optional[str] = None
+
+
+class CommissionRuleOut(BaseModel):
+    id: str
+    version: int
+    commission_type: CommissionType
+    user_level: Optional[UserLevel] = None
+    category: Optional[str] = None
+    rate: Optional[Decimal] = None
+    effective_from: datetime
+    note: Optional[str] = None
+    created_by_id: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 class PayoutOut(BaseModel):
     id: str
     period_start: datetime
@@ -0,0 +1,212 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ..models import Order, OrderItem, OrderStatus, Product, User, UserRole
+from ..schemas import BulkOrderIn
+from .product_events_service import publicar_produtos
+from .points_service import adicionar_pontos_em_lote, calcular_pontos_ganhos
+from .stock_service import agregar_demanda, carregar_produtos, reservar_stock
+
+BATCH_SIZE = 1000
+IN_CHUNK = 1000
+_MAX_TENTATIVAS = 3
+
+# (index, pedido válido | None, erro de parse | None)
+Entrada = Tuple[int, Optional[BulkOrderIn], Optional[str]]
+
+
+def _chunks(rows: List[Any], size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _carregar_users(db: Session, user_ids: Iterable[str]) -> Dict[str, User]:
+    ids = sorted(set(user_ids))
+    users: Dict[str, User] = {}
+    for chunk in _chunks(ids, IN_CHUNK):
+        for u in db.query(User).filter(User.id.in_(chunk)).all():
+            users[u.id] = u
+    return users
+
+
+def _falha(index: int, pedido: Optional[BulkOrderIn], error: str, items=None) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "ref": pedido.ref if pedido else None,
+        "ok": False,
+        "error": error,
+        "items": items,
+    }
+
+
+def _alocar(
+    pedidos: List[Tuple[int, BulkOrderIn, Dict[str, int]]],
+    products: Dict[str, Product],
+):
+    """
+    Distribui o stock pelos pedidos, pela ordem de entrada.
+    Retorna (aceites, demanda agregada por SKU, falhas).
+    """
+    restante = {pid: int(p.stock or 0) for pid, p in products.items()}
+    aceites, falhas = [], []
+    demanda_total: Dict[str, int] = {}
+
+    for index, pedido, demanda in pedidos:
+        faltam = [
+            {
+                "product_id": pid,
+                "name": products[pid].name,
+                "available": restante[pid],
+                "requested": qty,
+            }
+            for pid, qty in demanda.items()
+            if restante[pid] < qty
+        ]
+        if faltam:
+            falhas.append(_falha(index, pedido, "Sem stock", faltam))
+            continue
+
+        for pid, qty in demanda.items():
+            restante[pid] -= qty
+            demanda_total[pid] = demanda_total.get(pid, 0) + qty
+        aceites.append((index, pedido, demanda))
+
+    return aceites, demanda_total, falhas
+
+
+def importar_orders_em_lote(db: Session, current: User, entradas: List[Entrada]) -> Dict[str, Any]:
+    """
+    Lança muitos pedidos (vendas offline) numa única transacção:
+    - valida stock de todos com a procura agregada por SKU
+    - baixa stock num único batch (ver stock_service.reservar_stock)
+    - insere Order/OrderItem com INSERTs multi-linha em lotes de BATCH_SIZE
+    - atribui pontos em lote
+
+    Pedidos inválidos ou sem stock são reportados e não impedem os outros.
+    Os pedidos nascem PENDING, como em POST /orders/, mas sem etiqueta de
+    impressão nem reserva com expiração (a venda offline já foi entregue).
+    """
+    current_id = current.id
+    is_consultant = current.role == UserRole.consultant
+
+    results: List[Dict[str, Any]] = []
+    validos: List[Tuple[int, BulkOrderIn, Dict[str, int]]] = []
+
+    for index, pedido, erro in entradas:
+        if erro or pedido is None:
+            results.append(_falha(index, pedido, erro or "Pedido inválido"))
+            continue
+        if not pedido.items:
+            results.append(_falha(index, pedido, "Carrinho vazio"))
+            continue
+        if any(int(i.quantity or 0) <= 0 for i in pedido.items):
+            results.append(_falha(index, pedido, "Quantidade inválida"))
+            continue
+        validos.append((index, pedido, agregar_demanda(pedido.items)))
+
+    # ✅ utilizadores e produtos de todo o lote em poucas queries IN
+    user_ids = {current_id}
+    for _, pedido, _ in validos:
+        user_ids.add(pedido.user_id or current_id)
+        if pedido.consultant_id and not is_consultant:
+            user_ids.add(pedido.consultant_id)
+    users = _carregar_users(db, user_ids)
+
+    product_ids = {pid for _, _, demanda in validos for pid in demanda}
+    products = carregar_produtos(db, product_ids)
+
+    pedidos = []
+    for index, pedido, demanda in validos:
+        if (pedido.user_id or current_id) not in users:
+            results.append(_falha(index, pedido, f"Utilizador {pedido.user_id} não encontrado"))
+        elif pedido.consultant_id and not is_consultant and pedido.consultant_id not in users:
+            results.append(_falha(index, pedido, f"Consultor {pedido.consultant_id} não encontrado"))
+        else:
+            missing = next((pid for pid in demanda if pid not in products), None)
+            if missing:
+                results.append(_falha(index, pedido, f"Produto {missing} não encontrado"))
+            else:
+                pedidos.append((index, pedido, demanda))
+
+    # ✅ alocação + reserva; se o stock mudou entre o SELECT e o UPDATE, realoca
+    aceites, falhas = [], []
+    for _ in range(_MAX_TENTATIVAS):
+        aceites, demanda_total, falhas = _alocar(pedidos, products)
+        if not demanda_total or not reservar_stock(db, products, demanda_total):
+            break
+    else:
+        falhas = [_falha(index, pedido, "Sem stock") for index, pedido, _ in pedidos]
+        aceites = []
+    results.extend(falhas)
+
+    now = datetime.utcnow()
+    order_rows: List[Dict[str, Any]] = []
+    item_rows: List[Dict[str, Any]] = []
+    pontos: List[Tuple[str, int, str, Optional[str]]] = []
+
+    for index, pedido, _ in aceites:
+        order_id = str(uuid.uuid4())
+        buyer = users[pedido.user_id or current_id]
+
+        total = Decimal("0.00")
+        for item in pedido.items:
+            price = products[item.product_id].price
+            total += Decimal(price) * int(item.quantity)
+            item_rows.append({
+                "id": str(uuid.uuid4()),
+                "order_id": order_id,
+                "product_id": item.product_id,
+                "quantity": int(item.quantity),
+                "unit_price": price,
+            })
+
+        if is_consultant:
+            consultant_id = current_id
+        else:
+            consultant_id = pedido.consultant_id
+
+        points_earned = int(calcular_pontos_ganhos(buyer, total) or 0)
+        if points_earned > 0:
+            pontos.append((buyer.id, points_earned, "Pontos por compra", order_id))
+
+        order_rows.append({
+            "id": order_id,
+            "user_id": buyer.id,
+            "consultant_id": consultant_id,
+            "status": OrderStatus.pending,
+            "total_amount": total,
+            "discount_amount": Decimal("0.00"),
+            "points_used": 0,
+            "points_earned": points_earned,
+            "created_at": now,
+            "ref_source": pedido.ref_source,
+        })
+        results.append({
+            "index": index,
+            "ref": pedido.ref,
+            "ok": True,
+            "order_id": order_id,
+            "total_amount": total,
+        })
+
+    for chunk in _chunks(order_rows, BATCH_SIZE):
+        db.execute(insert(Order), chunk)
+    for chunk in _chunks(item_rows, BATCH_SIZE):
+        db.execute(insert(OrderItem), chunk)
+
+    adicionar_pontos_em_lote(db, pontos)
+
+    db.commit()
+    publicar_produtos(db, demanda_total.keys())
+
+    results.sort(key=lambda r: r["index"])
+    return {
+        "created": len(order_rows),
+        "failed": len(results) - len(order_rows),
+        "results": results,
+    }
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Product
+from ..schemas import ProductOut
+
+_products_adapter = TypeAdapter(List[ProductOut])
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    body: bytes  # JSON já serializado
+    etag: str
+    built_at: float
+
+
+# versão actual do catálogo; cada escrita de admin incrementa
+_version = 0
+_snapshot: Optional[CatalogSnapshot] = None
+_state_lock = threading.Lock()
+# só um rebuild de cada vez: misses concorrentes esperam por ele
+_build_lock = threading.Lock()
+
+
+def invalidar_catalogo():
+    """
+    Chamar depois de qualquer escrita em produtos (commit feito).
+    O rebuild é preguiçoso: acontece no próximo GET.
+    """
+    global _version
+    with _state_lock:
+        _version += 1
+
+
+def _fresco(snap: Optional[CatalogSnapshot]) -> bool:
+    if snap is None or snap.version != _version:
+        return False
+    # TTL curto: apanha mudanças de stock por pedidos e escritas noutros workers
+    return time.monotonic() - snap.built_at < settings.CATALOG_CACHE_TTL_SECONDS
+
+
+def _construir(db: Session, version: int) -> CatalogSnapshot:
+    products = db.query(Product).filter(Product.active == True).all()
+    body = _products_adapter.dump_json(
+        _products_adapter.validate_python(products, from_attributes=True)
+    )
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return CatalogSnapshot(version=version, body=body, etag=etag, built_at=time.monotonic())
+
+
+def obter_catalogo(db: Session) -> CatalogSnapshot:
+    """
+    Lista de produtos activos como bytes JSON + ETag forte (hash do conteúdo).
+    """
+    global _snapshot
+    snap = _snapshot
+    if _fresco(snap):
+        return snap
+
+    with _build_lock:
+        snap = _snapshot
+        if _fresco(snap):
+            return snap  # outro pedido acabou de reconstruir
+
+        version = _version  # lida antes da query: invalidação a meio força novo rebuild
+        snap = _construir(db, version)
+        _snapshot = snap
+        return snap
+
+
+def etag_corresponde(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Comparação fraca do If-None-Match (RFC 9110): ignora o prefixo W/.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
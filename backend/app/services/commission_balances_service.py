@@ -0,0 +1,219 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..models import CommissionBalance, CommissionRecord
+
+# =========================================================
+# Saldos de comissões por beneficiário (commission_balances)
+#
+# Cada escrita em commission_records acumula deltas
+# {beneficiary_id: {coluna: delta}} e aplica-os com aplicar_saldos()
+# ANTES do commit, na mesma transacção: o resumo do consultor passa a
+# ser um SELECT por chave primária.
+# Status fora de COMMISSION_STATUSES não entram nos saldos (nem na
+# reconstrução/verificação).
+# =========================================================
+
+COMMISSION_STATUSES = ("pending", "eligible", "locked", "paid", "void")
+SALDO_COLUNAS = tuple(f"total_{s}" for s in COMMISSION_STATUSES) + ("paid_total",)
+ZERO = Decimal("0.00")
+
+Deltas = Dict[str, Dict[str, Decimal]]
+
+
+def _coluna(status: Optional[str]) -> Optional[str]:
+    return f"total_{status}" if status in COMMISSION_STATUSES else None
+
+
+def registrar_delta(
+    deltas: Deltas,
+    beneficiary_id: str,
+    amount: Any,
+    status: Optional[str],
+    paid: bool = False,
+    sinal: int = 1,
+):
+    """Soma (sinal=1) ou retira (sinal=-1) uma comissão dos saldos."""
+    valor = Decimal(amount or 0) * sinal
+    if not valor:
+        return
+    saldo = deltas.setdefault(beneficiary_id, {})
+    coluna = _coluna(status)
+    if coluna:
+        saldo[coluna] = saldo.get(coluna, ZERO) + valor
+    if paid:
+        saldo["paid_total"] = saldo.get("paid_total", ZERO) + valor
+
+
+def aplicar_saldos(db: Session, deltas: Deltas):
+    """
+    UPSERT de `commission_balances.<coluna> += delta`, um executemany para
+    todos os beneficiários (ordenados: ordem de lock estável no Postgres).
+    """
+    now = datetime.utcnow()
+    rows = []
+    for beneficiary_id in sorted(deltas):
+        saldo = deltas[beneficiary_id]
+        if not any(saldo.values()):
+            continue
+        rows.append({
+            "beneficiary_id": beneficiary_id,
+            **{c: saldo.get(c, ZERO) for c in SALDO_COLUNAS},
+            "updated_at": now,
+        })
+    if not rows:
+        return
+
+    table = CommissionBalance.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.beneficiary_id],
+            set_={
+                **{c: table.c[c] + stmt.excluded[c] for c in SALDO_COLUNAS},
+                "updated_at": now,
+            },
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        updated = (
+            db.query(CommissionBalance)
+            .filter(CommissionBalance.beneficiary_id == row["beneficiary_id"])
+            .update(
+                {
+                    **{c: getattr(CommissionBalance, c) + row[c] for c in SALDO_COLUNAS},
+                    "updated_at": row["updated_at"],
+                },
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            db.add(CommissionBalance(**row))
+
+
+def transicionar_comissoes(
+    db: Session,
+    commissions: Iterable[CommissionRecord],
+    status: Optional[str] = None,
+    paid: Optional[bool] = None,
+):
+    """
+    Muda status e/ou o bool paid de comissões carregadas (ORM) e ajusta
+    os saldos pela diferença. Não faz commit.
+    """
+    deltas: Deltas = {}
+    for c in commissions:
+        novo_status = c.status if status is None else status
+        novo_paid = bool(c.paid) if paid is None else paid
+        if novo_status == c.status and novo_paid == bool(c.paid):
+            continue
+        registrar_delta(deltas, c.beneficiary_id, c.amount, c.status, bool(c.paid), sinal=-1)
+        registrar_delta(deltas, c.beneficiary_id, c.amount, novo_status, novo_paid)
+        c.status = novo_status
+        c.paid = novo_paid
+    aplicar_saldos(db, deltas)
+
+
+# ---------------------------------------------------------
+# Leitura
+# ---------------------------------------------------------
+def saldo_de(db: Session, beneficiary_id: str) -> Dict[str, Any]:
+    """Resumo do painel do consultor: um SELECT por chave primária."""
+    b = db.get(CommissionBalance, beneficiary_id)
+    by_status = {s: float(getattr(b, f"total_{s}") or 0) if b else 0.0 for s in COMMISSION_STATUSES}
+    return {
+        "beneficiary_id": beneficiary_id,
+        "total": float(sum(by_status.values())),
+        "by_status": by_status,
+        "paid_total": float(b.paid_total or 0) if b else 0.0,
+    }
+
+
+# ---------------------------------------------------------
+# Reconstrução / verificação contra commission_records
+# ---------------------------------------------------------
+def _agregado():
+    amount = CommissionRecord.amount
+    return (
+        select(
+            CommissionRecord.beneficiary_id,
+            *[
+                func.coalesce(func.sum(case((CommissionRecord.status == s, amount), else_=0)), 0)
+                for s in COMMISSION_STATUSES
+            ],
+            func.coalesce(func.sum(case((CommissionRecord.paid == True, amount), else_=0)), 0),
+        )
+        .group_by(CommissionRecord.beneficiary_id)
+    )
+
+
+def reconstruir_saldos(db: Session, apenas_se_vazio: bool = True) -> int:
+    """
+    Recalcula commission_balances a partir de commission_records
+    (arranque/reparação): DELETE + um INSERT ... SELECT agrupado.
+    Retorna o nº de beneficiários.
+    """
+    if apenas_se_vazio and db.query(CommissionBalance.beneficiary_id).first() is not None:
+        return 0
+    if apenas_se_vazio and db.query(CommissionRecord.id).first() is None:
+        return 0
+
+    db.query(CommissionBalance).delete(synchronize_session=False)
+    table = CommissionBalance.__table__
+    db.execute(
+        table.insert().from_select(
+            ["beneficiary_id", *SALDO_COLUNAS],
+            _agregado(),
+        )
+    )
+    db.query(CommissionBalance).update({"updated_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return db.query(func.count(CommissionBalance.beneficiary_id)).scalar() or 0
+
+
+def _q(valor: Any) -> Decimal:
+    return Decimal(valor or 0).quantize(Decimal("0.01"))
+
+
+def verificar_saldos(db: Session, limit: int = 100) -> Dict[str, Any]:
+    """
+    Compara commission_balances com o agregado das comissões.
+    Retorna contagens e até `limit` divergências (esperado vs guardado).
+    """
+    esperado = {
+        r[0]: dict(zip(SALDO_COLUNAS, (_q(v) for v in r[1:])))
+        for r in db.execute(_agregado()).all()
+    }
+    guardado = {
+        b.beneficiary_id: {c: _q(getattr(b, c)) for c in SALDO_COLUNAS}
+        for b in db.query(CommissionBalance).all()
+    }
+
+    vazio = {c: ZERO for c in SALDO_COLUNAS}
+    mismatches: List[Dict[str, Any]] = []
+    total = 0
+    for beneficiary_id in sorted(set(esperado) | set(guardado)):
+        exp = esperado.get(beneficiary_id, vazio)
+        got = guardado.get(beneficiary_id, vazio)
+        diff = {c: {"expected": str(exp[c]), "stored": str(got[c])} for c in SALDO_COLUNAS if exp[c] != got[c]}
+        if not diff:
+            continue
+        total += 1
+        if len(mismatches) < limit:
+            mismatches.append({"beneficiary_id": beneficiary_id, "columns": diff})
+
+    return {
+        "beneficiaries": len(set(esperado) | set(guardado)),
+        "ok": total == 0,
+        "mismatched": total,
+        "mismatches": mismatches,
+    }
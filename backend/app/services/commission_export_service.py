@@ -0,0 +1,146 @@
+import csv
+import io
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy.orm import Query
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import CommissionRecord, CommissionType, User
+
+# =========================================================
+# Listagem admin (keyset) e exportação CSV das comissões
+#
+# Filtros partilhados pela listagem e pelo export; cada filtro tem um
+# índice composto terminado em (created_at, id), a ordem do keyset.
+# O export lê com yield_per (cursor do lado do servidor no Postgres) e
+# escreve o CSV em blocos: memória constante para qualquer nº de linhas.
+# =========================================================
+
+CSV_COLUMNS = (
+    "id",
+    "created_at",
+    "beneficiary_id",
+    "beneficiary_name",
+    "beneficiary_phone",
+    "order_id",
+    "type",
+    "status",
+    "amount",
+    "rate",
+    "rule_version",
+    "paid",
+    "eligible_at",
+    "payout_id",
+)
+
+
+def _data(value: Optional[str]) -> Optional[datetime]:
+    # filtros de data (string -> datetime) sem quebrar
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def filtrar_comissoes(
+    q: Query,
+    beneficiary_id: Optional[str] = None,
+    order_id: Optional[str] = None,
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> Query:
+    if beneficiary_id:
+        q = q.filter(CommissionRecord.beneficiary_id == beneficiary_id)
+
+    if order_id:
+        q = q.filter(CommissionRecord.order_id == order_id)
+
+    if status:
+        q = q.filter(CommissionRecord.status == status)
+
+    if type:
+        # aceita string igual ao Enum (ex.: "consultant")
+        try:
+            q = q.filter(CommissionRecord.type == CommissionType(type))
+        except ValueError:
+            pass
+
+    dt_from = _data(date_from)
+    if dt_from:
+        q = q.filter(CommissionRecord.created_at >= dt_from)
+
+    dt_to = _data(date_to)
+    if dt_to:
+        q = q.filter(CommissionRecord.created_at <= dt_to)
+
+    return q
+
+
+def _celula(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, CommissionType):
+        return value.value
+    return str(value)
+
+
+def gerar_csv_comissoes(**filtros) -> Iterator[bytes]:
+    """
+    Gerador para StreamingResponse: CSV (UTF-8 com BOM, para o Excel) por
+    ordem de (created_at, id). Usa a sua própria sessão: a do request já
+    fechou quando a resposta começa a ser enviada.
+    """
+    batch = settings.COMMISSION_EXPORT_BATCH
+    db = SessionLocal()
+    try:
+        q = (
+            db.query(
+                CommissionRecord.id,
+                CommissionRecord.created_at,
+                CommissionRecord.beneficiary_id,
+                User.name,
+                User.phone,
+                CommissionRecord.order_id,
+                CommissionRecord.type,
+                CommissionRecord.status,
+                CommissionRecord.amount,
+                CommissionRecord.rate,
+                CommissionRecord.rule_version,
+                CommissionRecord.paid,
+                CommissionRecord.eligible_at,
+                CommissionRecord.payout_id,
+            )
+            .outerjoin(User, User.id == CommissionRecord.beneficiary_id)
+        )
+        q = (
+            filtrar_comissoes(q, **filtros)
+            .order_by(CommissionRecord.created_at, CommissionRecord.id)
+            .execution_options(yield_per=batch)
+        )
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        buf.write("\ufeff")
+        writer.writerow(CSV_COLUMNS)
+
+        pendentes = 0
+        for row in q:
+            writer.writerow([_celula(v) for v in row])
+            pendentes += 1
+            if pendentes >= batch:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+                pendentes = 0
+
+        yield buf.getvalue().encode("utf-8")
+    finally:
+        db.close()
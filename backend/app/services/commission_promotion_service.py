@@ -0,0 +1,134 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import CommissionPromotionRun, CommissionRecord
+from .commission_balances_service import Deltas, aplicar_saldos, registrar_delta
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# Job pending -> eligible das comissões (eligible_at vencido)
+#
+# - blocos de COMMISSION_PROMOTION_CHUNK: um UPDATE ... WHERE id IN
+#   (SELECT ... LIMIT n) RETURNING por bloco, guiado pelo índice
+#   ix_commission_status_eligible_at; um commit por bloco (com os saldos)
+# - watermark: cada execução cobre eligible_at em (watermark anterior
+#   - LOOKBACK, agora]; o LOOKBACK apanha comissões gravadas com
+#   eligible_at já no passado (recálculo, relógios). full=True ignora-o.
+# - cada execução fica em commission_promotion_runs (contagens, duração)
+# =========================================================
+
+
+def _ultimo_watermark(db: Session) -> Optional[datetime]:
+    return (
+        db.query(CommissionPromotionRun.watermark_to)
+        .filter(CommissionPromotionRun.status == "done")
+        .order_by(CommissionPromotionRun.watermark_to.desc())
+        .limit(1)
+        .scalar()
+    )
+
+
+def _promover_bloco(db: Session, desde: Optional[datetime], ate: datetime, chunk: int) -> int:
+    filtro = [CommissionRecord.status == "pending", CommissionRecord.eligible_at <= ate]
+    if desde is not None:
+        filtro.append(CommissionRecord.eligible_at > desde)
+    ids = (
+        select(CommissionRecord.id)
+        .where(*filtro)
+        .order_by(CommissionRecord.eligible_at)  # ordem do índice, sem sort
+        .limit(chunk)
+    )
+
+    table = CommissionRecord.__table__
+    dialect = db.get_bind().dialect
+    if dialect.update_returning:
+        where = [table.c.id.in_(ids.scalar_subquery())]
+        if dialect.name != "sqlite":
+            # Postgres: volta a exigir pending depois do lock da linha (void concorrente).
+            # No SQLite a escrita é serializada e este filtro faria o planner
+            # percorrer todas as pending pelo índice em vez de ir por id.
+            where.append(table.c.status == "pending")
+        stmt = (
+            update(table)
+            .where(*where)
+            .values(status="eligible")
+            .returning(table.c.beneficiary_id, table.c.amount, table.c.paid)
+        )
+        rows = db.execute(stmt).all()
+    else:
+        rows = (
+            db.query(CommissionRecord.id, CommissionRecord.beneficiary_id, CommissionRecord.amount, CommissionRecord.paid)
+            .filter(CommissionRecord.id.in_(ids.scalar_subquery()))
+            .all()
+        )
+        (
+            db.query(CommissionRecord)
+            .filter(CommissionRecord.id.in_([r.id for r in rows]), CommissionRecord.status == "pending")
+            .update({"status": "eligible"}, synchronize_session=False)
+        )
+
+    deltas: Deltas = {}
+    for r in rows:
+        registrar_delta(deltas, r.beneficiary_id, r.amount, "pending", bool(r.paid), sinal=-1)
+        registrar_delta(deltas, r.beneficiary_id, r.amount, "eligible", bool(r.paid))
+    aplicar_saldos(db, deltas)
+    db.commit()
+    return len(rows)
+
+
+def promover_comissoes_elegiveis(db: Session, full: bool = False, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Passa a eligible as comissões pending com eligible_at <= agora.
+    Retorna o registo da execução (commission_promotion_runs).
+    """
+    chunk_size = chunk_size or settings.COMMISSION_PROMOTION_CHUNK
+    ate = datetime.utcnow()
+    ultimo = None if full else _ultimo_watermark(db)
+    desde = ultimo - timedelta(hours=settings.COMMISSION_PROMOTION_LOOKBACK_HOURS) if ultimo else None
+
+    run = CommissionPromotionRun(status="running", watermark_from=desde, watermark_to=ate, started_at=ate)
+    db.add(run)
+    db.commit()
+
+    started = time.perf_counter()
+    try:
+        while True:
+            n = _promover_bloco(db, desde, ate, chunk_size)
+            run.promoted += n
+            run.chunks += 1
+            if n < chunk_size:
+                break
+        run.status = "done"
+    except Exception as e:
+        db.rollback()
+        run.status = "failed"
+        run.error = str(e)[:2000]
+        logger.exception("Promoção de comissões falhou")
+    finally:
+        run.duration_ms = int((time.perf_counter() - started) * 1000)
+        run.finished_at = datetime.utcnow()
+        db.commit()
+
+    if run.promoted:
+        logger.info(
+            "Comissões pending -> eligible: %s em %s blocos (%sms)",
+            run.promoted, run.chunks, run.duration_ms,
+        )
+    return run.to_dict()
+
+
+def listar_execucoes(db: Session, limit: int = 20) -> List[Dict[str, Any]]:
+    runs = (
+        db.query(CommissionPromotionRun)
+        .order_by(CommissionPromotionRun.started_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [r.to_dict() for r in runs]
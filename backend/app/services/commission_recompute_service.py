@@ -0,0 +1,453 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import CommissionRecord, CommissionType, Order, OrderStatus, User, UserLevel, UserRole
+from . import commissions_service
+from .commission_balances_service import Deltas, aplicar_saldos, registrar_delta
+from .commission_rules_service import TabelaComissoes, obter_tabela
+from .commissions_service import (
+    calcular_comissoes,
+    categorias_por_order,
+    centimos as _centimos,
+    em_decimal as _em_decimal,
+    inserir_comissoes,
+)
+from .referrals_service import uplines_em_lote
+
+# =========================================================
+# Recálculo em lote das comissões de pedidos pagos num intervalo
+#
+# - pedidos lidos por keyset em (paid_at, id), em blocos
+# - consultores resolvidos com SELECT ... IN (cache partilhada entre
+#   blocos); uplines de todos os níveis numa query à closure table
+# - taxas da tabela de regras compilada, na data paid_at de cada pedido
+#   (mesmo cálculo em cêntimos do fluxo normal: commissions_service)
+# - diff contra as comissões existentes: INSERT / UPDATE em batch;
+#   comissões que deixaram de existir passam a "void"
+# - comissões já em payout (locked/paid, ou com payout_id) nunca são
+#   alteradas: aparecem como `frozen` no relatório
+# - uma linha void do beneficiário certo é reactivada (`reactivate`):
+#   só entram pedidos pagos, e reembolso/cancelamento tira o pedido
+#   desse estado, por isso a void foi feita por um recálculo anterior
+#   (ex.: reparentar e voltar atrás); void com payout_id fica frozen
+# - commission_balances ajustado no mesmo commit de cada bloco
+# - dry_run: só calcula o diff
+# =========================================================
+
+PAID_STATUSES = (OrderStatus.paid, OrderStatus.shipped, OrderStatus.completed)
+FROZEN_STATUSES = ("locked", "paid", "void")
+IN_CHUNK = 1000
+
+_REACTIVAR_STMT = (
+    update(CommissionRecord.__table__)
+    .where(
+        CommissionRecord.__table__.c.id == bindparam("b_id"),
+        CommissionRecord.__table__.c.status == "void",
+        CommissionRecord.__table__.c.payout_id.is_(None),
+    )
+    .values(
+        status=bindparam("b_status"),
+        paid=False,
+        amount=bindparam("b_amount"),
+        rate=bindparam("b_rate"),
+        rule_version=bindparam("b_rule_version"),
+        eligible_at=bindparam("b_eligible_at"),
+    )
+)
+
+_UPDATE_STMT = (
+    update(CommissionRecord.__table__)
+    .where(CommissionRecord.__table__.c.id == bindparam("b_id"))
+    .values(
+        beneficiary_id=bindparam("b_beneficiary_id"),
+        amount=bindparam("b_amount"),
+        rate=bindparam("b_rate"),
+        rule_version=bindparam("b_rule_version"),
+    )
+)
+
+# (order_id, tipo) -> (beneficiary_id, cêntimos, rate, rule_version)
+Desejado = Dict[Tuple[str, CommissionType], Tuple[str, int, Decimal, int]]
+
+
+def _chunks(values: List[Any], size: int):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class _Rede:
+    """Cache id -> role/level de compradores e beneficiários, carregada em lote."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.roles: Dict[str, UserRole] = {}
+        self.levels: Dict[str, UserLevel] = {}
+
+    def carregar(self, ids: Iterable[str]):
+        faltam = sorted({i for i in ids if i and i not in self.roles})
+        for chunk in _chunks(faltam, IN_CHUNK):
+            rows = (
+                self.db.query(User.id, User.role, User.level)
+                .filter(User.id.in_(chunk))
+                .all()
+            )
+            for r in rows:
+                self.roles[r.id] = r.role
+                self.levels[r.id] = r.level
+
+
+def _consultor_da_order(order, rede: _Rede) -> Optional[str]:
+    if order.consultant_id:
+        return order.consultant_id
+    if rede.roles.get(order.user_id) == UserRole.consultant:
+        return order.user_id
+    return None
+
+
+def _calcular_bloco(orders: List[Any], rede: _Rede, tabela: TabelaComissoes) -> Desejado:
+    desejado: Desejado = {}
+    if not tabela.niveis:
+        return desejado
+
+    rede.carregar(o.consultant_id or o.user_id for o in orders)
+
+    consultores = {o.id: _consultor_da_order(o, rede) for o in orders}
+    ids = {c for c in consultores.values() if c}
+    cadeias = {
+        cid: [cid] + ups
+        for cid, ups in uplines_em_lote(rede.db, ids, len(tabela.niveis) - 1).items()
+    }
+    rede.carregar(b for cadeia in cadeias.values() for b in cadeia)
+    categorias = categorias_por_order(rede.db, [o.id for o in orders if consultores[o.id]])
+
+    for o in orders:
+        cid = consultores[o.id]
+        if not cid:
+            continue
+        base = _centimos(o.total_amount) - _centimos(o.discount_amount)
+        if base <= 0:
+            continue
+        cadeia = [(b, rede.levels.get(b)) for b in cadeias[cid]]
+        for ctype, beneficiary_id, amount, rate, version in calcular_comissoes(
+            tabela, base, categorias.get(o.id, {}), cadeia, o.paid_at
+        ):
+            desejado[(o.id, ctype)] = (beneficiary_id, amount, rate, version)
+    return desejado
+
+
+def _existentes(db: Session, order_ids: List[str]) -> Dict[Tuple[str, CommissionType], List[Any]]:
+    rows = (
+        db.query(
+            CommissionRecord.id,
+            CommissionRecord.order_id,
+            CommissionRecord.type,
+            CommissionRecord.beneficiary_id,
+            CommissionRecord.amount,
+            CommissionRecord.rate,
+            CommissionRecord.rule_version,
+            CommissionRecord.status,
+            CommissionRecord.paid,
+            CommissionRecord.payout_id,
+        )
+        .filter(CommissionRecord.order_id.in_(order_ids))
+        .all()
+    )
+    out: Dict[Tuple[str, CommissionType], List[Any]] = {}
+    for r in rows:
+        out.setdefault((r.order_id, r.type), []).append(r)
+    return out
+
+
+def _congelada(row) -> bool:
+    return row.status in FROZEN_STATUSES or row.payout_id is not None
+
+
+def _estado(row) -> Dict[str, Any]:
+    # status/paid actuais, para ajustar commission_balances ao gravar
+    return {"status": row.status, "paid": bool(row.paid)}
+
+
+def _diff(
+    orders: List[Any],
+    desejado: Desejado,
+    existentes: Dict[Tuple[str, CommissionType], List[Any]],
+    now: datetime,
+) -> Dict[str, List[Dict[str, Any]]]:
+    paid_at = {o.id: o.paid_at for o in orders}
+    diff = {"insert": [], "update": [], "reactivate": [], "void": [], "frozen": [], "unchanged": []}
+
+    for key in set(desejado) | set(existentes):
+        order_id, ctype = key
+        novo = desejado.get(key)
+        rows = existentes.get(key, [])
+        activas = [r for r in rows if r.status != "void"]
+
+        # prefere a linha do mesmo beneficiário; as restantes sobram
+        atual = None
+        if activas:
+            atual = next((r for r in activas if novo and r.beneficiary_id == novo[0]), activas[0])
+        sobras = [r for r in activas if r is not atual]
+
+        change = {"order_id": order_id, "type": ctype.value}
+        if novo:
+            change.update(
+                beneficiary_id=novo[0],
+                new_amount=_em_decimal(novo[1]),
+                rate=novo[2],
+                rule_version=novo[3],
+            )
+
+        # linha void do beneficiário novo (unique por beneficiário/pedido/tipo)
+        void_novo = next((r for r in rows if novo and r.beneficiary_id == novo[0] and r.status == "void"), None)
+
+        if atual is None:
+            if novo:
+                if void_novo is None:
+                    diff["insert"].append(change)
+                elif void_novo.payout_id is not None:
+                    diff["frozen"].append(change)
+                else:
+                    change.update(id=void_novo.id, old_amount=void_novo.amount, **_estado(void_novo))
+                    diff["reactivate"].append(change)
+        elif _congelada(atual):
+            if not novo or (atual.beneficiary_id, _centimos(atual.amount)) != (novo[0], novo[1]):
+                change["old_amount"] = atual.amount
+                diff["frozen"].append(change)
+            else:
+                diff["unchanged"].append(change)
+        elif not novo:
+            change.update(id=atual.id, beneficiary_id=atual.beneficiary_id, old_amount=atual.amount, **_estado(atual))
+            diff["void"].append(change)
+        elif atual.beneficiary_id != novo[0] and void_novo is not None:
+            # o novo beneficiário já tem a linha (void) desta chave: mover a
+            # actual para cima dela violaria uq_commission_beneficiary_order_type;
+            # a actual passa a void e a do novo volta a valer
+            diff["void"].append({
+                "id": atual.id,
+                "order_id": order_id,
+                "type": ctype.value,
+                "beneficiary_id": atual.beneficiary_id,
+                "old_amount": atual.amount,
+                **_estado(atual),
+            })
+            if void_novo.payout_id is not None:
+                diff["frozen"].append(change)
+            else:
+                change.update(id=void_novo.id, old_amount=void_novo.amount, **_estado(void_novo))
+                diff["reactivate"].append(change)
+        elif (
+            atual.beneficiary_id != novo[0]
+            or _centimos(atual.amount) != novo[1]
+            or (atual.rate is not None and Decimal(atual.rate) != novo[2])
+            or (atual.rule_version is not None and atual.rule_version != novo[3])
+        ):
+            change.update(
+                id=atual.id,
+                old_amount=atual.amount,
+                old_beneficiary_id=atual.beneficiary_id,
+                **_estado(atual),
+            )
+            diff["update"].append(change)
+        else:
+            diff["unchanged"].append(change)
+
+        for r in sobras:
+            if _congelada(r):
+                continue
+            diff["void"].append({
+                "id": r.id,
+                "order_id": order_id,
+                "type": ctype.value,
+                "beneficiary_id": r.beneficiary_id,
+                "old_amount": r.amount,
+                **_estado(r),
+            })
+
+    for change in diff["insert"] + diff["reactivate"]:
+        change["paid_at"] = paid_at.get(change["order_id"]) or now
+    return diff
+
+
+def _gravar(db: Session, diff: Dict[str, List[Dict[str, Any]]], now: datetime):
+    days = commissions_service.ELIGIBILITY_DAYS or 0
+    rows = []
+    for c in diff["insert"]:
+        eligible_at = c["paid_at"] + timedelta(days=days)
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "beneficiary_id": c["beneficiary_id"],
+            "order_id": c["order_id"],
+            "amount": c["new_amount"],
+            "type": CommissionType(c["type"]),
+            "created_at": now,
+            "paid": False,
+            "status": "eligible" if eligible_at <= now else "pending",
+            "rate": c["rate"],
+            "rule_version": c["rule_version"],
+            "eligible_at": eligible_at,
+            "payout_id": None,
+        })
+    for chunk in _chunks(rows, IN_CHUNK):
+        inserir_comissoes(db, chunk)
+
+    deltas: Deltas = {}
+    for c in diff["update"]:
+        registrar_delta(deltas, c["old_beneficiary_id"], c["old_amount"], c["status"], c["paid"], sinal=-1)
+        registrar_delta(deltas, c["beneficiary_id"], c["new_amount"], c["status"], c["paid"])
+
+    if diff["update"]:
+        db.execute(
+            _UPDATE_STMT,
+            [
+                {
+                    "b_id": c["id"],
+                    "b_beneficiary_id": c["beneficiary_id"],
+                    "b_amount": c["new_amount"],
+                    "b_rate": c["rate"],
+                    "b_rule_version": c["rule_version"],
+                }
+                for c in diff["update"]
+            ],
+        )
+
+    # void -> eligible/pending (mesma regra de eligible_at do INSERT); só as
+    # que continuam void sem payout (o UPDATE tem a mesma condição)
+    ainda_void = set()
+    ids = [c["id"] for c in diff["reactivate"]]
+    for chunk in _chunks(ids, IN_CHUNK):
+        ainda_void.update(
+            cid for (cid,) in db.query(CommissionRecord.id).filter(
+                CommissionRecord.id.in_(chunk),
+                CommissionRecord.status == "void",
+                CommissionRecord.payout_id.is_(None),
+            )
+        )
+    reactivar = []
+    for c in diff["reactivate"]:
+        if c["id"] not in ainda_void:
+            continue
+        eligible_at = c["paid_at"] + timedelta(days=days)
+        status = "eligible" if eligible_at <= now else "pending"
+        registrar_delta(deltas, c["beneficiary_id"], c["old_amount"], c["status"], c["paid"], sinal=-1)
+        registrar_delta(deltas, c["beneficiary_id"], c["new_amount"], status)
+        reactivar.append({
+            "b_id": c["id"],
+            "b_status": status,
+            "b_amount": c["new_amount"],
+            "b_rate": c["rate"],
+            "b_rule_version": c["rule_version"],
+            "b_eligible_at": eligible_at,
+        })
+    if reactivar:
+        db.execute(_REACTIVAR_STMT, reactivar)
+
+    void = {c["id"]: c for c in diff["void"]}
+    for chunk in _chunks(list(void), IN_CHUNK):
+        filtro = (
+            CommissionRecord.id.in_(chunk),
+            CommissionRecord.status.notin_(FROZEN_STATUSES),
+            CommissionRecord.payout_id.is_(None),
+        )
+        # só as que vão mesmo passar a void (o UPDATE tem a mesma condição)
+        for (cid,) in db.query(CommissionRecord.id).filter(*filtro).all():
+            c = void[cid]
+            registrar_delta(deltas, c["beneficiary_id"], c["old_amount"], c["status"], c["paid"], sinal=-1)
+            registrar_delta(deltas, c["beneficiary_id"], c["old_amount"], "void", c["paid"])
+        db.query(CommissionRecord).filter(*filtro).update({"status": "void"}, synchronize_session=False)
+
+    aplicar_saldos(db, deltas)
+
+
+def _json(change: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        k: (str(v) if isinstance(v, Decimal) else v.isoformat() if isinstance(v, datetime) else v)
+        for k, v in change.items()
+        if k not in ("id", "paid_at", "status", "paid")
+    }
+
+
+def recalcular_comissoes(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    dry_run: bool = True,
+    chunk_size: Optional[int] = None,
+    sample: int = 50,
+) -> Dict[str, Any]:
+    """
+    Recalcula as comissões dos pedidos pagos com paid_at em [start, end).
+    Com dry_run=False grava por bloco (um commit por bloco).
+    Retorna contagens, throughput e uma amostra das alterações.
+    """
+    chunk_size = chunk_size or settings.COMMISSION_RECOMPUTE_CHUNK
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    rede = _Rede(db)
+    tabela = obter_tabela(db)
+
+    totals = {k: 0 for k in ("orders", "insert", "update", "reactivate", "void", "frozen", "unchanged")}
+    changes: List[Dict[str, Any]] = []
+
+    last: Optional[Tuple[datetime, str]] = None
+    while True:
+        q = (
+            db.query(
+                Order.id,
+                Order.user_id,
+                Order.consultant_id,
+                Order.total_amount,
+                Order.discount_amount,
+                Order.paid_at,
+            )
+            .filter(
+                Order.status.in_(PAID_STATUSES),
+                Order.paid_at >= start,
+                Order.paid_at < end,
+            )
+        )
+        if last is not None:
+            q = q.filter(
+                (Order.paid_at > last[0]) | ((Order.paid_at == last[0]) & (Order.id > last[1]))
+            )
+        orders = q.order_by(Order.paid_at, Order.id).limit(chunk_size).all()
+        if not orders:
+            break
+        last = (orders[-1].paid_at, orders[-1].id)
+
+        desejado = _calcular_bloco(orders, rede, tabela)
+        diff = _diff(orders, desejado, _existentes(db, [o.id for o in orders]), now)
+
+        totals["orders"] += len(orders)
+        for action, items in diff.items():
+            totals[action] += len(items)
+            if action != "unchanged":
+                for c in items[: max(0, sample - len(changes))]:
+                    changes.append({"action": action, **_json(c)})
+
+        if not dry_run:
+            _gravar(db, diff, now)
+            db.commit()
+
+        if len(orders) < chunk_size:
+            break
+
+    if dry_run:
+        db.rollback()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "dry_run": dry_run,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        **totals,
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_second": round(totals["orders"] / elapsed, 1) if elapsed > 0 else None,
+        "changes": changes,
+    }
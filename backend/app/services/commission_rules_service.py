@@ -0,0 +1,218 @@
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, replace
+from datetime import datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import CommissionRule, CommissionType, UserLevel
+
+# =========================================================
+# Regras de comissão versionadas (commission_rules) compiladas
+# numa tabela imutável em memória
+#
+# - chave: (nível na rede, UserLevel do beneficiário, categoria);
+#   None = qualquer. Cada chave tem uma linha do tempo por effective_from.
+# - resolução: (nível, level, cat) > (nível, *, cat) > (nível, level, *)
+#   > (nível, *, *); dentro da chave vale a última regra com
+#   effective_from <= data do pedido (empate: version maior); a comissão
+#   guarda a version dessa regra (rule_version), não a da tabela
+# - compilada no arranque e depois de cada alteração; noutros workers a
+#   versão é revista no máximo a cada COMMISSION_RULES_REFRESH_SECONDS
+# - taxa por pedido = lookups em dict + bisect, sem query
+# =========================================================
+
+# níveis da rede, pela ordem: consultor da venda, upline 1, 2, 3
+NIVEIS = (
+    CommissionType.consultant,
+    CommissionType.upline_level1,
+    CommissionType.upline_level2,
+    CommissionType.upline_level3,
+)
+
+# regras iniciais (taxas que estavam fixas no código)
+REGRAS_PADRAO = (
+    (CommissionType.consultant, Decimal("0.05")),
+    (CommissionType.upline_level1, Decimal("0.03")),
+    (CommissionType.upline_level2, Decimal("0.02")),
+)
+INICIO = datetime(2000, 1, 1)
+ZERO = Decimal("0")
+
+_MAX_TENTATIVAS = 3
+
+Chave = Tuple[CommissionType, Optional[UserLevel], Optional[str]]
+
+
+@dataclass(frozen=True)
+class TabelaComissoes:
+    version: int  # maior version na tabela (detecta alterações noutros workers)
+    # chave -> (effective_from ordenados, rates e versions em paralelo)
+    linhas: Mapping[Chave, Tuple[Tuple[datetime, ...], Tuple[Optional[Decimal], ...], Tuple[int, ...]]]
+    niveis: Tuple[CommissionType, ...]  # níveis com regras, até ao mais fundo
+    built_at: float
+
+    def taxa(
+        self,
+        ctype: CommissionType,
+        user_level: Optional[UserLevel],
+        category: Optional[str],
+        at: datetime,
+    ) -> Tuple[Decimal, int]:
+        """(taxa, version da regra que a deu); (0, 0) sem regra."""
+        for chave in (
+            (ctype, user_level, category),
+            (ctype, None, category),
+            (ctype, user_level, None),
+            (ctype, None, None),
+        ):
+            linha = self.linhas.get(chave)
+            if linha is None:
+                continue
+            datas, rates, versions = linha
+            i = bisect_right(datas, at) - 1
+            if i >= 0 and rates[i] is not None:
+                return rates[i], versions[i]
+        return ZERO, 0
+
+
+_tabela: Optional[TabelaComissoes] = None
+_lock = threading.Lock()
+
+
+def _categoria(category: Optional[str]) -> Optional[str]:
+    return category or None
+
+
+def _versao_actual(db: Session) -> int:
+    return db.query(func.max(CommissionRule.version)).scalar() or 0
+
+
+def _compilar(db: Session) -> TabelaComissoes:
+    rules = (
+        db.query(CommissionRule)
+        .order_by(CommissionRule.effective_from, CommissionRule.version)
+        .all()
+    )
+    linhas: Dict[Chave, Tuple[List[datetime], List[Optional[Decimal]], List[int]]] = {}
+    for r in rules:
+        datas, rates, versions = linhas.setdefault(
+            (r.commission_type, r.user_level, _categoria(r.category)), ([], [], [])
+        )
+        datas.append(r.effective_from)
+        rates.append(Decimal(r.rate) if r.rate is not None else None)
+        versions.append(r.version)
+
+    usados = {chave[0] for chave in linhas}
+    fundo = max((i for i, ctype in enumerate(NIVEIS) if ctype in usados), default=-1)
+    return TabelaComissoes(
+        version=max((r.version for r in rules), default=0),
+        linhas=MappingProxyType({k: (tuple(d), tuple(r), tuple(v)) for k, (d, r, v) in linhas.items()}),
+        niveis=NIVEIS[: fundo + 1],
+        built_at=time.monotonic(),
+    )
+
+
+def recarregar_regras(db: Session) -> TabelaComissoes:
+    """Recompila já (arranque e depois de cada alteração, commit feito)."""
+    global _tabela
+    with _lock:
+        _tabela = _compilar(db)
+        return _tabela
+
+
+def obter_tabela(db: Session) -> TabelaComissoes:
+    """
+    Tabela compilada actual. Passado o TTL confirma a versão na BD
+    (uma query leve) e só recompila se outra instância mudou as regras.
+    """
+    global _tabela
+    tabela = _tabela
+    if tabela is not None and time.monotonic() - tabela.built_at < settings.COMMISSION_RULES_REFRESH_SECONDS:
+        return tabela
+
+    with _lock:
+        tabela = _tabela
+        if tabela is not None and time.monotonic() - tabela.built_at < settings.COMMISSION_RULES_REFRESH_SECONDS:
+            return tabela
+        if tabela is not None and _versao_actual(db) == tabela.version:
+            _tabela = replace(tabela, built_at=time.monotonic())
+        else:
+            _tabela = _compilar(db)
+        return _tabela
+
+
+def semear_regras_padrao(db: Session):
+    """Tabela vazia (BD nova / migração): grava REGRAS_PADRAO como versões 1..n."""
+    if db.query(CommissionRule.id).first() is not None:
+        return
+    for version, (ctype, rate) in enumerate(REGRAS_PADRAO, start=1):
+        db.add(CommissionRule(
+            version=version,
+            commission_type=ctype,
+            rate=rate,
+            effective_from=INICIO,
+            note="regra inicial",
+        ))
+    db.commit()
+
+
+def criar_regra(
+    db: Session,
+    commission_type: CommissionType,
+    rate: Optional[Decimal],
+    effective_from: Optional[datetime] = None,
+    user_level: Optional[UserLevel] = None,
+    category: Optional[str] = None,
+    note: Optional[str] = None,
+    created_by_id: Optional[str] = None,
+) -> CommissionRule:
+    """
+    Nova versão de regra (as antigas ficam, para histórico e recálculo).
+    Recompila a tabela em memória depois do commit.
+    """
+    if commission_type not in NIVEIS:
+        raise HTTPException(status_code=422, detail=f"commission_type inválido para regras: {commission_type.value}")
+
+    for tentativa in range(_MAX_TENTATIVAS):
+        rule = CommissionRule(
+            version=_versao_actual(db) + 1,
+            commission_type=commission_type,
+            user_level=user_level,
+            category=_categoria(category),
+            rate=rate,
+            effective_from=effective_from or datetime.utcnow(),
+            note=note,
+            created_by_id=created_by_id,
+        )
+        db.add(rule)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            # outra regra criada ao mesmo tempo ficou com esta versão
+            db.rollback()
+            if tentativa == _MAX_TENTATIVAS - 1:
+                raise HTTPException(status_code=409, detail="Conflito de versão; tente novamente")
+
+    db.refresh(rule)
+    recarregar_regras(db)
+    return rule
+
+
+def listar_regras(db: Session, limit: int = 200) -> List[Dict[str, Any]]:
+    rules = (
+        db.query(CommissionRule)
+        .order_by(CommissionRule.version.desc())
+        .limit(limit)
+        .all()
+    )
+    return [r.to_dict() for r in rules]
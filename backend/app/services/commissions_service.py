@@ -1,50 +1,144 @@
+import uuid
+from functools import lru_cache
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-from ..models import User, UserRole, Order, CommissionRecord, CommissionType
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
 
-CONSULTOR_PERCENT = Decimal("0.05")
-UPLINE1_PERCENT = Decimal("0.03")
-UPLINE2_PERCENT = Decimal("0.02")
-STAFF_POOL_PERCENT = Decimal("0.02")  # reservado (não usado agora)
+from ..models import User, UserLevel, UserRole, Order, OrderItem, Product, CommissionRecord, CommissionType
+from .commission_balances_service import Deltas, aplicar_saldos, registrar_delta
+from .commission_rules_service import TabelaComissoes, obter_tabela
+from .referrals_service import uplines
 
 ELIGIBILITY_DAYS = 0  # 0 = eligible já; 7 = pending por 7 dias (exemplo)
 
+# categoria -> valor bruto dos itens em cêntimos (None = pedido sem itens)
+Categorias = Dict[Optional[str], int]
 
-def criar_comissoes_para_order(db: Session, order: Order):
-    # garante relacionamentos carregados (sem rebentar se falhar)
-    try:
-        db.refresh(order)
-    except Exception:
-        pass
 
-    total = Decimal(order.total_amount or 0)
-    discount = Decimal(getattr(order, "discount_amount", 0) or 0)
+# =========================================================
+# Cálculo (cêntimos inteiros, partilhado com o recálculo em lote)
+# =========================================================
+def centimos(valor) -> int:
+    return int((Decimal(valor or 0) * 100).to_integral_value())
 
-    # ✅ base perfeita: não pagar comissão sobre desconto/pontos
-    base = total - discount
-    if base < 0:
-        base = Decimal("0.00")
 
+def em_decimal(valor_centimos: int) -> Decimal:
+    return (Decimal(valor_centimos) / 100).quantize(Decimal("0.01"))
+
+
+@lru_cache(maxsize=1024)  # poucas taxas distintas
+def _rate_1e4(rate: Decimal) -> int:
+    return int((rate * 10000).to_integral_value())
+
+
+def valor_centimos(base_centimos: int, partes: List[Tuple[Decimal, int]]) -> int:
+    """
+    Σ rate × base da categoria, com a base (total - desconto) rateada pelo
+    valor bruto de cada categoria; arredondado half-up ao cêntimo uma vez.
+    partes = [(rate, bruto em cêntimos)]. Com uma só taxa é rate × base.
+    """
+    bruto = sum(g for _, g in partes)
+    if base_centimos <= 0 or bruto <= 0:
+        return 0
+    num = base_centimos * sum(_rate_1e4(r) * g for r, g in partes)
+    den = bruto * 10000
+    return (2 * num + den) // (2 * den)
+
+
+def taxa_efetiva(partes: List[Tuple[Decimal, int]]) -> Decimal:
+    bruto = sum(g for _, g in partes)
+    if bruto <= 0:
+        return Decimal("0.0000")
+    return (sum(r * g for r, g in partes) / bruto).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+
+
+def categorias_por_order(db: Session, order_ids: Iterable[str]) -> Dict[str, Categorias]:
+    """{order_id: {categoria: bruto em cêntimos}} numa query (pedidos sem itens ficam de fora)."""
+    ids = list(order_ids)
+    if not ids:
+        return {}
+    rows = (
+        db.query(
+            OrderItem.order_id,
+            Product.category,
+            func.sum(OrderItem.quantity * OrderItem.unit_price),
+        )
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(OrderItem.order_id.in_(ids))
+        .group_by(OrderItem.order_id, Product.category)
+        .all()
+    )
+    out: Dict[str, Categorias] = {}
+    for order_id, category, bruto in rows:
+        cats = out.setdefault(order_id, {})
+        cats[category or None] = cats.get(category or None, 0) + centimos(bruto)
+    return out
+
+
+def calcular_comissoes(
+    tabela: TabelaComissoes,
+    base_centimos: int,
+    categorias: Categorias,
+    cadeia: List[Tuple[str, Optional[UserLevel]]],
+    at: datetime,
+) -> List[Tuple[CommissionType, str, int, Decimal, int]]:
+    """
+    cadeia = [(consultor, level), (upline1, level), ...].
+    Retorna [(tipo, beneficiary_id, cêntimos, taxa efectiva, rule_version)]
+    com valor > 0. rule_version = version da regra que deu a taxa; com
+    várias categorias (taxa misturada), a maior das regras usadas.
+    """
+    out = []
+    if len(categorias) <= 1:
+        # caso comum (uma categoria / sem itens): rate × base, sem rateio
+        category = next(iter(categorias), None)
+        for ctype, (beneficiary_id, level) in zip(tabela.niveis, cadeia):
+            rate, version = tabela.taxa(ctype, level, category, at)
+            amount = (base_centimos * _rate_1e4(rate) + 5000) // 10000
+            if amount > 0:
+                out.append((ctype, beneficiary_id, amount, rate, version))
+        return out
+
+    for ctype, (beneficiary_id, level) in zip(tabela.niveis, cadeia):
+        taxas = [(tabela.taxa(ctype, level, cat, at), bruto) for cat, bruto in categorias.items()]
+        partes = [(rate, bruto) for (rate, _), bruto in taxas]
+        amount = valor_centimos(base_centimos, partes)
+        if amount > 0:
+            version = max(v for (_, v), _ in taxas)
+            out.append((ctype, beneficiary_id, amount, taxa_efetiva(partes), version))
+    return out
+
+
+def criar_comissoes_para_order(db: Session, order: Order):
+    """
+    Comissões do pedido pago (consultor + uplines), gravadas num único
+    INSERT multi-linha idempotente: repetir (confirm concorrente, retry)
+    não duplica nem aborta a transacção do pedido.
+    Taxas da tabela de regras compilada (sem query por taxa).
+    """
+    # ✅ base perfeita: não pagar comissão sobre desconto/pontos
+    base = centimos(order.total_amount) - centimos(getattr(order, "discount_amount", 0))
     if base <= 0:
         return
 
     # ✅ consultor que gerou a venda (preferência)
-    consultant = None
-    if getattr(order, "consultant_id", None):
-        consultant = db.query(User).filter(User.id == order.consultant_id).first()
+    consultant_id = getattr(order, "consultant_id", None)
 
     # ✅ fallback compat: se não tem consultant_id e comprador é consultor
-    if consultant is None:
-        user = getattr(order, "user", None)
-        if not user and getattr(order, "user_id", None):
-            user = db.query(User).filter(User.id == order.user_id).first()
-        if user and user.role == UserRole.consultant:
-            consultant = user
-
-    if not consultant:
+    if not consultant_id and getattr(order, "user_id", None):
+        role = db.query(User.role).filter(User.id == order.user_id).scalar()
+        if role == UserRole.consultant:
+            consultant_id = order.user_id
+
+    if not consultant_id:
+        return
+
+    tabela = obter_tabela(db)
+    if not tabela.niveis:
         return
 
     now = datetime.utcnow()
@@ -57,93 +151,80 @@ def criar_comissoes_para_order(db: Session, order: Order):
         status = "eligible"
         eligible_at = now
 
-    # 1) comissão consultor
-    valor = (CONSULTOR_PERCENT * base).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    _registrar_comissao_idempotente(
-        db=db,
-        beneficiary=consultant,
-        order=order,
-        amount=valor,
-        ctype=CommissionType.consultant,
-        rate=CONSULTOR_PERCENT,
-        status=status,
-        eligible_at=eligible_at,
-    )
-
-    # 2) upline 1 e 2 (se existir referrer)
-    upline1 = getattr(consultant, "referrer", None)
-    if upline1:
-        valor = (UPLINE1_PERCENT * base).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        _registrar_comissao_idempotente(
-            db=db,
-            beneficiary=upline1,
-            order=order,
-            amount=valor,
-            ctype=CommissionType.upline_level1,
-            rate=UPLINE1_PERCENT,
-            status=status,
-            eligible_at=eligible_at,
-        )
-
-        upline2 = getattr(upline1, "referrer", None)
-        if upline2:
-            valor = (UPLINE2_PERCENT * base).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            _registrar_comissao_idempotente(
-                db=db,
-                beneficiary=upline2,
-                order=order,
-                amount=valor,
-                ctype=CommissionType.upline_level2,
-                rate=UPLINE2_PERCENT,
-                status=status,
-                eligible_at=eligible_at,
+    # consultor + uplines (closure table: uma query para todos os níveis)
+    beneficiarios = [consultant_id] + uplines(db, consultant_id, len(tabela.niveis) - 1)
+    levels = dict(db.query(User.id, User.level).filter(User.id.in_(beneficiarios)).all())
+    cadeia = [(b, levels.get(b)) for b in beneficiarios]
+
+    categorias = categorias_por_order(db, [order.id]).get(order.id, {})
+    at = getattr(order, "paid_at", None) or now
+
+    rows = []
+    for ctype, beneficiary_id, amount, rate, version in calcular_comissoes(tabela, base, categorias, cadeia, at):
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "beneficiary_id": beneficiary_id,
+            "order_id": order.id,
+            "amount": em_decimal(amount),
+            "type": ctype,
+            "created_at": now,
+            # ✅ compat / campos do teu DB
+            "paid": False,
+            "payout_id": None,
+            "status": status,
+            "rate": rate,
+            "rule_version": version,
+            "eligible_at": eligible_at,
+        })
+
+    inserir_comissoes(db, rows)
+
+
+def inserir_comissoes(db: Session, rows: List[Dict[str, Any]]) -> int:
+    """
+    INSERT ... ON CONFLICT (beneficiary_id, order_id, type) DO NOTHING
+    (uq_commission_beneficiary_order_type). Retorna as linhas inseridas.
+    Todas as linhas têm de trazer as mesmas colunas.
+    Só as linhas realmente inseridas entram em commission_balances.
+    """
+    if not rows:
+        return 0
+
+    table = CommissionRecord.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table).on_conflict_do_nothing(
+            index_elements=[table.c.beneficiary_id, table.c.order_id, table.c.type]
+        ).returning(table.c.id)
+        # executemany: o SQLAlchemy agrupa as linhas num INSERT multi-VALUES
+        # (insertmanyvalues) onde o driver o suporta; RETURNING só devolve
+        # as linhas que não bateram no conflito
+        ids = set(db.execute(stmt, rows).scalars().all())
+        _somar_saldos(db, [row for row in rows if row["id"] in ids])
+        return len(ids)
+
+    # outros bancos: uma verificação por linha, sem desfazer a transacção
+    inserted = []
+    for row in rows:
+        exists = (
+            db.query(CommissionRecord.id)
+            .filter(
+                CommissionRecord.beneficiary_id == row["beneficiary_id"],
+                CommissionRecord.order_id == row["order_id"],
+                CommissionRecord.type == row["type"],
             )
-
-
-def _registrar_comissao_idempotente(
-    db: Session,
-    beneficiary: User,
-    order: Order,
-    amount: Decimal,
-    ctype: CommissionType,
-    rate: Decimal | None,
-    status: str,
-    eligible_at: datetime,
-):
-    if amount <= 0:
-        return
-
-    # ✅ evita duplicar (rápido)
-    exists = (
-        db.query(CommissionRecord)
-        .filter(
-            CommissionRecord.beneficiary_id == beneficiary.id,
-            CommissionRecord.order_id == order.id,
-            CommissionRecord.type == ctype,
+            .first()
         )
-        .first()
-    )
-    if exists:
-        return
-
-    rec = CommissionRecord(
-        beneficiary_id=beneficiary.id,
-        order_id=order.id,
-        amount=amount,
-        type=ctype,
-
-        # ✅ compat / campos do teu DB
-        paid=False,
-        payout_id=None,
-
-        status=status,
-        rate=rate,
-        eligible_at=eligible_at,
-    )
-
-    db.add(rec)
-    try:
-        db.flush()
-    except IntegrityError:
-        db.rollback()
-        return
\ No newline at end of file
+        if not exists:
+            db.execute(table.insert().values(**row))
+            inserted.append(row)
+    _somar_saldos(db, inserted)
+    return len(inserted)
+
+
+def _somar_saldos(db: Session, rows: List[Dict[str, Any]]):
+    deltas: Deltas = {}
+    for row in rows:
+        registrar_delta(deltas, row["beneficiary_id"], row["amount"], row["status"], bool(row.get("paid")))
+    aplicar_saldos(db, deltas)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import IdempotencyKey
+
+# in_progress mais antigo que isto = processo morreu a meio; pode ser reclamado
+STALE_AFTER = timedelta(minutes=5)
+POLL_SECONDS = 0.2
+CACHE_MAX_ENTRIES = 10_000
+
+# cache local: id -> (expira_em_epoch, fingerprint, status_code, body)
+_cache: "OrderedDict[str, Tuple[float, str, int, Any]]" = OrderedDict()
+# pedidos em execução neste processo: id -> Event
+_inflight: Dict[str, threading.Event] = {}
+_lock = threading.Lock()
+
+
+def _record_id(scope: str, user_id: str, key: str) -> str:
+    return hashlib.sha256(f"{scope}|{user_id}|{key}".encode()).hexdigest()
+
+
+def _fingerprint(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _ttl() -> timedelta:
+    return timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+
+
+def _cache_get(rid: str):
+    with _lock:
+        hit = _cache.get(rid)
+        if hit and hit[0] < time.time():
+            _cache.pop(rid, None)
+            return None
+        return hit
+
+
+def _cache_put(rid: str, expires_at: datetime, fingerprint: str, status_code: int, body: Any):
+    expires_ts = time.time() + max(0.0, (expires_at - datetime.utcnow()).total_seconds())
+    with _lock:
+        _cache[rid] = (expires_ts, fingerprint, status_code, body)
+        _cache.move_to_end(rid)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _replay(hit, fingerprint: str) -> JSONResponse:
+    _, stored_fp, status_code, body = hit
+    if stored_fp != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key já usada com um payload diferente",
+        )
+    return JSONResponse(
+        content=body,
+        status_code=status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def _reclamar(rid: str, scope: str, user_id: str, key: str, fingerprint: str, deadline: float):
+    """
+    Reserva a chave na base (INSERT in_progress).
+    Retorna o registo completo se outro processo já respondeu; None se reservou.
+    Se outro processo está a executar, espera por ele até `deadline`.
+    """
+    while True:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rec = db.query(IdempotencyKey).filter(IdempotencyKey.id == rid).first()
+
+            expired = rec is not None and rec.expires_at < now
+            abandoned = (
+                rec is not None
+                and rec.status == "in_progress"
+                and rec.created_at < now - STALE_AFTER
+            )
+            if expired or abandoned:
+                db.delete(rec)
+                db.commit()
+                rec = None
+
+            if rec is None:
+                db.add(IdempotencyKey(
+                    id=rid,
+                    scope=scope,
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=fingerprint,
+                    status="in_progress",
+                    created_at=now,
+                    expires_at=now + _ttl(),
+                ))
+                try:
+                    db.commit()
+                    return None
+                except IntegrityError:
+                    db.rollback()  # outro processo reservou primeiro
+                    continue
+
+            if rec.status == "completed":
+                return rec
+        finally:
+            db.close()
+
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="Pedido com esta Idempotency-Key ainda em processamento",
+            )
+        time.sleep(POLL_SECONDS)
+
+
+def _gravar(rid: str, status_code: int, body: Any) -> datetime:
+    db = SessionLocal()
+    try:
+        rec = db.query(IdempotencyKey).filter(IdempotencyKey.id == rid).first()
+        expires_at = datetime.utcnow() + _ttl()
+        if rec:
+            rec.status = "completed"
+            rec.response_status = status_code
+            rec.response_body = body
+            rec.expires_at = expires_at
+            db.commit()
+        return expires_at
+    finally:
+        db.close()
+
+
+def _libertar(rid: str):
+    db = SessionLocal()
+    try:
+        (
+            db.query(IdempotencyKey)
+            .filter(IdempotencyKey.id == rid, IdempotencyKey.status == "in_progress")
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def executar_idempotente(
+    key: Optional[str],
+    scope: str,
+    user_id: str,
+    payload: Any,
+    executar: Callable[[], Any],
+    status_code: int = 200,
+):
+    """
+    Executa `executar()` no máximo uma vez por (scope, user_id, key).
+
+    - sem key: executa normalmente
+    - replay: devolve a resposta guardada (cache local; base se outro processo)
+    - duplicados concorrentes esperam pelo primeiro em vez de executar de novo
+    - mesma key com payload diferente: 422
+
+    Só respostas de sucesso são guardadas; se `executar()` falhar a key é
+    libertada e o cliente pode repetir.
+    """
+    if not key:
+        return executar()
+
+    rid = _record_id(scope, user_id, key)
+    fingerprint = _fingerprint(payload)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        hit = _cache_get(rid)
+        if hit:
+            return _replay(hit, fingerprint)
+
+        with _lock:
+            event = _inflight.get(rid)
+            owner = event is None
+            if owner:
+                event = _inflight[rid] = threading.Event()
+
+        if owner:
+            break
+
+        # duplicado concorrente neste processo: espera pelo primeiro
+        if not event.wait(max(0.0, deadline - time.monotonic())):
+            raise HTTPException(
+                status_code=409,
+                detail="Pedido com esta Idempotency-Key ainda em processamento",
+            )
+
+    try:
+        rec = _reclamar(rid, scope, user_id, key, fingerprint, deadline)
+        if rec is not None:
+            hit = (0.0, rec.fingerprint, rec.response_status, rec.response_body)
+            _cache_put(rid, rec.expires_at, *hit[1:])
+            return _replay(hit, fingerprint)
+
+        try:
+            body = executar()
+        except BaseException:
+            _libertar(rid)
+            raise
+
+        expires_at = _gravar(rid, status_code, body)
+        _cache_put(rid, expires_at, fingerprint, status_code, body)
+        return body
+    finally:
+        with _lock:
+            _inflight.pop(rid, None)
+        event.set()
+
+
+def purgar_chaves_expiradas() -> int:
+    db = SessionLocal()
+    try:
+        n = (
+            db.query(IdempotencyKey)
+            .filter(IdempotencyKey.expires_at < datetime.utcnow())
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+        return n
+    finally:
+        db.close()
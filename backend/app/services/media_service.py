@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from ..config import settings
+
+IMAGES_SUBDIR = "images"
+
+# variante -> lado maior em px (None = tamanho original); todas em WebP
+IMAGE_VARIANTS: Dict[str, Optional[int]] = {
+    "thumb": 320,
+    "medium": 960,
+    "webp": None,
+}
+
+# cabeçalhos/boundaries do multipart além do próprio arquivo
+_FOLGA_MULTIPART = 64 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _images_dir() -> str:
+    return os.path.join(settings.MEDIA_DIR, IMAGES_SUBDIR)
+
+
+def caminho_imagem(sha256: str, suffix: str) -> str:
+    """
+    Caminho content-addressed: media/images/ab/<sha256><suffix>
+    """
+    return os.path.join(_images_dir(), sha256[:2], f"{sha256}{suffix}")
+
+
+def url_media(path: str) -> str:
+    rel = os.path.relpath(path, settings.MEDIA_DIR).replace(os.sep, "/")
+    return f"/media/{rel}"
+
+
+def _muito_grande() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Arquivo maior que {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB",
+    )
+
+
+async def ler_arquivo_multipart(request: Request, campo: str = "file") -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    Lê o corpo multipart/form-data directamente de `request.stream()` e
+    produz (filename, chunk) da parte `campo`; as outras partes são
+    descartadas. Nada é spooled antes: o limite (UPLOAD_MAX_BYTES + folga
+    dos cabeçalhos) vale sobre os bytes recebidos, e um Content-Length
+    acima dele é recusado logo.
+    """
+    limite = settings.UPLOAD_MAX_BYTES + _FOLGA_MULTIPART
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limite:
+        raise _muito_grande()
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Esperado multipart/form-data")
+
+    parte = {"field": b"", "value": b"", "headers": {}, "filename": None, "visto": False}
+    dados: List[bytes] = []
+
+    def on_part_begin():
+        parte["headers"] = {}
+        parte["filename"] = None
+
+    def on_header_field(data, start, end):
+        parte["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        parte["value"] += data[start:end]
+
+    def on_header_end():
+        parte["headers"][parte["field"].lower()] = parte["value"]
+        parte["field"] = b""
+        parte["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(parte["headers"].get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode("latin-1") == campo and not parte["visto"]:
+            parte["visto"] = True  # só a primeira parte com esse nome
+            parte["filename"] = disposition.get(b"filename", b"").decode("utf-8", "replace")
+
+    def on_part_data(data, start, end):
+        if parte["filename"] is not None:
+            dados.append(data[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    recebido = 0
+    try:
+        async for chunk in request.stream():
+            recebido += len(chunk)
+            if recebido > limite:
+                raise _muito_grande()
+            parser.write(chunk)
+            for dado in dados:
+                yield parte["filename"], dado
+            dados.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Multipart inválido: {e}")
+
+
+async def gravar_upload_stream(chunks: AsyncIterator[bytes], ext: str) -> Dict[str, object]:
+    """
+    Grava o upload em disco por chunks (I/O fora do event loop), calculando
+    o SHA-256 e cortando em UPLOAD_MAX_BYTES. Se o conteúdo já existir,
+    descarta a cópia (dedup) e reaproveita o ficheiro existente.
+    """
+    tmp_dir = os.path.join(_images_dir(), "tmp")
+    await run_in_threadpool(os.makedirs, tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4()}{ext}.part")
+
+    digest = hashlib.sha256()
+    size = 0
+    buf = bytearray()  # junta os pedaços do parser até UPLOAD_CHUNK_BYTES por escrita
+    out = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > settings.UPLOAD_MAX_BYTES:
+                raise _muito_grande()
+            digest.update(chunk)
+            buf += chunk
+            if len(buf) >= settings.UPLOAD_CHUNK_BYTES:
+                await run_in_threadpool(out.write, bytes(buf))
+                buf.clear()
+        if buf:
+            await run_in_threadpool(out.write, bytes(buf))
+    except BaseException:
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(remover_arquivo, tmp_path)
+        raise
+    await run_in_threadpool(out.close)
+
+    if size == 0:
+        await run_in_threadpool(remover_arquivo, tmp_path)
+        raise HTTPException(status_code=400, detail="Arquivo vazio")
+
+    sha256 = digest.hexdigest()
+    final_path = caminho_imagem(sha256, ext)
+    deduplicated = await run_in_threadpool(_mover_se_novo, tmp_path, final_path)
+    return {"sha256": sha256, "path": final_path, "size": size, "deduplicated": deduplicated}
+
+
+def remover_arquivo(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _mover_se_novo(tmp_path: str, final_path: str) -> bool:
+    """Retorna True se o conteúdo já existia (dedup)."""
+    if os.path.exists(final_path):
+        remover_arquivo(tmp_path)
+        return True
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+    return False
+
+
+def _gerar_variantes(src_path: str, sha256: str) -> Dict[str, str]:
+    """
+    Corre no process pool: gera as variantes WebP que ainda não existem.
+    Levanta ValueError se o arquivo não for uma imagem válida.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    paths = {name: caminho_imagem(sha256, f"_{name}.webp") for name in IMAGE_VARIANTS}
+    if all(os.path.exists(p) for p in paths.values()):
+        return paths
+
+    try:
+        with Image.open(src_path) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+            for name, max_side in IMAGE_VARIANTS.items():
+                if os.path.exists(paths[name]):
+                    continue
+                variant = img.copy()
+                if max_side:
+                    variant.thumbnail((max_side, max_side))
+                tmp = paths[name] + ".part"
+                variant.save(tmp, "WEBP", quality=82, method=4)
+                os.replace(tmp, paths[name])
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError(f"Imagem inválida: {e}")
+
+    return paths
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _pool
+
+
+async def gerar_variantes(src_path: str, sha256: str) -> Dict[str, str]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), _gerar_variantes, src_path, sha256)
+
+
+def encerrar_pool_imagens():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
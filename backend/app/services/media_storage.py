@@ -0,0 +1,113 @@
+import mimetypes
+import os
+import posixpath
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Type
+
+from ..config import settings
+
+# =========================================================
+# Backends de armazenamento de media (servidos em /media)
+#
+# As chaves são caminhos relativos com "/" (ex.: images/ab/<sha>.jpg).
+# Um backend só precisa de `stat` e `ler`; se o objecto tiver `path`
+# local, a camada HTTP pode enviá-lo com sendfile (zero-copy).
+# =========================================================
+
+
+@dataclass(frozen=True)
+class MediaObject:
+    key: str
+    size: int
+    mtime: float
+    content_type: str
+    path: Optional[str] = None  # ficheiro local, se existir
+
+
+class MediaStorage(ABC):
+    @abstractmethod
+    def stat(self, key: str) -> Optional[MediaObject]:
+        ...
+
+    @abstractmethod
+    def ler(self, obj: MediaObject, offset: int, length: int, chunk_size: int) -> Iterator[bytes]:
+        ...
+
+
+def normalizar_chave(key: str) -> Optional[str]:
+    """
+    Chave canónica ou None se tentar sair da raiz (.., absolutos, bytes nulos).
+    """
+    if not key or "\x00" in key or "\\" in key:
+        return None
+    key = posixpath.normpath("/" + key).lstrip("/")
+    if not key or key == ".":
+        return None
+    return key
+
+
+def tipo_conteudo(key: str) -> str:
+    content_type, _ = mimetypes.guess_type(key)
+    return content_type or "application/octet-stream"
+
+
+class LocalMediaStorage(MediaStorage):
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    def _caminho(self, key: str) -> Optional[str]:
+        key = normalizar_chave(key)
+        if key is None:
+            return None
+        path = os.path.realpath(os.path.join(self.root, *key.split("/")))
+        if not path.startswith(self.root + os.sep):
+            return None  # symlink para fora da raiz
+        return path
+
+    def stat(self, key: str) -> Optional[MediaObject]:
+        key = normalizar_chave(key)
+        path = self._caminho(key) if key else None
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not os.path.isfile(path):
+            return None
+        return MediaObject(
+            key=key,
+            size=st.st_size,
+            mtime=st.st_mtime,
+            content_type=tipo_conteudo(key),
+            path=path,
+        )
+
+    def ler(self, obj: MediaObject, offset: int, length: int, chunk_size: int) -> Iterator[bytes]:
+        with open(obj.path, "rb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+MEDIA_BACKENDS: Dict[str, Type[MediaStorage]] = {
+    "local": LocalMediaStorage,
+}
+
+_storage: Optional[MediaStorage] = None
+
+
+def get_media_storage() -> MediaStorage:
+    global _storage
+    if _storage is None:
+        backend = MEDIA_BACKENDS.get(settings.MEDIA_STORAGE)
+        if backend is None:
+            raise RuntimeError(f"MEDIA_STORAGE desconhecido: {settings.MEDIA_STORAGE}")
+        _storage = backend(settings.MEDIA_DIR)
+    return _storage
@@ -0,0 +1,146 @@
+import csv
+import io
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import Payout, PayoutStatus, User
+
+# =========================================================
+# Ficheiro de desembolso em massa dos payouts pendentes
+#
+# - formatos: mpesa / emola (CSV de pagamento em lote por MSISDN) e
+#   bank (transferência, separado por ';')
+# - primeiro reserva, depois escreve: ainda no request, os payouts pending
+#   com state="generated" passam a state="exported" (export_id,
+#   exported_at) com UPDATEs condicionais em blocos, commit por bloco.
+#   Dois exports concorrentes nunca levam o mesmo payout (também no
+#   SQLite, onde FOR UPDATE não existe) e nenhuma transacção fica aberta
+#   durante o download
+# - o ficheiro é só uma leitura WHERE export_id=:id, com JOIN em users
+#   (nome, telefone) e yield_per (cursor do lado do servidor no
+#   Postgres): memória constante. Download perdido volta a sair igual em
+#   GET /admin/payouts/exports/{export_id}
+# - Reference = payout.id (é o que volta no extracto de liquidação)
+# =========================================================
+
+
+class Layout(NamedTuple):
+    delimiter: str
+    header: Sequence[str]
+    linha: Callable[["Linha"], List[str]]
+
+
+class Linha(NamedTuple):
+    id: str
+    amount: Decimal
+    period_start: datetime
+    period_end: datetime
+    name: str
+    phone: str
+
+
+def msisdn(phone: Optional[str]) -> str:
+    """Só dígitos, com indicativo 258 (números nacionais de 9 dígitos: 8X XXX XXXX)."""
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 9 and digits.startswith("8"):
+        return "258" + digits
+    return digits
+
+
+def _valor(amount) -> str:
+    return str(Decimal(amount or 0).quantize(Decimal("0.01")))
+
+
+def _descricao(r: Linha) -> str:
+    return f"Comissoes {r.period_start:%Y-%m-%d} a {r.period_end:%Y-%m-%d}"
+
+
+def _linha_carteira(r: Linha) -> List[str]:
+    return [msisdn(r.phone), _valor(r.amount), r.id, r.name]
+
+
+def _linha_banco(r: Linha) -> List[str]:
+    return [r.id, r.name, msisdn(r.phone), _valor(r.amount), "MZN", _descricao(r)]
+
+
+LAYOUTS: Dict[str, Layout] = {
+    "mpesa": Layout(",", ("MSISDN", "Amount", "Reference", "Name"), _linha_carteira),
+    "emola": Layout(",", ("MSISDN", "Amount", "Reference", "Name"), _linha_carteira),
+    "bank": Layout(
+        ";",
+        ("Reference", "BeneficiaryName", "BeneficiaryPhone", "Amount", "Currency", "Description"),
+        _linha_banco,
+    ),
+}
+
+
+def reservar_para_exportacao(db: Session, export_id: str, batch_id: Optional[str] = None) -> int:
+    """
+    Marca os payouts pending com state="generated" (opcionalmente só de um
+    batch_id) como exportados em `export_id`, em blocos de
+    PAYOUT_EXPORT_BATCH com commit por bloco. O UPDATE volta a exigir
+    state="generated": quem chega depois a um payout já reservado não o
+    leva. Retorna o nº de payouts reservados.
+    """
+    now = datetime.utcnow()
+    total = 0
+    while True:
+        alvo = select(Payout.id).where(Payout.state == "generated", Payout.status == PayoutStatus.pending)
+        if batch_id:
+            alvo = alvo.where(Payout.batch_id == batch_id)
+        alvo = alvo.order_by(Payout.created_at, Payout.id).limit(settings.PAYOUT_EXPORT_BATCH)
+        if db.get_bind().dialect.name == "postgresql":
+            alvo = alvo.with_for_update(skip_locked=True)
+        res = db.execute(
+            update(Payout)
+            .where(Payout.id.in_(alvo), Payout.state == "generated")
+            .values(state="exported", export_id=export_id, exported_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if not res.rowcount:
+            return total
+        total += res.rowcount
+
+
+def gerar_arquivo_desembolso(formato: str, export_id: str) -> Iterator[bytes]:
+    """
+    Gerador para StreamingResponse com os payouts do export `export_id`
+    (ver `reservar_para_exportacao`); só lê, não muda estados.
+    Usa a sua própria sessão: a do request já fechou quando a resposta
+    começa a ser enviada.
+    """
+    layout = LAYOUTS[formato]
+    batch = settings.PAYOUT_EXPORT_BATCH
+    db = SessionLocal()
+    try:
+        q = (
+            db.query(Payout.id, Payout.amount, Payout.period_start, Payout.period_end, User.name, User.phone)
+            .join(User, User.id == Payout.user_id)
+            .filter(Payout.export_id == export_id)
+            .order_by(Payout.created_at, Payout.id)
+            .execution_options(yield_per=batch)
+        )
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter=layout.delimiter)
+        writer.writerow(layout.header)
+
+        n = 0
+        for row in q:
+            writer.writerow(layout.linha(Linha(*row)))
+            n += 1
+            if n % batch == 0:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode("utf-8")
+    finally:
+        db.close()
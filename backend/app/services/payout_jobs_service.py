@@ -0,0 +1,365 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import Payout, PayoutJob, User
+from . import commissions_service
+from .payouts_service import (
+    beneficiarios_com_candidatas,
+    gerar_payouts_incrementais,
+    gerar_payouts_periodo,
+    marca_actual,
+)
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# Geração de payouts em background (payout_jobs)
+#
+# - POST /admin/payouts/generate só regista o job e devolve 202; o motor
+#   (payouts_service.gerar_payouts_periodo) corre num worker
+# - cada bloco grava o checkpoint (último users.id) e o progresso na
+#   mesma transacção dos payouts: o que está no checkpoint está gravado
+# - job interrompido (processo morreu) fica "running" sem heartbeat; o
+#   scheduler retoma-o do checkpoint passado PAYOUT_JOB_STALE_MINUTES.
+#   Job "failed" retoma-se com POST /admin/payouts/jobs/{id}/resume.
+# - no máximo uma geração activa de cada vez
+# - mode="incremental" (job_payouts do scheduler): só comissões entre o
+#   watermark (created_at, id) do último incremental done, recuado
+#   PAYOUT_WATERMARK_LOOKBACK_HOURS + ELIGIBILITY_DAYS (commits tardios,
+#   comissões que saíram do hold depois), e a comissão mais recente;
+#   o custo acompanha a actividade nova, não o histórico. Sem incremental
+#   anterior, o limite de baixo é o period_end do último payout (recuado
+#   igual), nunca antes de JANELA_INICIAL: o histórico não é varrido.
+#   Comissões mais antigas que esse limite só são apanhadas por uma
+#   geração manual por janela (POST /admin/payouts/generate {"days": N})
+# =========================================================
+
+ACTIVOS = ("pending", "running")
+
+# primeiro incremental: a janela do antigo job_payouts (30 dias)
+JANELA_INICIAL = timedelta(days=30)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _condicao_disponivel(now: datetime):
+    return or_(
+        PayoutJob.status == "pending",
+        and_(
+            PayoutJob.status == "running",
+            PayoutJob.locked_at < now - timedelta(minutes=settings.PAYOUT_JOB_STALE_MINUTES),
+        ),
+    )
+
+
+def job_para_dict(job: PayoutJob) -> Dict[str, Any]:
+    out = job.to_dict()
+    if job.status == "done":
+        out["progress"] = 100.0
+    else:
+        out["progress"] = round(100.0 * job.processed / job.total, 1) if job.total else 0.0
+    return out
+
+
+def job_activo(db: Session) -> Optional[PayoutJob]:
+    return (
+        db.query(PayoutJob)
+        .filter(PayoutJob.status.in_(ACTIVOS))
+        .order_by(PayoutJob.created_at)
+        .first()
+    )
+
+
+def criar_job_payouts(
+    db: Session,
+    period_start: datetime,
+    period_end: datetime,
+    created_by_id: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+) -> PayoutJob:
+    """
+    Regista um job pending (commit feito). 409 se já houver outro activo.
+    """
+    activo = job_activo(db)
+    if activo is not None:
+        raise HTTPException(status_code=409, detail=f"Geração de payouts já em curso (job {activo.id})")
+
+    job = PayoutJob(
+        status="pending",
+        period_start=period_start,
+        period_end=period_end,
+        chunk_size=chunk_size or settings.PAYOUT_CHUNK,
+        total=db.query(func.count(User.id)).scalar() or 0,
+        created_by_id=created_by_id,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _recuo() -> timedelta:
+    return timedelta(
+        hours=settings.PAYOUT_WATERMARK_LOOKBACK_HOURS,
+        days=commissions_service.ELIGIBILITY_DAYS or 0,
+    )
+
+
+def ultimo_incremental(db: Session) -> Optional[PayoutJob]:
+    return (
+        db.query(PayoutJob)
+        .filter(PayoutJob.mode == "incremental", PayoutJob.status == "done")
+        .order_by(PayoutJob.watermark_at.desc(), PayoutJob.watermark_id.desc())
+        .first()
+    )
+
+
+def criar_job_incremental(
+    db: Session,
+    created_by_id: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+) -> Optional[PayoutJob]:
+    """
+    Regista um job incremental pending (commit feito), do watermark do
+    último incremental done (o primeiro: ver JANELA_INICIAL) até à
+    comissão mais recente. None se não há
+    comissões ou o watermark não avançou (o período seria o mesmo do
+    anterior). 409 se já houver outro activo.
+    """
+    activo = job_activo(db)
+    if activo is not None:
+        raise HTTPException(status_code=409, detail=f"Geração de payouts já em curso (job {activo.id})")
+
+    marca = marca_actual(db)
+    if marca is None:
+        return None
+    anterior = ultimo_incremental(db)
+    if anterior is not None and (anterior.watermark_at, anterior.watermark_id) == marca:
+        return None
+    if anterior is not None:
+        desde = anterior.watermark_at - _recuo()
+    else:
+        desde = datetime.utcnow() - JANELA_INICIAL
+        ultimo_fim = db.query(func.max(Payout.period_end)).scalar()
+        if ultimo_fim is not None:
+            desde = max(desde, ultimo_fim - _recuo())
+
+    job = PayoutJob(
+        status="pending",
+        mode="incremental",
+        period_start=desde,
+        period_end=marca[0],
+        watermark_from=desde,
+        watermark_at=marca[0],
+        watermark_id=marca[1],
+        chunk_size=chunk_size or settings.PAYOUT_CHUNK,
+        total=0,  # beneficiários com comissões novas: contados ao arrancar
+        created_by_id=created_by_id,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _reservar(db: Session, job_id: str) -> bool:
+    # UPDATE condicional: dois workers (ou processos) nunca correm o mesmo job
+    now = datetime.utcnow()
+    res = db.execute(
+        update(PayoutJob)
+        .where(PayoutJob.id == job_id, _condicao_disponivel(now))
+        .values(
+            status="running",
+            locked_at=now,
+            attempts=PayoutJob.attempts + 1,
+            started_at=func.coalesce(PayoutJob.started_at, now),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return res.rowcount == 1
+
+
+def executar_job_payouts(job_id: str) -> bool:
+    """
+    Reserva o job e corre o motor a partir do checkpoint.
+    Retorna True se terminou (done).
+    """
+    db = SessionLocal()
+    try:
+        if not _reservar(db, job_id):
+            return False
+        job = db.query(PayoutJob).filter(PayoutJob.id == job_id).first()
+
+        beneficiarios: Optional[List[str]] = None
+        if job.mode == "incremental":
+            marca = (job.watermark_at, job.watermark_id)
+            beneficiarios = beneficiarios_com_candidatas(db, job.watermark_from, marca, job.checkpoint)
+            job.total = job.processed + len(beneficiarios)
+            db.commit()
+        feitos = [0]  # beneficiários já percorridos nesta execução (fatias da lista)
+
+        def _checkpoint(ate: str, bloco: Dict[str, Any]):
+            if beneficiarios is not None:
+                n = min(job.chunk_size, len(beneficiarios) - feitos[0])
+                feitos[0] += n
+                job.processed += n
+            else:
+                utilizadores = db.query(func.count(User.id)).filter(User.id <= ate)
+                if job.checkpoint is not None:
+                    utilizadores = utilizadores.filter(User.id > job.checkpoint)
+                job.processed += utilizadores.scalar() or 0
+            job.total = max(job.total, job.processed)
+            job.checkpoint = ate
+            job.chunks += 1
+            job.payouts_created += bloco["created"]
+            job.commissions_linked += bloco["commissions"]
+            job.commissions_unlinked += bloco["unlinked"]
+            job.total_amount = Decimal(job.total_amount or 0) + bloco["amount"]
+            job.locked_at = datetime.utcnow()
+
+        try:
+            if beneficiarios is not None:
+                gerar_payouts_incrementais(
+                    db,
+                    job.watermark_from,
+                    (job.watermark_at, job.watermark_id),
+                    chunk_size=job.chunk_size,
+                    batch_id=job.id,
+                    depois_de=job.checkpoint,
+                    ao_gravar_bloco=_checkpoint,
+                    beneficiarios=beneficiarios,
+                )
+            else:
+                gerar_payouts_periodo(
+                    db,
+                    job.period_start,
+                    job.period_end,
+                    chunk_size=job.chunk_size,
+                    batch_id=job.id,
+                    depois_de=job.checkpoint,
+                    ao_gravar_bloco=_checkpoint,
+                )
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.last_error = f"{type(e).__name__}: {e}"[:2000]
+            job.locked_at = None
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            logger.exception("Job de payouts %s falhou (checkpoint %s)", job_id, job.checkpoint)
+            return False
+
+        job.status = "done"
+        job.total = job.processed
+        job.locked_at = None
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        logger.info(
+            "Job de payouts %s: %s payouts, %s comissões, %s em %s blocos",
+            job_id, job.payouts_created, job.commissions_linked, job.total_amount, job.chunks,
+        )
+        if job.commissions_unlinked:
+            logger.warning(
+                "Job de payouts %s: %s comissões eligible ficaram sem payout "
+                "(payout do período já exportado/pago)",
+                job_id, job.commissions_unlinked,
+            )
+        return True
+    finally:
+        db.close()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="payout-worker")
+    return _executor
+
+
+def iniciar_job(job_id: str):
+    _get_executor().submit(executar_job_payouts, job_id)
+
+
+def retomar_jobs_payouts() -> int:
+    """
+    Arranca os jobs pending e os running sem heartbeat (worker morreu).
+    Chamado periodicamente pelo scheduler (ver `job_resume_payout_jobs` em main.py).
+    """
+    db = SessionLocal()
+    try:
+        job_ids = [
+            row.id
+            for row in db.query(PayoutJob.id)
+            .filter(_condicao_disponivel(datetime.utcnow()))
+            .order_by(PayoutJob.created_at)
+            .all()
+        ]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        iniciar_job(job_id)
+    return len(job_ids)
+
+
+def retomar_job(db: Session, job_id: str) -> PayoutJob:
+    """Volta a pôr um job failed (ou running sem heartbeat) em pending, sem perder o checkpoint."""
+    job = db.query(PayoutJob).filter(PayoutJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Payout job not found")
+
+    now = datetime.utcnow()
+    retomavel = job.status == "failed" or (
+        job.status == "running"
+        and job.locked_at is not None
+        and job.locked_at < now - timedelta(minutes=settings.PAYOUT_JOB_STALE_MINUTES)
+    )
+    if not retomavel:
+        raise HTTPException(status_code=409, detail=f"Job {job.status} não pode ser retomado")
+
+    outro = job_activo(db)
+    if outro is not None and outro.id != job.id:
+        raise HTTPException(status_code=409, detail=f"Geração de payouts já em curso (job {outro.id})")
+
+    job.status = "pending"
+    job.locked_at = None
+    job.finished_at = None
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def obter_job(db: Session, job_id: str) -> PayoutJob:
+    job = db.query(PayoutJob).filter(PayoutJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Payout job not found")
+    return job
+
+
+def listar_jobs(db: Session, limit: int = 20) -> List[Dict[str, Any]]:
+    jobs = (
+        db.query(PayoutJob)
+        .order_by(PayoutJob.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [job_para_dict(j) for j in jobs]
+
+
+def encerrar_jobs_payouts():
+    # o bloco em curso é abandonado; o job retoma do checkpoint no próximo arranque
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,297 @@
+import csv
+import io
+from collections import deque
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import IO, Any, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from ..models import CommissionRecord, Payout, PayoutStatus, User
+from .commission_balances_service import Deltas, aplicar_saldos, registrar_delta
+from .payout_export_service import msisdn
+
+# =========================================================
+# Reconciliação de payouts com o extracto de liquidação do provedor
+# (M-Pesa / e-Mola / banco)
+#
+# - cada linha casa com um payout pending por Reference (= payout.id,
+#   o que saiu no ficheiro de desembolso; lookup pela PK em blocos) ou,
+#   sem referência conhecida, por (MSISDN, valor): índice em memória
+#   (dict) só com as chaves que aparecem no extracto, montado numa
+#   passagem pelos payouts em aberto
+# - valor diferente, pagamento falhado no provedor, payout já pago ou
+#   repetido no ficheiro e linhas sem par são reportados, não pagos
+# - payouts e comissões passam a pagos com UPDATEs em conjunto
+#   (executemany / IN por bloco) numa só transacção, com os saldos
+# =========================================================
+
+_BLOCO = 1000
+CENTIMO = Decimal("0.01")
+
+COLUNAS = {
+    "reference": ("reference", "referencia", "ref", "payout_id", "third_party_reference"),
+    "phone": ("msisdn", "phone", "telefone", "mobile", "beneficiaryphone"),
+    "amount": ("amount", "valor", "montante"),
+    "receipt": ("receipt", "transaction_id", "transaction", "txn_id", "recibo", "transactionid"),
+    "status": ("status", "estado", "result"),
+}
+FALHAS = {"failed", "fail", "falhou", "falhado", "rejected", "rejeitado", "error", "erro", "cancelled", "reversed"}
+
+
+class LinhaExtracto(NamedTuple):
+    line: int
+    reference: Optional[str]
+    phone: Optional[str]
+    amount: Optional[Decimal]
+    receipt: Optional[str]
+    status: Optional[str]
+
+
+def _valor(texto: Optional[str]) -> Optional[Decimal]:
+    """'1234.50', '1 234,50', '1.234,50', '1,234.50' -> Decimal (ao cêntimo)."""
+    texto = (texto or "").replace(" ", "").replace("\u00a0", "")
+    if not texto:
+        return None
+    if "," in texto and "." in texto:
+        milhares = "." if texto.rfind(",") > texto.rfind(".") else ","
+        texto = texto.replace(milhares, "")
+    texto = texto.replace(",", ".")
+    try:
+        return Decimal(texto).quantize(CENTIMO)
+    except InvalidOperation:
+        return None
+
+
+def _coluna(fieldnames: Sequence[str], campo: str) -> Optional[str]:
+    return next((c for c in COLUNAS[campo] if c in fieldnames), None)
+
+
+def ler_extracto(f: IO[bytes]) -> List[LinhaExtracto]:
+    """CSV com cabeçalho (',' ou ';'); colunas por nome, ver COLUNAS."""
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    reader = None
+    linhas: List[LinhaExtracto] = []
+    try:
+        header = text.readline()
+        if not header.strip():
+            raise HTTPException(status_code=400, detail="Extracto vazio")
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        fieldnames = [
+            c.strip().lower().replace(" ", "_")
+            for c in next(csv.reader([header], delimiter=delimiter))
+        ]
+        cols = {campo: _coluna(fieldnames, campo) for campo in COLUNAS}
+        if not cols["amount"] or not (cols["reference"] or cols["phone"]):
+            raise HTTPException(status_code=400, detail="Extracto sem coluna amount e reference/msisdn")
+
+        reader = csv.DictReader(text, fieldnames=fieldnames, delimiter=delimiter)
+        for row in reader:
+            if not any(v for v in row.values() if isinstance(v, str) and v.strip()):
+                continue
+
+            def get(campo: str) -> Optional[str]:
+                valor = row.get(cols[campo]) if cols[campo] else None
+                return (valor or "").strip() or None
+
+            linhas.append(LinhaExtracto(
+                line=reader.line_num,
+                reference=get("reference"),
+                phone=get("phone"),
+                amount=_valor(get("amount")),
+                receipt=get("receipt"),
+                status=get("status"),
+            ))
+    except (csv.Error, UnicodeDecodeError) as e:
+        linha = reader.line_num if reader is not None else 1
+        raise HTTPException(status_code=400, detail=f"Extracto inválido na linha {linha}: {e}")
+    return linhas
+
+
+# ---------------------------------------------------------
+# Pagamento (em conjunto)
+# ---------------------------------------------------------
+def marcar_payouts_pagos(
+    db: Session,
+    pagamentos: Sequence[Tuple[str, Optional[str]]],
+    method: str,
+    paid_at: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    pagamentos = [(payout_id, reference)]. Marca os payouts ainda pending
+    como processed/paid e as comissões ligadas como paid (paid=True),
+    ajustando os saldos. Não faz commit.
+    """
+    paid_at = paid_at or datetime.utcnow()
+    refs = dict(pagamentos)
+    ids = list(refs)
+
+    # lock dos que continuam pending (Postgres); os outros ficam de fora
+    pendentes: List[str] = []
+    amount = Decimal("0.00")
+    for i in range(0, len(ids), _BLOCO):
+        for pid, valor in (
+            db.query(Payout.id, Payout.amount)
+            .filter(Payout.id.in_(ids[i:i + _BLOCO]), Payout.status == PayoutStatus.pending)
+            .with_for_update()
+        ):
+            pendentes.append(pid)
+            amount += Decimal(valor or 0)
+    if not pendentes:
+        return {"payouts": 0, "commissions": 0, "amount": amount}
+
+    db.execute(
+        update(Payout.__table__)
+        .where(Payout.__table__.c.id == bindparam("pid"))
+        .values(
+            status=PayoutStatus.processed,
+            state="paid",
+            method=method,
+            reference=bindparam("ref"),
+            paid_at=paid_at,
+        ),
+        [{"pid": pid, "ref": refs[pid]} for pid in pendentes],
+    )
+
+    deltas: Deltas = {}
+    commissions = 0
+    for i in range(0, len(pendentes), _BLOCO):
+        bloco = pendentes[i:i + _BLOCO]
+        ligadas = (CommissionRecord.payout_id.in_(bloco), CommissionRecord.status != "void")
+        for beneficiary_id, status, paid, total, n in (
+            db.query(
+                CommissionRecord.beneficiary_id,
+                CommissionRecord.status,
+                CommissionRecord.paid,
+                func.sum(CommissionRecord.amount),
+                func.count(CommissionRecord.id),
+            )
+            .filter(*ligadas)
+            .group_by(CommissionRecord.beneficiary_id, CommissionRecord.status, CommissionRecord.paid)
+        ):
+            registrar_delta(deltas, beneficiary_id, total, status, bool(paid), sinal=-1)
+            registrar_delta(deltas, beneficiary_id, total, "paid", True)
+            commissions += n
+        db.query(CommissionRecord).filter(*ligadas).update(
+            {"status": "paid", "paid": True}, synchronize_session=False
+        )
+    aplicar_saldos(db, deltas)
+    return {"payouts": len(pendentes), "commissions": commissions, "amount": amount}
+
+
+# ---------------------------------------------------------
+# Reconciliação
+# ---------------------------------------------------------
+def _por_referencia(db: Session, refs: List[str]) -> Dict[str, Tuple[Decimal, PayoutStatus]]:
+    encontrados: Dict[str, Tuple[Decimal, PayoutStatus]] = {}
+    for i in range(0, len(refs), _BLOCO):
+        for pid, amount, status in (
+            db.query(Payout.id, Payout.amount, Payout.status)
+            .filter(Payout.id.in_(refs[i:i + _BLOCO]))
+        ):
+            encontrados[pid] = (Decimal(amount).quantize(CENTIMO), status)
+    return encontrados
+
+
+def _indice_telefone_valor(db: Session, chaves: set) -> Dict[Tuple[str, Decimal], Deque[str]]:
+    """(MSISDN, valor) -> payouts pending em aberto, mais antigos primeiro."""
+    indice: Dict[Tuple[str, Decimal], Deque[str]] = {}
+    q = (
+        db.query(Payout.id, Payout.amount, User.phone)
+        .join(User, User.id == Payout.user_id)
+        .filter(Payout.status == PayoutStatus.pending, Payout.state.in_(("generated", "exported")))
+        .order_by(Payout.created_at, Payout.id)
+        .execution_options(yield_per=_BLOCO)
+    )
+    for pid, amount, phone in q:
+        chave = (msisdn(phone), Decimal(amount).quantize(CENTIMO))
+        if chave in chaves:
+            indice.setdefault(chave, deque()).append(pid)
+    return indice
+
+
+def reconciliar_pagamentos(
+    db: Session,
+    linhas: Sequence[LinhaExtracto],
+    method: str,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Casa as linhas do extracto com payouts e paga os casados numa transacção.
+    Retorna contagens e as linhas não pagas com o motivo.
+    """
+    issues: List[Dict[str, Any]] = []
+    pagamentos: Dict[str, Optional[str]] = {}  # payout_id -> reference do provedor
+
+    def _reportar(linha: LinhaExtracto, reason: str, payout_id: Optional[str] = None, expected=None):
+        issues.append({
+            "line": linha.line,
+            "reference": linha.reference,
+            "phone": linha.phone,
+            "amount": str(linha.amount) if linha.amount is not None else None,
+            "reason": reason,
+            "payout_id": payout_id,
+            "expected_amount": str(expected) if expected is not None else None,
+        })
+
+    def _casar(linha: LinhaExtracto, payout_id: str):
+        if payout_id in pagamentos:
+            _reportar(linha, "duplicate", payout_id)
+        else:
+            pagamentos[payout_id] = linha.receipt or linha.reference
+
+    validas: List[LinhaExtracto] = []
+    for linha in linhas:
+        if linha.amount is None:
+            _reportar(linha, "invalid_amount")
+        elif linha.status and linha.status.lower() in FALHAS:
+            _reportar(linha, "provider_failed")
+        else:
+            validas.append(linha)
+
+    por_ref = _por_referencia(db, sorted({l.reference for l in validas if l.reference}))
+    sem_ref: List[LinhaExtracto] = []
+    for linha in validas:
+        encontrado = por_ref.get(linha.reference) if linha.reference else None
+        if encontrado is None:
+            sem_ref.append(linha)
+            continue
+        amount, status = encontrado
+        if status != PayoutStatus.pending:
+            _reportar(linha, "already_paid", linha.reference)
+        elif amount != linha.amount:
+            _reportar(linha, "amount_mismatch", linha.reference, expected=amount)
+        else:
+            _casar(linha, linha.reference)
+
+    chaves = {(msisdn(l.phone), l.amount) for l in sem_ref if l.phone}
+    indice = _indice_telefone_valor(db, chaves) if chaves else {}
+    for linha in sem_ref:
+        fila = indice.get((msisdn(linha.phone), linha.amount)) if linha.phone else None
+        # o mesmo payout não casa duas vezes: sai da fila
+        while fila and fila[0] in pagamentos:
+            fila.popleft()
+        if fila:
+            _casar(linha, fila.popleft())
+        else:
+            _reportar(linha, "unmatched")
+
+    resultado = {"payouts": 0, "commissions": 0, "amount": Decimal("0.00")}
+    if pagamentos and not dry_run:
+        resultado = marcar_payouts_pagos(db, list(pagamentos.items()), method)
+        db.commit()
+
+    issues.sort(key=lambda i: i["line"])
+    return {
+        "lines": len(linhas),
+        "matched": len(pagamentos),
+        "paid_payouts": resultado["payouts"],
+        "paid_commissions": resultado["commissions"],
+        "paid_amount": str(resultado["amount"]),
+        "unmatched": sum(1 for i in issues if i["reason"] == "unmatched"),
+        "mismatched": sum(1 for i in issues if i["reason"] == "amount_mismatch"),
+        "dry_run": dry_run,
+        "issues": issues,
+    }
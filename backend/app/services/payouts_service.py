@@ -1,47 +1,391 @@
+import time
+import uuid
 from datetime import datetime
 from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, func, literal, literal_column, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
-from ..models import CommissionRecord, Payout, PayoutStatus
+from ..config import settings
+from ..models import CommissionRecord, Payout, PayoutStatus, User
+from .commission_balances_service import Deltas, aplicar_saldos
+
+# =========================================================
+# Motor de payouts (único): comissões eligible sem payout_id, criadas
+# no período, agrupadas por beneficiário
+#
+# Dois modos:
+# - janela (gerar_payouts_periodo): created_at em [início, fim); blocos
+#   de PAYOUT_CHUNK utilizadores (intervalo de users.id, keyset)
+# - incremental (gerar_payouts_incrementais): created_at depois do
+#   watermark anterior e (created_at, id) <= watermark novo; blocos só
+#   dos beneficiários com comissões novas (custo = actividade nova)
+#
+# Por bloco:
+#   1. INSERT INTO payouts ... SELECT ... FROM users JOIN commission_records
+#      GROUP BY users.id (cada utilizador vai ao índice por beneficiário);
+#      ON CONFLICT DO NOTHING em (user_id, period_start, period_end):
+#      nunca dois payouts do mesmo beneficiário para o mesmo período
+#   2. UPDATE commission_records ... FROM payouts: locked + payout_id,
+#      no payout novo ou, se o período já tinha um ainda "generated"
+#      (re-execução do mesmo período), nesse; as que ficam sem payout
+#      (o do período já foi exportado/pago) são contadas em "unlinked"
+#   3. payouts.amount = SUM das comissões efectivamente ligadas
+#      (exacto mesmo que uma comissão mude de estado entre 1 e 2)
+#   4. commission_balances (eligible -> locked) e commit do bloco
+# Somas feitas pela BD em NUMERIC; a memória só guarda um bloco.
+#
+# A garantia contra pagar duas vezes é payout_id IS NULL nas candidatas
+# (uma comissão só é ligada uma vez); a chave única só apanha o mesmo
+# período repetido, os períodos incrementais sobrepõem-se (recuo).
+# =========================================================
+
+# período dos payouts incrementais antes do primeiro watermark
+SEM_INICIO = datetime(2000, 1, 1)
+
+Faixa = Callable[[Any], Any]  # coluna de utilizador -> filtro do bloco
+Marca = Tuple[datetime, str]  # watermark: (created_at, id) da comissão
+
+# uuid4 gerado pela própria BD no INSERT ... SELECT
+_UUID_SQL = {
+    "postgresql": "gen_random_uuid()::text",  # Postgres 13+
+    "sqlite": (
+        "lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' || "
+        "substr(hex(randomblob(2)), 2) || '-' || "
+        "substr('89ab', 1 + (abs(random()) % 4), 1) || substr(hex(randomblob(2)), 2) || '-' || "
+        "hex(randomblob(6)))"
+    ),
+}
+
+
+def _sem_indice(dialect: str, col):
+    # SQLite: "+coluna" tira o termo da escolha de índice
+    if dialect == "sqlite":
+        return literal_column(f"+{col.table.name}.{col.name}", type_=col.type)
+    return col
+
+
+def _candidatas(dialect: str, period_start: datetime, period_end: datetime):
+    # No SQLite só beneficiary_id fica indexável: sem ANALYZE o planner
+    # preferia status/payout_id/created_at, i.e. percorrer todas as
+    # candidatas do período em cada bloco.
+    # 'eligible' literal (não parâmetro): no Postgres o planner só usa o
+    # índice parcial ix_commission_payout_candidates se o WHERE bater com o dele.
+    # paid: o fluxo antigo pagava só com paid=True (ficavam eligible sem payout_id)
+    created_at = _sem_indice(dialect, CommissionRecord.created_at)
+    return and_(
+        _sem_indice(dialect, CommissionRecord.status) == literal_column("'eligible'"),
+        _sem_indice(dialect, CommissionRecord.payout_id).is_(None),
+        _sem_indice(dialect, CommissionRecord.paid).isnot(True),
+        created_at >= period_start,
+        created_at < period_end,
+    )
+
+
+def _candidatas_novas(desde: Optional[datetime], marca: Marca):
+    # modo incremental: o intervalo de created_at é curto, qualquer índice serve
+    filtro = [
+        CommissionRecord.status == literal_column("'eligible'"),
+        CommissionRecord.payout_id.is_(None),
+        CommissionRecord.paid.isnot(True),
+        tuple_(CommissionRecord.created_at, CommissionRecord.id) <= tuple_(*marca),
+    ]
+    if desde is not None:
+        filtro.append(CommissionRecord.created_at > desde)
+    return and_(*filtro)
+
 
-def gerar_payouts_periodo(db: Session, period_start: datetime, period_end: datetime):
-    rows = (
-        db.query(
-            CommissionRecord.beneficiary_id,
-            func.sum(CommissionRecord.amount).label("total")
+def _fim_do_bloco(db: Session, depois_de: Optional[str], chunk: int) -> Optional[str]:
+    """Último id dos próximos `chunk` utilizadores (keyset pela PK)."""
+    q = select(User.id).order_by(User.id)
+    if depois_de is not None:
+        q = q.where(User.id > depois_de)
+    ate = db.execute(q.offset(chunk - 1).limit(1)).scalar()
+    if ate is None and db.execute(q.limit(1)).scalar() is not None:
+        # último bloco, incompleto
+        ate = db.execute(select(func.max(User.id))).scalar()
+    return ate
+
+
+def _intervalo(col, depois_de: Optional[str], ate: str):
+    if depois_de is None:
+        return col <= ate
+    return and_(col > depois_de, col <= ate)
+
+
+def _blocos_de_utilizadores(db: Session, depois_de: Optional[str], chunk: int) -> Iterator[Tuple[str, Faixa]]:
+    while True:
+        ate = _fim_do_bloco(db, depois_de, chunk)
+        if ate is None:
+            return
+        yield ate, (lambda col, d=depois_de, a=ate: _intervalo(col, d, a))
+        depois_de = ate
+
+
+def _blocos_de_lista(beneficiarios: Sequence[str], chunk: int) -> Iterator[Tuple[str, Faixa]]:
+    for i in range(0, len(beneficiarios), chunk):
+        bloco = list(beneficiarios[i:i + chunk])
+        yield bloco[-1], (lambda col, b=bloco: col.in_(b))
+
+
+def _inserir_payouts(db: Session, dialect: str, candidatas, faixa, batch_id: str, period_start, period_end, now):
+    table = Payout.__table__
+    campos = {
+        "user_id": User.id,
+        "period_start": literal(period_start, table.c.period_start.type),
+        "period_end": literal(period_end, table.c.period_end.type),
+        "amount": func.sum(CommissionRecord.amount),
+        "status": literal(PayoutStatus.pending, table.c.status.type),
+        "state": literal("generated"),
+        "batch_id": literal(batch_id),
+        "created_at": literal(now, table.c.created_at.type),
+    }
+    agregado = (
+        select(*campos.values())
+        .select_from(User)
+        .join(CommissionRecord, CommissionRecord.beneficiary_id == User.id)
+        .where(candidatas, faixa)
+        .group_by(User.id)
+        .having(func.sum(CommissionRecord.amount) > 0)
+    )
+
+    uuid_sql = _UUID_SQL.get(dialect)
+    if uuid_sql:
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        sel = agregado.add_columns(literal_column(uuid_sql).label("id"))
+        db.execute(
+            insert(table)
+            .from_select([*campos, "id"], sel)
+            .on_conflict_do_nothing(index_elements=["user_id", "period_start", "period_end"])
         )
+        return
+
+    # outros bancos: ids gerados aqui (no máximo um bloco de linhas)
+    rows = [dict(zip(campos, r), id=str(uuid.uuid4())) for r in db.execute(agregado).all()]
+    if rows:
+        db.execute(table.insert(), rows)
+
+
+def _gerar_bloco(
+    db: Session,
+    dialect: str,
+    candidatas,
+    batch_id: str,
+    period_start: datetime,
+    period_end: datetime,
+    now: datetime,
+    faixa: Faixa,
+) -> Dict[str, Any]:
+    do_periodo = and_(
+        faixa(Payout.user_id),
+        Payout.period_start == period_start,
+        Payout.period_end == period_end,
+    )
+    # payouts do período criados antes (outra execução) e ainda por exportar:
+    # recebem as comissões que o ON CONFLICT deixaria de fora
+    anteriores = dict(
+        db.query(Payout.id, Payout.amount)
         .filter(
-            CommissionRecord.created_at >= period_start,
-            CommissionRecord.created_at < period_end,
-            CommissionRecord.paid == False,
+            do_periodo,
+            or_(Payout.batch_id.is_(None), Payout.batch_id != batch_id),
+            Payout.state == "generated",
+            Payout.status == PayoutStatus.pending,
         )
-        .group_by(CommissionRecord.beneficiary_id)
+        .with_for_update()
         .all()
     )
 
-    for row in rows:
-        beneficiary_id = row.beneficiary_id
-        total = row.total or Decimal("0.00")
-        if total <= 0:
-            continue
+    _inserir_payouts(db, dialect, candidatas, faixa(User.id), batch_id, period_start, period_end, now)
+    do_bloco = and_(do_periodo, or_(Payout.batch_id == batch_id, Payout.id.in_(list(anteriores))))
 
-        payout = Payout(
-            user_id=beneficiary_id,
-            period_start=period_start,
-            period_end=period_end,
-            amount=total,
-            status=PayoutStatus.pending,
+    # UPDATE ... FROM payouts: liga e tranca as comissões de cada payout
+    linked = db.execute(
+        update(CommissionRecord)
+        .where(
+            candidatas,
+            faixa(CommissionRecord.beneficiary_id),
+            CommissionRecord.beneficiary_id == Payout.user_id,
+            do_bloco,
         )
-        db.add(payout)
-
-        (
-            db.query(CommissionRecord)
-            .filter(
-                CommissionRecord.beneficiary_id == beneficiary_id,
-                CommissionRecord.created_at >= period_start,
-                CommissionRecord.created_at < period_end,
-                CommissionRecord.paid == False,
-            )
-            .update({"paid": True}, synchronize_session=False)
+        .values(payout_id=Payout.id, status="locked")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    do_payout = CommissionRecord.payout_id == Payout.id
+    # payout do período já exportado/pago (ou soma <= 0): ficam eligible
+    unlinked = (
+        db.query(func.count(CommissionRecord.id))
+        .filter(candidatas, faixa(CommissionRecord.beneficiary_id))
+        .scalar()
+    )
+    if not linked:
+        # nada ligado (ex.: re-execução sem comissões novas): nada a somar
+        db.execute(
+            delete(Payout)
+            .where(do_periodo, Payout.batch_id == batch_id)
+            .execution_options(synchronize_session=False)
         )
+        return {"created": 0, "commissions": 0, "unlinked": unlinked, "amount": Decimal("0.00")}
+
+    soma_ligada = (
+        select(func.coalesce(func.sum(CommissionRecord.amount), 0))
+        .where(do_payout)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Payout)
+        .where(do_bloco)
+        .values(amount=soma_ligada)
+        .execution_options(synchronize_session=False)
+    )
+    # outra geração em paralelo ligou estas comissões primeiro
+    db.execute(
+        delete(Payout)
+        .where(do_periodo, Payout.batch_id == batch_id, ~select(CommissionRecord.id).where(do_payout).exists())
+        .execution_options(synchronize_session=False)
+    )
+
+    created, total = 0, Decimal("0.00")
+    deltas: Deltas = {}
+    for payout_id, user_id, amount in db.query(Payout.id, Payout.user_id, Payout.amount).filter(do_bloco).all():
+        if payout_id in anteriores:
+            amount = Decimal(amount or 0) - Decimal(anteriores[payout_id] or 0)
+        else:
+            amount = Decimal(amount or 0)
+            created += 1
+        if amount:
+            deltas[user_id] = {"total_eligible": -amount, "total_locked": amount}
+        total += amount
+    aplicar_saldos(db, deltas)
+    return {"created": created, "commissions": linked, "unlinked": unlinked, "amount": total}
+
+
+def _gerar(
+    db: Session,
+    dialect: str,
+    candidatas,
+    blocos: Iterator[Tuple[str, Faixa]],
+    batch_id: str,
+    period_start: datetime,
+    period_end: datetime,
+    ao_gravar_bloco: Optional[Callable[[str, Dict[str, Any]], None]],
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    now = datetime.utcnow()
+
+    created, linked, unlinked, chunks = 0, 0, 0, 0
+    total = Decimal("0.00")
+    for ate, faixa in blocos:
+        bloco = _gerar_bloco(db, dialect, candidatas, batch_id, period_start, period_end, now, faixa)
+        if ao_gravar_bloco is not None:
+            ao_gravar_bloco(ate, bloco)
+        db.commit()
+
+        created += bloco["created"]
+        linked += bloco["commissions"]
+        unlinked += bloco["unlinked"]
+        total += bloco["amount"]
+        chunks += 1
+
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_id": batch_id,
+        "created": created,
+        "commissions": linked,
+        "unlinked": unlinked,
+        "total_amount": str(total.quantize(Decimal("0.01"))),
+        "chunks": chunks,
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat(),
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+def gerar_payouts_periodo(
+    db: Session,
+    period_start: datetime,
+    period_end: datetime,
+    chunk_size: Optional[int] = None,
+    batch_id: Optional[str] = None,
+    depois_de: Optional[str] = None,
+    ao_gravar_bloco: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Gera um payout por beneficiário com as comissões eligible (sem payout)
+    criadas em [period_start, period_end) e tranca-as (locked + payout_id).
+    Um commit por bloco de beneficiários. Retorna contagens e o total.
+
+    depois_de: retoma a partir deste users.id (checkpoint de um job).
+    ao_gravar_bloco(ate, bloco): chamado antes do commit de cada bloco,
+    para gravar o checkpoint na mesma transacção.
+    """
+    dialect = db.get_bind().dialect.name
+    return _gerar(
+        db,
+        dialect,
+        _candidatas(dialect, period_start, period_end),
+        _blocos_de_utilizadores(db, depois_de, chunk_size or settings.PAYOUT_CHUNK),
+        batch_id or str(uuid.uuid4()),
+        period_start,
+        period_end,
+        ao_gravar_bloco,
+    )
+
+
+def marca_actual(db: Session) -> Optional[Marca]:
+    """(created_at, id) da comissão mais recente (índice ix_commission_created_at_id)."""
+    row = (
+        db.query(CommissionRecord.created_at, CommissionRecord.id)
+        .order_by(CommissionRecord.created_at.desc(), CommissionRecord.id.desc())
+        .first()
+    )
+    return (row.created_at, row.id) if row else None
+
+
+def beneficiarios_com_candidatas(
+    db: Session,
+    desde: Optional[datetime],
+    marca: Marca,
+    depois_de: Optional[str] = None,
+) -> List[str]:
+    q = (
+        db.query(CommissionRecord.beneficiary_id)
+        .filter(_candidatas_novas(desde, marca))
+        .distinct()
+        .order_by(CommissionRecord.beneficiary_id)
+    )
+    if depois_de is not None:
+        q = q.filter(CommissionRecord.beneficiary_id > depois_de)
+    return [row.beneficiary_id for row in q]
+
+
+def gerar_payouts_incrementais(
+    db: Session,
+    desde: Optional[datetime],
+    marca: Marca,
+    chunk_size: Optional[int] = None,
+    batch_id: Optional[str] = None,
+    depois_de: Optional[str] = None,
+    ao_gravar_bloco: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    beneficiarios: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Payouts das comissões eligible (sem payout) com created_at > desde e
+    (created_at, id) <= marca. Período dos payouts: (desde, marca].
+    Blocos só dos beneficiários com comissões nesse intervalo.
+    depois_de / ao_gravar_bloco como em gerar_payouts_periodo.
+    """
+    if beneficiarios is None:
+        beneficiarios = beneficiarios_com_candidatas(db, desde, marca, depois_de)
+    return _gerar(
+        db,
+        db.get_bind().dialect.name,
+        _candidatas_novas(desde, marca),
+        _blocos_de_lista(beneficiarios, chunk_size or settings.PAYOUT_CHUNK),
+        batch_id or str(uuid.uuid4()),
+        desde or SEM_INICIO,
+        marca[0],
+        ao_gravar_bloco,
+    )
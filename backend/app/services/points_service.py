@@ -1,8 +1,10 @@
 from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import bindparam, func, insert, update
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 
-from ..models import User, UserLevel, PointsTransaction, PointsType
+from ..models import Order, User, UserLevel, PointsTransaction, PointsType
 
 LEVEL_PERCENT = {
     UserLevel.bronze: Decimal("0.02"),
@@ -55,3 +57,116 @@ def usar_pontos(db: Session, user: User, points: int, description: str, order_id
         order_id=order_id,
     )
     db.add(tx)
+
+
+def adicionar_pontos_em_lote(
+    db: Session,
+    lancamentos: Iterable[Tuple[str, int, str, Optional[str]]],
+):
+    """
+    Versão em lote de `adicionar_pontos` para muitos pedidos de uma vez.
+    lancamentos: (user_id, points, description, order_id)
+
+    Um INSERT multi-linha em points_transactions e um batch de
+    UPDATE users SET points_balance = points_balance + :n por utilizador.
+    Objectos User já carregados na sessão ficam com o saldo antigo (expire se precisar).
+    """
+    lancamentos = [l for l in lancamentos if int(l[1] or 0) > 0]
+    if not lancamentos:
+        return
+
+    now = datetime.utcnow()
+    db.execute(
+        insert(PointsTransaction),
+        [
+            {
+                "user_id": user_id,
+                "type": PointsType.earn,
+                "points": int(points),
+                "description": description,
+                "order_id": order_id,
+                "created_at": now,
+            }
+            for user_id, points, description, order_id in lancamentos
+        ],
+    )
+
+    por_user = {}
+    for user_id, points, _, _ in lancamentos:
+        por_user[user_id] = por_user.get(user_id, 0) + int(points)
+
+    users = User.__table__
+    db.execute(
+        update(users)
+        .where(users.c.id == bindparam("b_id"))
+        .values(points_balance=func.coalesce(users.c.points_balance, 0) + bindparam("b_points")),
+        [{"b_id": user_id, "b_points": points} for user_id, points in por_user.items()],
+    )
+
+
+def estornar_pontos_de_pedidos(db: Session, order_ids: Iterable[str]) -> int:
+    """
+    Pedidos cancelados sem pagamento: devolve os `points_used` e retira os
+    `points_earned` lançados em `create_order`, em lote (um INSERT de
+    lançamentos `adjust` e um batch de UPDATE por utilizador). Se os pontos
+    ganhos já foram gastos, só se retira o que o saldo tem: o lançamento
+    é do valor efectivamente retirado (soma dos lançamentos == saldo).
+    Não faz commit. Retorna o nº de lançamentos.
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return 0
+
+    pedidos = []
+    for i in range(0, len(order_ids), 1000):
+        pedidos += (
+            db.query(Order.id, Order.user_id, Order.points_used, Order.points_earned)
+            .filter(Order.id.in_(order_ids[i:i + 1000]))
+            .all()
+        )
+    user_ids = sorted({p.user_id for p in pedidos})
+    saldos = {}
+    for i in range(0, len(user_ids), 1000):
+        saldos.update(
+            db.query(User.id, User.points_balance)
+            .filter(User.id.in_(user_ids[i:i + 1000]))
+            .with_for_update()
+            .all()
+        )
+
+    now = datetime.utcnow()
+    lancamentos = []
+    por_user = {}
+
+    def _lancar(user_id, order_id, points, description):
+        if not points:
+            return
+        lancamentos.append({
+            "user_id": user_id,
+            "type": PointsType.adjust,
+            "points": points,
+            "description": description,
+            "order_id": order_id,
+            "created_at": now,
+        })
+        por_user[user_id] = por_user.get(user_id, 0) + points
+
+    # devoluções primeiro: o saldo que voltam pode cobrir os estornos
+    for order_id, user_id, used, _ in pedidos:
+        _lancar(user_id, order_id, int(used or 0), "Estorno de pontos usados (pedido cancelado)")
+    for order_id, user_id, _, earned in pedidos:
+        saldo = int(saldos.get(user_id) or 0) + por_user.get(user_id, 0)
+        _lancar(user_id, order_id, -min(int(earned or 0), max(saldo, 0)), "Estorno de pontos ganhos (pedido cancelado)")
+    if not lancamentos:
+        return 0
+
+    db.execute(insert(PointsTransaction), lancamentos)
+
+    users = User.__table__
+    db.execute(
+        update(users)
+        .where(users.c.id == bindparam("b_id"))
+        .values(points_balance=func.coalesce(users.c.points_balance, 0) + bindparam("b_points")),
+        [{"b_id": user_id, "b_points": points} for user_id, points in por_user.items() if points],
+    )
+    return len(lancamentos)
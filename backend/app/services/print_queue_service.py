@@ -0,0 +1,210 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import Order, OrderItem, PrintJob, Product
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+# job em "processing" há mais tempo que isto = worker morreu a meio
+STALE_AFTER = timedelta(minutes=10)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def enfileirar_impressao(
+    db: Session,
+    order: Order,
+    delivery_address: Optional[Dict[str, Any]] = None,
+) -> PrintJob:
+    """
+    Cria o job de impressão na mesma transacção do pedido (não faz commit).
+    """
+    job = PrintJob(
+        order_id=order.id,
+        status="pending",
+        payload={"delivery_address": delivery_address or {}},
+        attempts=0,
+        max_attempts=settings.PRINT_MAX_ATTEMPTS,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(job)
+    return job
+
+
+def calcular_backoff(attempts: int) -> timedelta:
+    """30s, 60s, 120s, ... até 1h."""
+    seconds = BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1))
+    return timedelta(seconds=min(seconds, BACKOFF_MAX_SECONDS))
+
+
+def _condicao_disponivel(now: datetime):
+    return or_(
+        and_(PrintJob.status == "pending", PrintJob.next_attempt_at <= now),
+        and_(PrintJob.status == "processing", PrintJob.locked_at < now - STALE_AFTER),
+    )
+
+
+def reservar_jobs(db: Session, limit: int) -> List[str]:
+    """
+    Reserva até `limit` jobs prontos a correr.
+    Cada job é reservado com um UPDATE condicional, por isso vários
+    processos (workers do uvicorn) podem partilhar a mesma fila.
+    """
+    now = datetime.utcnow()
+    candidates = [
+        row.id
+        for row in (
+            db.query(PrintJob.id)
+            .filter(_condicao_disponivel(now))
+            .order_by(PrintJob.next_attempt_at)
+            .limit(limit)
+            .all()
+        )
+    ]
+
+    claimed: List[str] = []
+    for job_id in candidates:
+        res = db.execute(
+            update(PrintJob)
+            .where(PrintJob.id == job_id, _condicao_disponivel(now))
+            .values(status="processing", locked_at=now, attempts=PrintJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if res.rowcount == 1:
+            claimed.append(job_id)
+    db.commit()
+    return claimed
+
+
+def repetir_job(db: Session, job_id: str) -> PrintJob:
+    """
+    Volta a pôr em pending um job failed (retry manual do admin).
+    UPDATE condicional: done/processing/pending dão 409, nunca reimprime
+    nem corre duas vezes.
+    """
+    res = db.execute(
+        update(PrintJob)
+        .where(PrintJob.id == job_id, PrintJob.status == "failed")
+        .values(status="pending", attempts=0, locked_at=None, next_attempt_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    job = db.query(PrintJob).filter(PrintJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Print job not found")
+    if res.rowcount != 1:
+        raise HTTPException(status_code=409, detail=f"Job {job.status} não pode ser repetido (só failed)")
+    return job
+
+
+def _dados_etiqueta(db: Session, job: PrintJob) -> Dict[str, Any]:
+    order = db.query(Order).filter(Order.id == job.order_id).first()
+    if not order:
+        raise LookupError(f"Pedido {job.order_id} não encontrado")
+
+    rows = (
+        db.query(OrderItem.quantity, OrderItem.unit_price, Product.name)
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(OrderItem.order_id == order.id)
+        .all()
+    )
+    return {
+        "id": order.id,
+        "delivery_address": (job.payload or {}).get("delivery_address") or {},
+        "items": [
+            {"name": name, "quantity": quantity, "price": str(unit_price)}
+            for quantity, unit_price, name in rows
+        ],
+        "total_amount": str(order.total_amount),
+    }
+
+
+def executar_job(job_id: str) -> bool:
+    """
+    Renderiza e imprime um job já reservado.
+    Em caso de erro reagenda com backoff exponencial ou marca como failed.
+    """
+    # import tardio: reportlab/qrcode só são necessários no worker
+    from ..utils.pdf_generator import generate_order_pdf
+    from ..utils.printer import print_pdf
+
+    db = SessionLocal()
+    try:
+        job = db.query(PrintJob).filter(PrintJob.id == job_id).first()
+        if not job:
+            return False
+
+        try:
+            pdf_file = generate_order_pdf(_dados_etiqueta(db, job), settings.PRINT_SPOOL_DIR)
+            job.pdf_path = pdf_file
+            print_pdf(pdf_file)
+        except Exception as e:
+            job.last_error = f"{type(e).__name__}: {e}"
+            job.locked_at = None
+            if job.attempts >= job.max_attempts:
+                job.status = "failed"
+                logger.error("Impressão do pedido %s falhou de vez: %s", job.order_id, job.last_error)
+            else:
+                job.status = "pending"
+                job.next_attempt_at = datetime.utcnow() + calcular_backoff(job.attempts)
+                logger.warning(
+                    "Impressão do pedido %s falhou (tentativa %s/%s): %s",
+                    job.order_id, job.attempts, job.max_attempts, job.last_error,
+                )
+            db.commit()
+            return False
+
+        job.status = "done"
+        job.locked_at = None
+        job.last_error = None
+        job.printed_at = datetime.utcnow()
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PRINT_WORKERS,
+            thread_name_prefix="print-worker",
+        )
+    return _executor
+
+
+def processar_fila_impressao(limit: Optional[int] = None) -> int:
+    """
+    Reserva os jobs prontos e processa-os no pool de workers.
+    Chamado periodicamente pelo scheduler (ver `job_print_queue` em main.py).
+    Retorna quantos jobs foram impressos com sucesso.
+    """
+    db = SessionLocal()
+    try:
+        job_ids = reservar_jobs(db, limit or settings.PRINT_WORKERS * 10)
+    finally:
+        db.close()
+
+    if not job_ids:
+        return 0
+
+    return sum(1 for ok in _get_executor().map(executar_job, job_ids) if ok)
+
+
+def encerrar_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
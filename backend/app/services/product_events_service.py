@@ -0,0 +1,185 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Product
+
+# =========================================================
+# Feed de alterações de produtos (preço / stock) para SSE
+#
+# Pub/sub em processo: as escritas (threads do threadpool ou do scheduler)
+# publicam DEPOIS do commit; cada evento é serializado uma vez e entregue
+# a todos os clientes ligados ao event loop, sem queries por cliente.
+# Cada cliente tem um buffer limitado; se encher (cliente lento), é
+# desligado com um evento `resync` e volta a ligar-se.
+# Com vários workers cada processo só vê as suas escritas: o cliente deve
+# tratar `resync` (e reconexões) relendo o catálogo.
+# =========================================================
+
+_RESYNC = object()
+
+
+class _Subscriber:
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def entregar(self, frame: bytes):
+        """Corre no event loop."""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # cliente lento: descarta o que tem e manda-o ressincronizar
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+
+
+_lock = threading.RLock()
+_subscribers: Dict[asyncio.AbstractEventLoop, Set[_Subscriber]] = {}
+_history: Deque[Tuple[int, bytes]] = deque(maxlen=settings.PRODUCT_EVENTS_HISTORY)
+_seq = 0
+
+
+def _frame(seq: int, event: str, data: Any) -> bytes:
+    payload = json.dumps(data, separators=(",", ":"), default=str)
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+def _entregar_todos(subs: List[_Subscriber], frame: bytes):
+    for sub in subs:
+        sub.entregar(frame)
+
+
+def tem_subscritores() -> bool:
+    with _lock:
+        return any(_subscribers.values())
+
+
+def _avancar_sequencia():
+    """
+    Escrita sem ninguém a ouvir: não guarda histórico, mas o salto no id
+    obriga quem reconectar com Last-Event-ID antigo a ressincronizar.
+    """
+    global _seq
+    with _lock:
+        _seq += 1
+        _history.clear()
+
+
+def publicar(deltas: List[Dict[str, Any]]):
+    """
+    Publica uma lista de deltas {id, price, stock, reserved, active}.
+    Thread-safe; pode ser chamado de qualquer thread.
+    """
+    global _seq
+    if not deltas:
+        return
+    with _lock:
+        if not tem_subscritores():
+            _avancar_sequencia()
+            return
+        _seq += 1
+        frame = _frame(_seq, "products", deltas)
+        _history.append((_seq, frame))
+        targets = [(loop, list(subs)) for loop, subs in _subscribers.items() if subs]
+
+    for loop, subs in targets:
+        try:
+            loop.call_soon_threadsafe(_entregar_todos, subs, frame)
+        except RuntimeError:
+            pass  # loop já fechado
+
+
+def publicar_produtos(db: Session, product_ids: Iterable[str]):
+    """
+    Chamar depois do commit: lê o estado actual dos produtos numa query
+    (o stock pode ter sido alterado por UPDATE em Core) e publica.
+    Sem clientes ligados não faz query.
+    """
+    ids = sorted({pid for pid in product_ids if pid})
+    if not ids:
+        return
+    if not tem_subscritores():
+        _avancar_sequencia()
+        return
+
+    rows = (
+        db.query(Product.id, Product.price, Product.stock, Product.reserved, Product.active)
+        .filter(Product.id.in_(ids))
+        .all()
+    )
+    publicar([
+        {
+            "id": r.id,
+            "price": str(r.price),
+            "stock": int(r.stock or 0),
+            "reserved": int(r.reserved or 0),
+            "active": bool(r.active),
+        }
+        for r in rows
+    ])
+
+
+def _replay(last_event_id: Optional[str]) -> Optional[List[bytes]]:
+    """
+    Eventos depois de `last_event_id`, ou None se já não estão no histórico.
+    """
+    try:
+        last = int(last_event_id)
+    except (TypeError, ValueError):
+        return None
+    if last == _seq:
+        return []
+    if not _history or last < _history[0][0] - 1 or last > _seq:
+        return None
+    return [frame for seq, frame in _history if seq > last]
+
+
+async def stream_eventos(last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Gerador SSE para StreamingResponse. Termina com `resync` se o cliente
+    ficar para trás; o cancelamento (cliente desligou) remove a subscrição.
+    """
+    loop = asyncio.get_running_loop()
+    sub = _Subscriber(settings.PRODUCT_EVENTS_BUFFER)
+    with _lock:
+        _subscribers.setdefault(loop, set()).add(sub)
+        seq = _seq
+        pending = _replay(last_event_id) if last_event_id is not None else []
+
+    try:
+        yield "retry: 3000\n\n".encode()
+        if pending is None:
+            yield _frame(seq, "resync", {})
+        else:
+            for frame in pending:
+                yield frame
+
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    sub.queue.get(), timeout=settings.PRODUCT_EVENTS_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if item is _RESYNC:
+                yield _frame(_seq, "resync", {})
+                return
+            yield item
+    finally:
+        with _lock:
+            subs = _subscribers.get(loop)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del _subscribers[loop]
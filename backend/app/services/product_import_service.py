@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Product
+from ..schemas import ProductImportRow
+from .product_events_service import publicar_produtos
+from .products_service import faceta_de, sincronizar_produtos
+
+# =========================================================
+# Importação em massa de produtos (CSV / NDJSON), upsert por SKU
+#
+# O ficheiro é lido linha a linha; cada lote de PRODUCT_IMPORT_BATCH
+# linhas válidas é gravado numa transacção (1 SELECT ... IN por lote +
+# INSERT/UPDATE em batch no flush). Erros de uma linha não abortam o lote.
+# Invalidar a cache do catálogo UMA vez no fim (quem chama).
+# =========================================================
+
+_MAX_TENTATIVAS = 3
+SKU_COLUMNS = ("sku", "external_id")
+
+# (nº da linha, linha válida | None, sku, erro)
+Linha = Tuple[int, Optional[ProductImportRow], Optional[str], Optional[str]]
+
+
+def _erro_validacao(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+    )
+
+
+def _validar(line: int, raw: Dict[str, Any]) -> Linha:
+    sku = raw.get("sku") or raw.get("external_id")
+    raw = {k: v for k, v in raw.items() if v is not None and v != ""}
+    raw["sku"] = sku
+    try:
+        return line, ProductImportRow.model_validate(raw), sku, None
+    except ValidationError as e:
+        return line, None, sku, _erro_validacao(e)
+
+
+def ler_csv(f: IO[bytes]) -> Iterator[Linha]:
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    if not reader.fieldnames:
+        raise HTTPException(status_code=400, detail="CSV vazio")
+    reader.fieldnames = [(name or "").strip().lower() for name in reader.fieldnames]
+    if not any(col in reader.fieldnames for col in SKU_COLUMNS):
+        raise HTTPException(status_code=400, detail="CSV sem coluna sku")
+
+    try:
+        for row in reader:
+            raw = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+            yield _validar(reader.line_num, raw)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"CSV inválido na linha {reader.line_num}: {e}")
+
+
+def ler_ndjson(f: IO[bytes]) -> Iterator[Linha]:
+    for line, data in enumerate(f, start=1):
+        if not data.strip():
+            continue
+        try:
+            raw = json.loads(data)
+        except ValueError:
+            yield line, None, None, "JSON inválido"
+            continue
+        if not isinstance(raw, dict):
+            yield line, None, None, "Esperado objecto JSON"
+            continue
+        yield _validar(line, raw)
+
+
+def _aplicar(product: Product, row: ProductImportRow):
+    for field in row.model_fields_set:
+        if field != "sku":
+            setattr(product, field, getattr(row, field))
+
+
+def _gravar_lote(db: Session, lote: List[Tuple[int, ProductImportRow]]) -> Tuple[int, int, List[Dict[str, Any]]]:
+    """
+    Upsert de um lote numa transacção. Retorna (criados, actualizados, erros).
+    """
+    skus = {row.sku for _, row in lote}
+    existentes = {p.sku: p for p in db.query(Product).filter(Product.sku.in_(skus)).all()}
+    antes = {p.id: faceta_de(p) for p in existentes.values()}
+
+    criados, actualizados, erros = 0, 0, []
+    tocados: Dict[str, Product] = {}
+    for line, row in lote:
+        product = existentes.get(row.sku)
+        if product is None:
+            if not row.name or row.price is None or row.cost is None or not row.category:
+                erros.append({
+                    "line": line,
+                    "sku": row.sku,
+                    "error": "name, price, cost e category obrigatórios para criar",
+                })
+                continue
+            product = Product(sku=row.sku, stock=0, active=True)
+            _aplicar(product, row)
+            db.add(product)
+            existentes[row.sku] = product
+            criados += 1
+        else:
+            _aplicar(product, row)
+            if product.sku not in tocados and product.id in antes:
+                actualizados += 1
+        tocados[row.sku] = product
+
+    db.flush()
+    sincronizar_produtos(db, tocados.values(), antes)
+    ids = [p.id for p in tocados.values()]
+    db.commit()
+    publicar_produtos(db, ids)
+    return criados, actualizados, erros
+
+
+def importar_produtos(db: Session, linhas: Iterator[Linha]) -> Dict[str, Any]:
+    created, updated = 0, 0
+    errors: List[Dict[str, Any]] = []
+
+    def _flush(lote):
+        nonlocal created, updated
+        for tentativa in range(_MAX_TENTATIVAS):
+            try:
+                c, u, e = _gravar_lote(db, lote)
+                break
+            except IntegrityError:
+                # SKU novo inserido por outra importação concorrente: relê e repete
+                db.rollback()
+                if tentativa == _MAX_TENTATIVAS - 1:
+                    raise HTTPException(status_code=409, detail="Conflito de SKU; tente novamente")
+        created += c
+        updated += u
+        errors.extend(e)
+
+    lote: List[Tuple[int, ProductImportRow]] = []
+    for line, row, sku, error in linhas:
+        if error:
+            errors.append({"line": line, "sku": sku, "error": error})
+            continue
+        lote.append((line, row))
+        if len(lote) >= settings.PRODUCT_IMPORT_BATCH:
+            _flush(lote)
+            lote = []
+    if lote:
+        _flush(lote)
+
+    return {
+        "created": created,
+        "updated": updated,
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda e: e["line"]),
+    }
@@ -0,0 +1,175 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..models import CategoryFacet, Product
+from ..utils.pagination import decode_cursor, encode_cursor, keyset_after
+from .search_service import indexar_produtos
+
+# =========================================================
+# Manutenção incremental de dados derivados do catálogo
+# (índice de busca + contagens por categoria) em cada escrita de produto.
+# Chamar ANTES do commit, na mesma transacção da escrita.
+# =========================================================
+
+SEM_CATEGORIA = ""
+
+
+def faceta_de(product: Product) -> Optional[str]:
+    """
+    Categoria em que o produto conta nas facetas (None = não conta: inactivo).
+    Capturar antes de alterar o produto e passar a `sincronizar_produtos`.
+    """
+    if not product.active:
+        return None
+    return product.category or SEM_CATEGORIA
+
+
+def ajustar_facetas(db: Session, deltas: Dict[str, int]):
+    """
+    UPSERT de `category_facets.product_count += delta` (um statement por categoria).
+    """
+    deltas = {cat: d for cat, d in deltas.items() if d}
+    if not deltas:
+        return
+
+    dialect = db.get_bind().dialect.name
+    table = CategoryFacet.__table__
+    for category, delta in deltas.items():
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            stmt = insert(table).values(category=category, product_count=delta)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.category],
+                set_={"product_count": table.c.product_count + stmt.excluded.product_count},
+            )
+            db.execute(stmt)
+        else:
+            updated = (
+                db.query(CategoryFacet)
+                .filter(CategoryFacet.category == category)
+                .update(
+                    {"product_count": CategoryFacet.product_count + delta},
+                    synchronize_session=False,
+                )
+            )
+            if not updated:
+                db.add(CategoryFacet(category=category, product_count=delta))
+
+
+def sincronizar_produtos(
+    db: Session,
+    products: Iterable[Product],
+    antes: Optional[Dict[str, Optional[str]]] = None,
+):
+    """
+    Depois de criar/alterar produtos (antes do commit):
+    - actualiza o índice de busca
+    - ajusta as facetas de categoria pela diferença antes/depois
+
+    `antes`: {product_id: faceta_de(product)} capturado antes da alteração;
+    produtos novos não entram (contam como None).
+    """
+    products = list(products)
+    antes = antes or {}
+
+    deltas: Dict[str, int] = {}
+    for p in products:
+        old = antes.get(p.id)
+        new = faceta_de(p)
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] = deltas.get(old, 0) - 1
+        if new is not None:
+            deltas[new] = deltas.get(new, 0) + 1
+
+    ajustar_facetas(db, deltas)
+    indexar_produtos(db, products)
+
+
+def recalcular_facetas(db: Session, apenas_se_vazio: bool = True):
+    """
+    Reconstrói `category_facets` a partir de products (arranque/reparação).
+    """
+    if apenas_se_vazio and db.query(CategoryFacet.category).first() is not None:
+        return
+
+    category = func.coalesce(Product.category, literal_column("''"))
+    rows = (
+        db.query(category, func.count(Product.id))
+        .filter(Product.active == True)
+        .group_by(category)
+        .all()
+    )
+    db.query(CategoryFacet).delete(synchronize_session=False)
+    db.add_all([CategoryFacet(category=cat, product_count=n) for cat, n in rows])
+    db.commit()
+
+
+def listar_facetas(db: Session) -> Dict[str, int]:
+    return {
+        f.category: f.product_count
+        for f in db.query(CategoryFacet).filter(CategoryFacet.product_count > 0).all()
+    }
+
+
+# sort -> (coluna principal, descendente?)
+CATALOG_SORTS = {
+    "newest": (Product.created_at, True),
+    "price_asc": (Product.price, False),
+    "price_desc": (Product.price, True),
+}
+
+
+def _valor_cursor(sort: str, raw: str):
+    try:
+        return datetime.fromisoformat(raw) if sort == "newest" else Decimal(raw)
+    except (ValueError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+
+def paginar_catalogo(
+    db: Session,
+    category: Optional[str] = None,
+    min_price: Optional[Decimal] = None,
+    max_price: Optional[Decimal] = None,
+    in_stock: bool = False,
+    sort: str = "newest",
+    limit: int = 24,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Product], Optional[str]]:
+    """
+    Página do catálogo activo com filtros e paginação keyset em (sort, id).
+    Servida pelos índices (active, category, price) e (active, created_at).
+    """
+    column, desc = CATALOG_SORTS[sort]
+
+    q = db.query(Product).filter(Product.active == True)
+    if category is not None:
+        q = q.filter(Product.category == category)
+    if min_price is not None:
+        q = q.filter(Product.price >= min_price)
+    if max_price is not None:
+        q = q.filter(Product.price <= max_price)
+    if in_stock:
+        q = q.filter(Product.stock > 0)
+
+    if cursor:
+        raw, last_id = decode_cursor(cursor, 2)
+        q = q.filter(keyset_after((column, Product.id), (_valor_cursor(sort, raw), last_id), desc=desc))
+
+    order = (column.desc(), Product.id.desc()) if desc else (column.asc(), Product.id.asc())
+    rows = q.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+    return rows, next_cursor
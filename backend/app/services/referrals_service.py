@@ -0,0 +1,163 @@
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..models import ReferralAncestry, User
+
+# =========================================================
+# Rede de indicações materializada (closure table referral_ancestry)
+#
+# Para cada utilizador guarda todos os ancestrais com a distância, por
+# isso "uplines até ao nível N" e "downline até ao nível N" são uma query
+# indexada, sem percorrer referred_by um nível de cada vez.
+# Mantida no registo e no re-parent do admin (na transacção da escrita).
+# =========================================================
+
+IN_CHUNK = 1000
+MAX_DEPTH_REBUILD = 64  # protecção contra ciclos em dados antigos
+
+_REBUILD_SQL = """
+INSERT INTO referral_ancestry (ancestor_id, descendant_id, depth)
+WITH RECURSIVE t(ancestor_id, descendant_id, depth) AS (
+    SELECT referred_by_id, id, 1 FROM users WHERE referred_by_id IS NOT NULL
+    UNION ALL
+    SELECT u.referred_by_id, t.descendant_id, t.depth + 1
+    FROM t JOIN users u ON u.id = t.ancestor_id
+    WHERE u.referred_by_id IS NOT NULL AND t.depth < :max_depth
+)
+SELECT ancestor_id, descendant_id, MIN(depth)
+FROM t
+WHERE ancestor_id <> descendant_id
+GROUP BY ancestor_id, descendant_id
+"""
+
+# novo pai e os seus ancestrais  x  o utilizador e a sua sub-árvore
+_LIGAR_SQL = """
+INSERT INTO referral_ancestry (ancestor_id, descendant_id, depth)
+SELECT a.ancestor_id, s.descendant_id, a.depth + s.depth + 1
+FROM (
+    SELECT :parent_id AS ancestor_id, 0 AS depth
+    UNION ALL
+    SELECT ancestor_id, depth FROM referral_ancestry WHERE descendant_id = :parent_id
+) a
+CROSS JOIN (
+    SELECT :user_id AS descendant_id, 0 AS depth
+    UNION ALL
+    SELECT descendant_id, depth FROM referral_ancestry WHERE ancestor_id = :user_id
+) s
+"""
+
+# corta a sub-árvore do utilizador (incluindo ele) dos ancestrais actuais
+_DESLIGAR_SQL = """
+DELETE FROM referral_ancestry
+WHERE ancestor_id IN (
+    SELECT ancestor_id FROM referral_ancestry WHERE descendant_id = :user_id
+)
+AND (
+    descendant_id = :user_id
+    OR descendant_id IN (
+        SELECT descendant_id FROM referral_ancestry WHERE ancestor_id = :user_id
+    )
+)
+"""
+
+
+def reconstruir_rede(db: Session, apenas_se_vazio: bool = True):
+    """
+    Reconstrói referral_ancestry a partir de users.referred_by_id
+    (arranque/reparação). Um único INSERT ... WITH RECURSIVE.
+    """
+    if apenas_se_vazio and db.query(ReferralAncestry.ancestor_id).first() is not None:
+        return
+    if apenas_se_vazio and db.query(User.id).filter(User.referred_by_id.isnot(None)).first() is None:
+        return
+
+    db.query(ReferralAncestry).delete(synchronize_session=False)
+    db.execute(text(_REBUILD_SQL), {"max_depth": MAX_DEPTH_REBUILD})
+    db.commit()
+
+
+def registrar_na_rede(db: Session, user: User):
+    """
+    Utilizador novo (já com id, flush feito): herda os ancestrais de quem o indicou.
+    """
+    if user.referred_by_id:
+        db.execute(text(_LIGAR_SQL), {"parent_id": user.referred_by_id, "user_id": user.id})
+
+
+def reparentar(db: Session, user: User, parent_id: Optional[str]):
+    """
+    Muda quem indicou `user` (None = sem indicador), movendo toda a sub-árvore.
+    Recusa ciclos: o novo pai não pode ser o próprio nem um descendente.
+    """
+    if parent_id == user.referred_by_id:
+        return
+
+    if parent_id is not None:
+        if parent_id == user.id:
+            raise HTTPException(status_code=409, detail="Utilizador não pode indicar-se a si próprio")
+        if db.get(User, parent_id) is None:
+            raise HTTPException(status_code=404, detail="Indicador não encontrado")
+        ciclo = (
+            db.query(ReferralAncestry.depth)
+            .filter(
+                ReferralAncestry.ancestor_id == user.id,
+                ReferralAncestry.descendant_id == parent_id,
+            )
+            .first()
+        )
+        if ciclo is not None:
+            raise HTTPException(status_code=409, detail="O novo indicador está na rede deste utilizador (ciclo)")
+
+    db.execute(text(_DESLIGAR_SQL), {"user_id": user.id})
+    user.referred_by_id = parent_id
+    db.flush()
+    if parent_id is not None:
+        db.execute(text(_LIGAR_SQL), {"parent_id": parent_id, "user_id": user.id})
+
+
+def uplines(db: Session, user_id: str, niveis: int) -> List[str]:
+    """[upline1, upline2, ...] até `niveis`, numa query."""
+    rows = (
+        db.query(ReferralAncestry.ancestor_id)
+        .filter(
+            ReferralAncestry.descendant_id == user_id,
+            ReferralAncestry.depth.between(1, niveis),
+        )
+        .order_by(ReferralAncestry.depth)
+        .all()
+    )
+    return [r.ancestor_id for r in rows]
+
+
+def uplines_em_lote(db: Session, user_ids: Iterable[str], niveis: int) -> Dict[str, List[str]]:
+    """{user_id: [upline1, upline2, ...]} com uma query por bloco de ids."""
+    ids = sorted(set(user_ids))
+    out: Dict[str, List[str]] = {uid: [] for uid in ids}
+    for i in range(0, len(ids), IN_CHUNK):
+        rows = (
+            db.query(ReferralAncestry.descendant_id, ReferralAncestry.ancestor_id)
+            .filter(
+                ReferralAncestry.descendant_id.in_(ids[i:i + IN_CHUNK]),
+                ReferralAncestry.depth.between(1, niveis),
+            )
+            .order_by(ReferralAncestry.descendant_id, ReferralAncestry.depth)
+            .all()
+        )
+        for r in rows:
+            out[r.descendant_id].append(r.ancestor_id)
+    return out
+
+
+def downline(db: Session, user_id: str, max_depth: Optional[int] = None, limit: int = 100, offset: int = 0):
+    """(User, depth) da rede abaixo de `user_id`, mais próximos primeiro."""
+    q = (
+        db.query(User, ReferralAncestry.depth)
+        .join(ReferralAncestry, ReferralAncestry.descendant_id == User.id)
+        .filter(ReferralAncestry.ancestor_id == user_id)
+    )
+    if max_depth is not None:
+        q = q.filter(ReferralAncestry.depth <= max_depth)
+    return q.order_by(ReferralAncestry.depth, User.created_at).offset(offset).limit(limit).all()
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Order, OrderStatus, Product, StockReservation
+from .points_service import estornar_pontos_de_pedidos
+from .product_events_service import publicar_produtos
+
+_products = Product.__table__
+
+# devolve ao stock disponível o que estava reservado
+_REPOR_STMT = (
+    update(_products)
+    .where(_products.c.id == bindparam("b_id"))
+    .values(
+        stock=func.coalesce(_products.c.stock, 0) + bindparam("b_qty"),
+        reserved=func.coalesce(_products.c.reserved, 0) - bindparam("b_qty"),
+    )
+)
+
+# só larga a reserva (venda concretizada ou stock já reposto por outro caminho)
+_LARGAR_STMT = (
+    update(_products)
+    .where(_products.c.id == bindparam("b_id"))
+    .values(reserved=func.coalesce(_products.c.reserved, 0) - bindparam("b_qty"))
+)
+
+
+def criar_reservas(
+    db: Session,
+    order_id: str,
+    demanda: Dict[str, int],
+    now: Optional[datetime] = None,
+):
+    """
+    Regista as reservas do pedido pendente (o stock já foi baixado por
+    `stock_service.reservar_stock(..., reservado=True)`).
+    """
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(minutes=settings.ORDER_RESERVATION_MINUTES)
+    db.add_all([
+        StockReservation(
+            order_id=order_id,
+            product_id=product_id,
+            quantity=qty,
+            status="active",
+            expires_at=expires_at,
+            created_at=now,
+        )
+        for product_id, qty in demanda.items()
+    ])
+
+
+def _fechar_reservas(db: Session, order_ids: List[str], status: str, repor_stock: bool) -> List[str]:
+    """
+    Fecha as reservas activas dos pedidos e acerta `products.reserved`
+    (e `stock`, se `repor_stock`) com um batch de UPDATE por SKU.
+    Retorna os SKUs alterados.
+    """
+    if not order_ids:
+        return []
+
+    rows = (
+        db.query(StockReservation.product_id, func.sum(StockReservation.quantity))
+        .filter(
+            StockReservation.order_id.in_(order_ids),
+            StockReservation.status == "active",
+        )
+        .group_by(StockReservation.product_id)
+        .all()
+    )
+    if not rows:
+        return []
+
+    (
+        db.query(StockReservation)
+        .filter(
+            StockReservation.order_id.in_(order_ids),
+            StockReservation.status == "active",
+        )
+        .update({"status": status}, synchronize_session=False)
+    )
+    db.execute(
+        _REPOR_STMT if repor_stock else _LARGAR_STMT,
+        [{"b_id": product_id, "b_qty": int(qty)} for product_id, qty in rows],
+    )
+    return [product_id for product_id, _ in rows]
+
+
+def consumir_reservas(db: Session, order_id: str) -> List[str]:
+    """Pedido pago: a reserva vira venda."""
+    return _fechar_reservas(db, [order_id], "consumed", repor_stock=False)
+
+
+def liberar_reservas(db: Session, order_id: str, repor_stock: bool = True) -> List[str]:
+    """Pedido cancelado. `repor_stock=False` se o chamador já repõe o stock."""
+    return _fechar_reservas(db, [order_id], "released", repor_stock=repor_stock)
+
+
+def _cancelar_pendentes(db: Session, order_ids: Iterable[str]) -> List[str]:
+    """
+    Cancela os pedidos que ainda estão PENDING e retorna os ids cancelados.
+    UPDATE condicional: um pagamento concorrente ganha ao job.
+    """
+    stmt = (
+        update(Order)
+        .where(Order.id.in_(list(order_ids)), Order.status == OrderStatus.pending)
+        .values(status=OrderStatus.canceled)
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        return [row[0] for row in db.execute(stmt.returning(Order.id))]
+
+    canceled = []
+    for order_id in order_ids:
+        res = db.execute(stmt.where(Order.id == order_id))
+        if res.rowcount:
+            canceled.append(order_id)
+    return canceled
+
+
+def liberar_reservas_expiradas(db: Session, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    Job: cancela pedidos pendentes com reserva expirada e devolve o stock.
+
+    Lê as reservas vencidas pelo índice (status, expires_at), em lotes, e
+    faz commit por lote. Reservas de pedidos que já não estão pendentes
+    (ex.: pagos sem consumir a reserva) são fechadas sem repor stock.
+    Os pontos usados/ganhos dos pedidos cancelados são estornados na
+    mesma transacção.
+    """
+    batch_size = batch_size or settings.RESERVATION_RELEASE_BATCH
+    totals = {"orders_canceled": 0, "orders_closed": 0}
+
+    while True:
+        now = datetime.utcnow()
+        rows = (
+            db.query(StockReservation.order_id)
+            .filter(
+                StockReservation.status == "active",
+                StockReservation.expires_at <= now,
+            )
+            .order_by(StockReservation.expires_at)
+            .limit(batch_size)
+            .all()
+        )
+        order_ids = list(dict.fromkeys(r.order_id for r in rows))
+        if not order_ids:
+            break
+
+        canceled = _cancelar_pendentes(db, order_ids)
+        others = [oid for oid in order_ids if oid not in set(canceled)]
+
+        repostos = _fechar_reservas(db, canceled, "released", repor_stock=True)
+        estornar_pontos_de_pedidos(db, canceled)
+        fechados = _fechar_reservas(db, others, "consumed", repor_stock=False)
+        db.commit()
+        publicar_produtos(db, repostos + fechados)
+
+        totals["orders_canceled"] += len(canceled)
+        totals["orders_closed"] += len(others)
+
+        if len(rows) < batch_size:
+            break
+
+    return totals
@@ -0,0 +1,153 @@
+import re
+from typing import Iterable, List
+
+from sqlalchemy import bindparam, or_, text
+from sqlalchemy.orm import Session
+
+from ..models import Product
+
+# =========================================================
+# Busca full-text de produtos (name, description, category)
+#
+# - SQLite: tabela virtual FTS5 `products_fts` com tokenizer unicode61
+#   remove_diacritics 2 (sem acentos, sem maiúsculas); mantida pela app
+#   em cada create/update/deactivate (ver indexar_produtos).
+# - Postgres: coluna gerada `products.search_vector` (tsvector com a
+#   configuração pt_unaccent) + índice GIN, criados em migrate.sql;
+#   o próprio Postgres mantém o índice em cada escrita.
+# =========================================================
+
+# pesos: name > category > description
+_FTS5_RANK = "bm25(products_fts, 0.0, 10.0, 2.0, 5.0)"
+
+_SQLITE_DDL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    product_id UNINDEXED,
+    name,
+    description,
+    category,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+_DELETE_CHUNK = 500
+
+# fallback LIKE (outros bancos): as colunas indexadas acima
+_COLUNAS_BUSCA = (Product.name, Product.description, Product.category)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def _tokens(q: str) -> List[str]:
+    return _TOKEN_RE.findall(q or "")[:8]
+
+
+def garantir_indice_busca(db: Session):
+    """
+    No arranque: cria o índice FTS5 (SQLite) e popula-o se estiver vazio.
+    Em Postgres o índice vem de migrate.sql.
+    """
+    if _dialect(db) != "sqlite":
+        return
+    db.execute(text(_SQLITE_DDL))
+    vazio = db.execute(text("SELECT NOT EXISTS (SELECT 1 FROM products_fts)")).scalar()
+    if vazio:
+        db.execute(text(
+            "INSERT INTO products_fts (product_id, name, description, category) "
+            "SELECT id, name, coalesce(description, ''), coalesce(category, '') "
+            "FROM products WHERE active = 1"
+        ))
+    db.commit()
+
+
+def indexar_produtos(db: Session, products: Iterable[Product]):
+    """
+    Actualiza o índice para os produtos dados (na mesma transacção da escrita).
+    Produtos inactivos saem do índice. Em Postgres não faz nada.
+    """
+    if _dialect(db) != "sqlite":
+        return
+
+    products = list(products)
+    if not products:
+        return
+
+    # product_id é UNINDEXED: cada DELETE percorre a tabela, por isso um
+    # DELETE ... IN por bloco em vez de um por produto
+    ids = [p.id for p in products]
+    for i in range(0, len(ids), _DELETE_CHUNK):
+        db.execute(
+            text("DELETE FROM products_fts WHERE product_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"ids": ids[i:i + _DELETE_CHUNK]},
+        )
+    rows = [
+        {
+            "id": p.id,
+            "name": p.name or "",
+            "description": p.description or "",
+            "category": p.category or "",
+        }
+        for p in products
+        if p.active
+    ]
+    if rows:
+        db.execute(
+            text(
+                "INSERT INTO products_fts (product_id, name, description, category) "
+                "VALUES (:id, :name, :description, :category)"
+            ),
+            rows,
+        )
+
+
+def buscar_produtos(db: Session, q: str, limit: int = 20) -> List[Product]:
+    """
+    Produtos activos que casam com todos os termos (prefixo, p/ typeahead),
+    ordenados por relevância.
+    """
+    tokens = _tokens(q)
+    if not tokens:
+        return []
+
+    dialect = _dialect(db)
+    if dialect == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        ids = db.execute(
+            text(
+                f"SELECT product_id FROM products_fts WHERE products_fts MATCH :match "
+                f"ORDER BY {_FTS5_RANK} LIMIT :limit"
+            ),
+            {"match": match, "limit": limit},
+        ).scalars().all()
+    elif dialect == "postgresql":
+        tsquery = " & ".join(f"{t}:*" for t in tokens)
+        ids = db.execute(
+            text(
+                "SELECT id FROM products "
+                "WHERE active AND search_vector @@ to_tsquery('pt_unaccent', :tsq) "
+                "ORDER BY ts_rank(search_vector, to_tsquery('pt_unaccent', :tsq)) DESC "
+                "LIMIT :limit"
+            ),
+            {"tsq": tsquery, "limit": limit},
+        ).scalars().all()
+    else:
+        # mesmas colunas do índice FTS: cada termo em qualquer delas
+        like = db.query(Product.id).filter(Product.active == True)
+        for t in tokens:
+            like = like.filter(or_(*(col.ilike(f"%{t}%") for col in _COLUNAS_BUSCA)))
+        ids = [row.id for row in like.limit(limit).all()]
+
+    if not ids:
+        return []
+
+    by_id = {
+        p.id: p
+        for p in db.query(Product).filter(Product.id.in_(ids), Product.active == True).all()
+    }
+    return [by_id[i] for i in ids if i in by_id]
@@ -0,0 +1,135 @@
+from typing import Any, Dict, Iterable, List, Set
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from ..models import Product
+
+_products = Product.__table__
+
+# UPDATE condicional: só baixa se ainda houver stock suficiente.
+# Executado em batch (executemany) com um conjunto de parâmetros por SKU.
+_BAIXAR_STMT = (
+    update(_products)
+    .where(_products.c.id == bindparam("b_id"))
+    .where(_products.c.stock >= bindparam("b_qty"))
+    .values(stock=_products.c.stock - bindparam("b_qty"))
+)
+
+# Igual, mas a quantidade fica "reservada" (pedido pendente com expiração)
+_RESERVAR_STMT = _BAIXAR_STMT.values(
+    reserved=func.coalesce(_products.c.reserved, 0) + bindparam("b_qty"),
+)
+
+_MAX_TENTATIVAS = 3
+
+
+def agregar_demanda(items: Iterable[Any]) -> Dict[str, int]:
+    """
+    Soma as quantidades por produto (o carrinho pode repetir o mesmo SKU).
+    Cada item precisa de `product_id` e `quantity`.
+    """
+    demanda: Dict[str, int] = {}
+    for item in items:
+        demanda[item.product_id] = demanda.get(item.product_id, 0) + int(item.quantity or 0)
+    return demanda
+
+
+def carregar_produtos(db: Session, product_ids: Iterable[str], lock: bool = True) -> Dict[str, Product]:
+    """
+    Carrega todos os produtos activos do carrinho numa única query `IN`.
+
+    Com `lock=True` usa `SELECT ... FOR UPDATE` (Postgres) ordenado por id,
+    para que pedidos concorrentes bloqueiem as linhas sempre pela mesma ordem
+    (sem deadlocks). No SQLite o FOR UPDATE é ignorado e quem garante a
+    consistência é o UPDATE condicional de `reservar_stock`.
+    """
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+
+    q = (
+        db.query(Product)
+        .filter(Product.id.in_(ids), Product.active == True)
+        .order_by(Product.id)
+    )
+    if lock:
+        q = q.with_for_update()
+
+    return {p.id: p for p in q.all()}
+
+
+def _stock_issue(product: Product, available: int, requested: int) -> Dict[str, Any]:
+    return {
+        "product_id": product.id,
+        "name": product.name,
+        "available": available,
+        "requested": requested,
+    }
+
+
+def _verificar_stock(
+    products_by_id: Dict[str, Product],
+    demanda: Dict[str, int],
+    indisponiveis: Set[str] = frozenset(),
+) -> List[Dict[str, Any]]:
+    issues: List[Dict[str, Any]] = []
+    for product_id, requested in demanda.items():
+        product = products_by_id[product_id]
+        available = 0 if product_id in indisponiveis else int(product.stock or 0)
+        if available < requested:
+            issues.append(_stock_issue(product, available, requested))
+    return issues
+
+
+def reservar_stock(
+    db: Session,
+    products_by_id: Dict[str, Product],
+    demanda: Dict[str, int],
+    reservado: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Baixa o stock de todos os SKUs do pedido num único batch de
+    `UPDATE products SET stock = stock - :n WHERE id = :id AND stock >= :n`.
+
+    Com `reservado=True` a quantidade também soma em `products.reserved`
+    (ver reservations_service: o pedido pendente segura o stock até expirar).
+
+    Retorna a lista de `stock_issues` (vazia = tudo reservado).
+
+    ⚠️ Deve ser chamado antes de qualquer outra escrita na sessão: se algum
+    SKU falhar no UPDATE condicional (outro pedido levou o stock entre o
+    SELECT e o UPDATE), a transacção é desfeita com `db.rollback()` e a
+    verificação é repetida com o stock actual.
+    """
+    stmt = _RESERVAR_STMT if reservado else _BAIXAR_STMT
+    params = [{"b_id": pid, "b_qty": qty} for pid, qty in demanda.items()]
+    sane_rowcount = db.get_bind().dialect.supports_sane_multi_rowcount
+    indisponiveis: Set[str] = set()
+
+    for _ in range(_MAX_TENTATIVAS):
+        issues = _verificar_stock(products_by_id, demanda, indisponiveis)
+        if issues:
+            return issues
+
+        if sane_rowcount:
+            updated = db.execute(stmt, params).rowcount
+        else:
+            updated = sum(db.execute(stmt, p).rowcount for p in params)
+
+        if updated == len(params):
+            # o UPDATE foi feito em Core: os objectos carregados têm o stock antigo
+            for product_id in demanda:
+                db.expire(products_by_id[product_id], ["stock", "reserved"])
+            return []
+
+        # corrida perdida: desfaz o batch parcial e recarrega o stock actual
+        db.rollback()
+        fresh = carregar_produtos(db, demanda.keys())
+        indisponiveis = set(demanda) - set(fresh)  # desactivados entretanto
+
+    db.rollback()
+    return _verificar_stock(products_by_id, demanda, indisponiveis) or [
+        _stock_issue(products_by_id[pid], int(products_by_id[pid].stock or 0), qty)
+        for pid, qty in demanda.items()
+    ]
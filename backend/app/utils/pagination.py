@@ -0,0 +1,51 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Cursor opaco (base64 url-safe) com os valores da última linha da página.
+    Ex.: encode_cursor(order.created_at, order.id)
+    """
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else str(v) for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+    return values
+
+
+def decode_datetime_cursor(cursor: str):
+    """
+    Atalho para o caso comum (created_at, id).
+    """
+    created_at, id_ = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(created_at), id_
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+
+def keyset_after(columns: Sequence[Any], values: Sequence[Any], desc: bool = True):
+    """
+    Condição "depois do cursor" para ORDER BY columns (todas DESC ou todas ASC).
+    (a, b) < (x, y)  ==>  a < x OR (a = x AND b < y)
+    """
+    clauses = []
+    for i, col in enumerate(columns):
+        prefix = [columns[j] == values[j] for j in range(i)]
+        cmp = col < values[i] if desc else col > values[i]
+        clauses.append(and_(*prefix, cmp))
+    return or_(*clauses)
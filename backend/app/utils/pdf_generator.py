@@ -3,20 +3,23 @@ from reportlab.lib.pagesizes import A6
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
 import qrcode
 import io
+import os
 
-def generate_order_pdf(order: dict) -> str:
+def generate_order_pdf(order: dict, output_dir: str = "./app/tmp") -> str:
     """
     Gera PDF do pedido com endereço e lista de produtos.
     Retorna o caminho do arquivo gerado.
     """
     order_id = order.get("id")
-    delivery_address = order.get("delivery_address", {})
+    delivery_address = order.get("delivery_address") or {}
     items = order.get("items", [])
     total_amount = order.get("total_amount", "0.00")
 
-    filename = f"./app/tmp/order_{order_id}.pdf"
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, f"order_{order_id}.pdf")
     c = canvas.Canvas(filename, pagesize=A6)
     width, height = A6
 
@@ -74,7 +77,7 @@ def generate_order_pdf(order: dict) -> str:
     img.save(img_buffer)
     img_buffer.seek(0)
 
-    c.drawInlineImage(img_buffer, width - 35*mm, 10*mm, 25*mm, 25*mm)
+    c.drawImage(ImageReader(img_buffer), width - 35*mm, 10*mm, 25*mm, 25*mm)
 
     c.showPage()
     c.save()
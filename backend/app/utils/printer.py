@@ -1,27 +1,34 @@
 import os
 import platform
+import shlex
 import subprocess
 from pathlib import Path
 
+from ..config import settings
+
+
 def print_pdf(file_path: str):
     """
     Envia PDF para a impressora padrão do sistema.
     Funciona no Windows, Linux e MacOS.
+    Em Linux/MacOS usa `settings.PRINT_COMMAND` (por omissão `lp`).
+
+    Levanta exceção se a impressão falhar (a fila de impressão trata os retries).
     """
     file_path = Path(file_path)
     if not file_path.exists():
         raise FileNotFoundError(f"Arquivo PDF não encontrado: {file_path}")
 
     system = platform.system()
-    try:
-        if system == "Windows":
-            # Windows
-            os.startfile(file_path, "print")
-        elif system == "Linux":
-            subprocess.run(["lp", str(file_path)], check=True)
-        elif system == "Darwin":
-            subprocess.run(["lp", str(file_path)], check=True)
-        else:
-            raise OSError("Sistema operacional não suportado para impressão direta.")
-    except Exception as e:
-        print(f"Erro ao imprimir PDF: {e}")
\ No newline at end of file
+    if system == "Windows":
+        # Windows
+        os.startfile(file_path, "print")
+    elif system in ("Linux", "Darwin"):
+        cmd = shlex.split(settings.PRINT_COMMAND) + [str(file_path)]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"{cmd[0]} terminou com código {result.returncode}: {result.stderr.strip()}"
+            )
+    else:
+        raise OSError("Sistema operacional não suportado para impressão direta.")
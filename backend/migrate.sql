@@ -2,22 +2,76 @@
 ALTER TABLE users ADD COLUMN IF NOT EXISTS default_consultant_id varchar NULL;
 CREATE INDEX IF NOT EXISTS ix_users_default_consultant_id ON users(default_consultant_id);
 
+-- products
+ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved integer NOT NULL DEFAULT 0;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS sku varchar NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS ix_products_sku ON products(sku);
+CREATE INDEX IF NOT EXISTS ix_products_active_category_price ON products(active, category, price);
+CREATE INDEX IF NOT EXISTS ix_products_active_created_at ON products(active, created_at);
+
+-- products: busca full-text (português, sem acentos)
+CREATE EXTENSION IF NOT EXISTS unaccent;
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN
+    CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese);
+    ALTER TEXT SEARCH CONFIGURATION pt_unaccent
+      ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+  END IF;
+END $$;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+  GENERATED ALWAYS AS (
+    setweight(to_tsvector('pt_unaccent', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('pt_unaccent', coalesce(category, '')), 'B') ||
+    setweight(to_tsvector('pt_unaccent', coalesce(description, '')), 'C')
+  ) STORED;
+CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin(search_vector);
+
 -- orders
 ALTER TABLE orders ADD COLUMN IF NOT EXISTS paid_at timestamp NULL;
 ALTER TABLE orders ADD COLUMN IF NOT EXISTS consultant_id varchar NULL;
 ALTER TABLE orders ADD COLUMN IF NOT EXISTS ref_source varchar NULL;
 CREATE INDEX IF NOT EXISTS ix_orders_consultant_id ON orders(consultant_id);
 CREATE INDEX IF NOT EXISTS ix_orders_paid_at ON orders(paid_at);
+CREATE INDEX IF NOT EXISTS ix_orders_user_created_at ON orders(user_id, created_at);
 
 -- commission_records
 ALTER TABLE commission_records ADD COLUMN IF NOT EXISTS status varchar NOT NULL DEFAULT 'pending';
 ALTER TABLE commission_records ADD COLUMN IF NOT EXISTS rate numeric(6,4) NULL;
 ALTER TABLE commission_records ADD COLUMN IF NOT EXISTS eligible_at timestamp NULL;
 ALTER TABLE commission_records ADD COLUMN IF NOT EXISTS payout_id varchar NULL;
+ALTER TABLE commission_records ADD COLUMN IF NOT EXISTS rule_version integer NULL;
 
 CREATE INDEX IF NOT EXISTS ix_commission_beneficiary_status ON commission_records(beneficiary_id, status);
 CREATE INDEX IF NOT EXISTS ix_commission_order_id ON commission_records(order_id);
 CREATE INDEX IF NOT EXISTS ix_commission_payout_id ON commission_records(payout_id);
+CREATE INDEX IF NOT EXISTS ix_commission_status_eligible_at ON commission_records(status, eligible_at);
+CREATE INDEX IF NOT EXISTS ix_commission_created_at_id ON commission_records(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_commission_beneficiary_created_at ON commission_records(beneficiary_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_commission_status_created_at ON commission_records(status, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_commission_type_created_at ON commission_records(type, created_at, id);
+-- comissões pagas pelo fluxo antigo (só paid=true; ficavam eligible sem
+-- payout_id) passam a status paid, com commission_balances acertado na
+-- mesma transacção; sem isto o motor de payouts voltava a pagá-las
+BEGIN;
+UPDATE commission_balances b
+   SET total_eligible = b.total_eligible - s.total,
+       total_paid = b.total_paid + s.total,
+       updated_at = now()
+  FROM (
+    SELECT beneficiary_id, SUM(amount) AS total
+      FROM commission_records
+     WHERE status = 'eligible' AND paid IS true AND payout_id IS NULL
+     GROUP BY beneficiary_id
+  ) s
+ WHERE b.beneficiary_id = s.beneficiary_id;
+UPDATE commission_records SET status = 'paid'
+ WHERE status = 'eligible' AND paid IS true AND payout_id IS NULL;
+COMMIT;
+
+-- (um índice já criado só com status/payout_id continua válido: o WHERE do motor implica-o)
+CREATE INDEX IF NOT EXISTS ix_commission_payout_candidates ON commission_records(beneficiary_id, created_at)
+  WHERE status = 'eligible' AND payout_id IS NULL AND paid IS NOT true;
 
 DO $$
 BEGIN
@@ -35,4 +89,31 @@ ALTER TABLE payouts ADD COLUMN IF NOT EXISTS paid_at timestamp NULL;
 ALTER TABLE payouts ADD COLUMN IF NOT EXISTS method varchar NULL;
 ALTER TABLE payouts ADD COLUMN IF NOT EXISTS reference varchar NULL;
 ALTER TABLE payouts ADD COLUMN IF NOT EXISTS state varchar NOT NULL DEFAULT 'generated';
-CREATE INDEX IF NOT EXISTS ix_payout_user_period ON payouts(user_id, period_start, period_end);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS ix_payout_user_period ON payouts(user_id, period_start, period_end);
+ALTER TABLE payouts ADD COLUMN IF NOT EXISTS batch_id varchar NULL;
+CREATE INDEX IF NOT EXISTS ix_payout_batch_user ON payouts(batch_id, user_id);
+ALTER TABLE payouts ADD COLUMN IF NOT EXISTS export_id varchar NULL;
+ALTER TABLE payouts ADD COLUMN IF NOT EXISTS exported_at timestamp NULL;
+CREATE INDEX IF NOT EXISTS ix_payout_state_created_at ON payouts(state, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_payout_export_id ON payouts(export_id);
+
+-- um payout por beneficiário e período (resolver duplicados antes, se os houver)
+DROP INDEX IF EXISTS ix_payout_user_period;
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint WHERE conname = 'uq_payout_user_period'
+  ) THEN
+    ALTER TABLE payouts
+      ADD CONSTRAINT uq_payout_user_period
+      UNIQUE (user_id, period_start, period_end);
+  END IF;
+END $$;
+
+-- payout_jobs: modo incremental (watermark)
+ALTER TABLE payout_jobs ADD COLUMN IF NOT EXISTS mode varchar NOT NULL DEFAULT 'window';
+ALTER TABLE payout_jobs ADD COLUMN IF NOT EXISTS watermark_from timestamp NULL;
+ALTER TABLE payout_jobs ADD COLUMN IF NOT EXISTS watermark_at timestamp NULL;
+ALTER TABLE payout_jobs ADD COLUMN IF NOT EXISTS watermark_id varchar NULL;
+ALTER TABLE payout_jobs ADD COLUMN IF NOT EXISTS commissions_unlinked integer NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_payout_jobs_mode_status_watermark ON payout_jobs(mode, status, watermark_at);
@@ -0,0 +1,95 @@
+"""
+Benchmark do catálogo em cache (GET /products/).
+
+Compara, pelo stack ASGI completo (TestClient):
+- miss: cache invalidada antes de cada pedido (SELECT + serialização)
+- hit:  JSON pré-serializado servido da memória
+- 304:  If-None-Match com o ETag actual
+
+Uso (a partir de backend/):
+    python scripts/bench_catalog.py
+    BENCH_PRODUCTS=5000 BENCH_REQUESTS=2000 python scripts/bench_catalog.py
+"""
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, get_db  # importar antes de models (import circular)
+from app import models
+from app.routers import products_routes
+from app.services.catalog_cache_service import invalidar_catalogo
+
+PRODUCTS = int(os.getenv("BENCH_PRODUCTS", "1000"))
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "1000"))
+
+
+def _seed(Session):
+    db = Session()
+    try:
+        db.add_all([
+            models.Product(
+                name=f"Produto {i}",
+                description="Descrição de teste " * 5,
+                price=Decimal("199.90"),
+                cost=Decimal("99.90"),
+                stock=100,
+                category=f"Categoria {i % 20}",
+                active=True,
+            )
+            for i in range(PRODUCTS)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run(client, label, headers=None, invalidate=False, expect=200):
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        if invalidate:
+            invalidar_catalogo()
+        r = client.get("/products/", headers=headers or {})
+        assert r.status_code == expect, r.status_code
+    elapsed = time.perf_counter() - started
+    print(f"{label:<6} {REQUESTS / elapsed:>10.1f} req/s   ({elapsed * 1000 / REQUESTS:.2f} ms/req)")
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "bench_catalog.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    _seed(Session)
+
+    def _get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(products_routes.router, prefix="/products")
+    app.dependency_overrides[get_db] = _get_db
+    client = TestClient(app)
+
+    first = client.get("/products/")
+    etag = first.headers["ETag"]
+    print(f"products: {PRODUCTS}   body: {len(first.content) / 1024:.0f} KiB   requests: {REQUESTS}")
+
+    _run(client, "miss", invalidate=True)
+    _run(client, "hit")
+    _run(client, "304", headers={"If-None-Match": etag}, expect=304)
+
+
+if __name__ == "__main__":
+    main()
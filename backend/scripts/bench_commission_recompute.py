@@ -0,0 +1,125 @@
+"""
+Benchmark do recálculo de comissões em lote.
+
+Cria uma rede de consultores (3 níveis) e N pedidos pagos, metade já com
+comissões antigas (taxa diferente), e corre:
+- dry-run (só diff)
+- escrita
+- segunda passagem (tudo unchanged)
+
+Uso (a partir de backend/):
+    python scripts/bench_commission_recompute.py
+    BENCH_ORDERS=200000 python scripts/bench_commission_recompute.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base  # importar antes de models (import circular)
+from app import models
+from app.services.commission_recompute_service import recalcular_comissoes
+from app.services.commission_rules_service import recarregar_regras, semear_regras_padrao
+from app.services.referrals_service import reconstruir_rede
+
+ORDERS = int(os.getenv("BENCH_ORDERS", "50000"))
+CONSULTANTS = int(os.getenv("BENCH_CONSULTANTS", "500"))
+
+
+def _seed(Session, start):
+    db = Session()
+    try:
+        users = []
+        for i in range(CONSULTANTS):
+            users.append({
+                "id": str(uuid.uuid4()),
+                "name": f"Consultor {i}",
+                "email": f"c{i}@bench",
+                "phone": f"84{i:07d}",
+                "password_hash": "x",
+                "role": models.UserRole.consultant,
+                "level": models.UserLevel.bronze,
+                # cada consultor é indicado por um dos anteriores
+                "referred_by_id": users[(i - 1) // 3]["id"] if i else None,
+            })
+        db.execute(insert(models.User), users)
+
+        orders, commissions = [], []
+        for i in range(ORDERS):
+            order_id = str(uuid.uuid4())
+            consultant = users[i % CONSULTANTS]
+            orders.append({
+                "id": order_id,
+                "user_id": consultant["id"],
+                "consultant_id": consultant["id"],
+                "status": models.OrderStatus.paid,
+                "total_amount": Decimal("1234.57"),
+                "discount_amount": Decimal("10.00"),
+                "points_used": 0,
+                "points_earned": 0,
+                "created_at": start,
+                "paid_at": start + timedelta(seconds=i),
+            })
+            if i % 2 == 0:
+                commissions.append({
+                    "id": str(uuid.uuid4()),
+                    "beneficiary_id": consultant["id"],
+                    "order_id": order_id,
+                    "amount": Decimal("49.00"),
+                    "type": models.CommissionType.consultant,
+                    "created_at": start,
+                    "paid": False,
+                    "status": "eligible",
+                    "rate": Decimal("0.04"),
+                    "eligible_at": start,
+                })
+        for i in range(0, len(orders), 5000):
+            db.execute(insert(models.Order), orders[i:i + 5000])
+        for i in range(0, len(commissions), 5000):
+            db.execute(insert(models.CommissionRecord), commissions[i:i + 5000])
+        db.commit()
+        reconstruir_rede(db)
+        semear_regras_padrao(db)
+        recarregar_regras(db)
+    finally:
+        db.close()
+
+
+def _run(Session, label, start, end, dry_run):
+    db = Session()
+    try:
+        r = recalcular_comissoes(db, start, end, dry_run=dry_run, sample=0)
+    finally:
+        db.close()
+    print(
+        f"{label:<10} orders={r['orders']} insert={r['insert']} update={r['update']} "
+        f"void={r['void']} unchanged={r['unchanged']}   "
+        f"{r['elapsed_seconds']:.2f}s  ({r['orders_per_second']:.0f} orders/s)"
+    )
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "bench_commissions.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    start = datetime(2025, 1, 1)
+    end = start + timedelta(seconds=ORDERS + 1)
+    _seed(Session, start)
+    print(f"orders: {ORDERS}   consultants: {CONSULTANTS}")
+
+    _run(Session, "dry-run", start, end, dry_run=True)
+    _run(Session, "write", start, end, dry_run=False)
+    _run(Session, "re-run", start, end, dry_run=True)
+
+
+if __name__ == "__main__":
+    main()
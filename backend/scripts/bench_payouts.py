@@ -0,0 +1,128 @@
+"""
+Benchmark do motor de payouts (services/payouts_service.py).
+
+Cria N comissões eligible distribuídas por B beneficiários, corre
+gerar_payouts_periodo e confere:
+- soma dos payouts == soma das comissões (Decimal, ao cêntimo)
+- todas as comissões ficaram locked e ligadas a um payout
+- commission_balances bate com commission_records
+- segunda passagem não cria nada
+
+Uso (a partir de backend/):
+    python scripts/bench_payouts.py
+    BENCH_COMMISSIONS=200000 BENCH_BENEFICIARIES=5000 python scripts/bench_payouts.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base  # importar antes de models (import circular)
+from app import models
+from app.services.commission_balances_service import reconstruir_saldos, verificar_saldos
+from app.services.payouts_service import gerar_payouts_periodo
+
+COMMISSIONS = int(os.getenv("BENCH_COMMISSIONS", "1000000"))
+BENEFICIARIES = int(os.getenv("BENCH_BENEFICIARIES", "20000"))
+CHUNK = int(os.getenv("BENCH_CHUNK", "0")) or None
+BATCH = 20000
+
+
+def _seed(Session, start) -> Decimal:
+    rnd = random.Random(42)
+    db = Session()
+    try:
+        users = [{
+            "id": str(uuid.uuid4()),
+            "name": f"Consultor {i}",
+            "email": f"c{i}@bench",
+            "phone": f"84{i:07d}",
+            "password_hash": "x",
+            "role": models.UserRole.consultant,
+            "level": models.UserLevel.bronze,
+        } for i in range(BENEFICIARIES)]
+        db.execute(insert(models.User), users)
+
+        total = Decimal("0.00")
+        rows = []
+        for i in range(COMMISSIONS):
+            amount = Decimal(rnd.randint(1, 50000)) / 100
+            total += amount
+            rows.append({
+                "id": str(uuid.uuid4()),
+                "beneficiary_id": users[rnd.randrange(BENEFICIARIES)]["id"],
+                "order_id": str(uuid.uuid4()),  # FK não verificada no SQLite
+                "amount": amount,
+                "type": models.CommissionType.consultant,
+                "created_at": start + timedelta(seconds=i),
+                "paid": False,
+                "status": "eligible",
+                "rate": Decimal("0.05"),
+                "eligible_at": start,
+            })
+            if len(rows) == BATCH:
+                db.execute(insert(models.CommissionRecord), rows)
+                rows = []
+        if rows:
+            db.execute(insert(models.CommissionRecord), rows)
+        db.commit()
+        reconstruir_saldos(db, apenas_se_vazio=False)
+        return total
+    finally:
+        db.close()
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "bench_payouts.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    start = datetime(2025, 1, 1)
+    end = start + timedelta(seconds=COMMISSIONS + 1)
+
+    t = time.perf_counter()
+    expected = _seed(Session, start)
+    print(f"commissions: {COMMISSIONS}   beneficiaries: {BENEFICIARIES}   seed {time.perf_counter() - t:.1f}s")
+
+    db = Session()
+    try:
+        r = gerar_payouts_periodo(db, start, end, chunk_size=CHUNK)
+        print(
+            f"generate   payouts={r['created']} commissions={r['commissions']} chunks={r['chunks']} "
+            f"total={r['total_amount']}   {r['elapsed_seconds']:.2f}s  "
+            f"({r['commissions'] / max(r['elapsed_seconds'], 1e-9):.0f} commissions/s)"
+        )
+
+        payouts_total = db.query(func.sum(models.Payout.amount)).scalar()
+        soltas = (
+            db.query(func.count(models.CommissionRecord.id))
+            .filter((models.CommissionRecord.status != "locked") | models.CommissionRecord.payout_id.is_(None))
+            .scalar()
+        )
+        saldos = verificar_saldos(db)
+        print(
+            f"check      expected={expected} payouts={payouts_total} returned={r['total_amount']} "
+            f"unlinked={soltas} balances_ok={saldos['ok']}"
+        )
+        assert Decimal(payouts_total) == expected == Decimal(r["total_amount"])
+        assert soltas == 0 and saldos["ok"]
+
+        again = gerar_payouts_periodo(db, start, end, chunk_size=CHUNK)
+        print(f"re-run     payouts={again['created']}   {again['elapsed_seconds']:.2f}s")
+        assert again["created"] == 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark de concorrência da reserva de stock (create_order).
+
+N clientes (threads) disparam pedidos contra um único SKU "quente" até o
+stock acabar. No fim verifica que não houve oversell:
+stock final >= 0 e unidades vendidas == stock inicial - stock final.
+
+Uso (a partir de backend/):
+    python scripts/bench_stock_reservation.py
+    BENCH_DATABASE_URL=postgresql://... python scripts/bench_stock_reservation.py
+
+⚠️ Em Postgres as tabelas do benchmark são criadas na base indicada; use
+uma base descartável.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base  # importar antes de models (import circular)
+from app import models, schemas
+from app.routers.orders_routes import create_order
+
+CLIENTS = int(os.getenv("BENCH_CLIENTS", "50"))
+INITIAL_STOCK = int(os.getenv("BENCH_STOCK", "1000"))
+QTY_PER_ORDER = int(os.getenv("BENCH_QTY", "1"))
+
+
+def _engine():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return create_engine(url, pool_size=CLIENTS, max_overflow=0)
+    path = os.path.join(tempfile.mkdtemp(), "bench_stock.db")
+    return create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 60},
+    )
+
+
+def _seed(Session):
+    db = Session()
+    try:
+        product = models.Product(
+            name="SKU quente",
+            price=Decimal("100.00"),
+            cost=Decimal("50.00"),
+            stock=INITIAL_STOCK,
+            active=True,
+        )
+        users = [
+            models.User(
+                name=f"bench {i}",
+                email=f"bench{i}-{time.time_ns()}@example.com",
+                phone=f"+bench{i}-{time.time_ns()}",
+                password_hash="x",
+            )
+            for i in range(CLIENTS)
+        ]
+        db.add(product)
+        db.add_all(users)
+        db.commit()
+        return product.id, [u.id for u in users]
+    finally:
+        db.close()
+
+
+def _client(Session, product_id, user_id, stats, lock):
+    payload = schemas.OrderCreate(
+        items=[schemas.OrderItemCreate(product_id=product_id, quantity=QTY_PER_ORDER)],
+        points_to_use=0,
+    )
+    while True:
+        db = Session()
+        try:
+            user = db.get(models.User, user_id)
+            create_order(data=payload, db=db, current=user, idempotency_key=None)
+            outcome = "ok"
+        except HTTPException as e:
+            db.rollback()
+            outcome = "sold_out" if e.status_code == 409 else "error"
+        except OperationalError:
+            db.rollback()
+            outcome = "retry"  # lock/busy do SQLite: tenta de novo
+        finally:
+            db.close()
+
+        with lock:
+            stats[outcome] += 1
+        if outcome in ("sold_out", "error"):
+            return
+
+
+def main():
+    engine = _engine()
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    product_id, user_ids = _seed(Session)
+
+    stats = {"ok": 0, "sold_out": 0, "retry": 0, "error": 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_client, args=(Session, product_id, uid, stats, lock))
+        for uid in user_ids
+    ]
+
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    db = Session()
+    try:
+        final_stock = db.get(models.Product, product_id).stock
+        sold = (
+            db.query(func.coalesce(func.sum(models.OrderItem.quantity), 0))
+            .filter(models.OrderItem.product_id == product_id)
+            .scalar()
+        )
+    finally:
+        db.close()
+
+    oversell = final_stock < 0 or sold != INITIAL_STOCK - final_stock
+    print(f"dialect:          {engine.dialect.name}")
+    print(f"clients:          {CLIENTS}")
+    print(f"initial stock:    {INITIAL_STOCK}")
+    print(f"orders ok:        {stats['ok']}")
+    print(f"409 sold out:     {stats['sold_out']}")
+    print(f"busy retries:     {stats['retry']}")
+    print(f"errors:           {stats['error']}")
+    print(f"elapsed:          {elapsed:.2f}s")
+    print(f"orders/sec:       {stats['ok'] / elapsed:.1f}")
+    print(f"final stock:      {final_stock}")
+    print(f"units sold:       {sold}")
+    print(f"oversell:         {'YES' if oversell else 'no'}")
+
+    if oversell or stats["error"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
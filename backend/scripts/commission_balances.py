@@ -0,0 +1,39 @@
+"""
+Verifica / reconstrói commission_balances a partir de commission_records.
+
+Uso (a partir de backend/):
+    python scripts/commission_balances.py verify
+    python scripts/commission_balances.py rebuild
+
+Sai com código 1 se a verificação encontrar divergências.
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal  # importar antes de models (import circular)
+from app.services.commission_balances_service import reconstruir_saldos, verificar_saldos
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if cmd not in ("verify", "rebuild"):
+        raise SystemExit("uso: commission_balances.py [verify|rebuild]")
+
+    db = SessionLocal()
+    try:
+        if cmd == "rebuild":
+            print(f"rebuilt: {reconstruir_saldos(db, apenas_se_vazio=False)} beneficiários")
+        result = verificar_saldos(db)
+    finally:
+        db.close()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+`lp` falso para testar a fila de impressão sem impressora.
+
+Copia o PDF para FAKE_LP_DIR (por omissão /tmp/fake_lp). Com FAKE_LP_FAIL=1
+termina com erro, para exercitar retries/backoff.
+
+Uso:
+    PRINT_COMMAND="python scripts/fake_lp.py" uvicorn app.main:app
+"""
+import os
+import shutil
+import sys
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("uso: fake_lp.py <arquivo.pdf>", file=sys.stderr)
+        raise SystemExit(2)
+
+    if os.getenv("FAKE_LP_FAIL") == "1":
+        print("fake_lp: impressora offline", file=sys.stderr)
+        raise SystemExit(1)
+
+    out_dir = os.getenv("FAKE_LP_DIR", "/tmp/fake_lp")
+    os.makedirs(out_dir, exist_ok=True)
+    shutil.copy(sys.argv[1], out_dir)
+    print(f"request id is fake-{os.path.basename(sys.argv[1])}")
+
+
+if __name__ == "__main__":
+    main()